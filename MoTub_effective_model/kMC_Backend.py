@@ -0,0 +1,15 @@
+"""
+Backend of the kMC kernels of the model (cf. kMC_core/kMC_Backend.py)
+
+the engine is shared by the models in the kMC_core package at the root of
+the repository: this module, imported first by Tools & kMC_Library, puts the
+root on the import path of the scripts of the model (run from its directory)
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from kMC_core.kMC_Backend import BACKEND, jit, new_list
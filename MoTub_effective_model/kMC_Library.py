@@ -1,15 +1,39 @@
 """
-kMC functions for VSS method + local scan + use of list of list
-for a simple model (flux of processive 2-head motors)
+kMC functions of the effective MoTub model: its rules (enabled reactions & 
+lattice changes) plugged into the shared engine (cf. kMC_core/kMC_Engine.py) 
+for the VSS method + local scan + array-backed event lists
 """
 import numpy as np
-import Tools as tl
+from kMC_Backend import BACKEND, jit
+from kMC_core.kMC_Geometry import UP, DOWN, LEFT1, LEFT2, RIGHT1, RIGHT2, ngbr_s3, ngbr_s3_lattice
+from kMC_core.kMC_Engine import (ModelSpec, STATE, model_bins, build_event_lists, enabled_pairs, 
+    model_kernels, memo_table, random_streams, draw_events, build_rate_tree, leap_rates, insert_leaps)
 
-""" magical function to create list of list
+""" public names, with the engine functions the scripts of the model use through this module """
+__all__ = ["MODEL", "SLOT", "MEMO_SIZE", "latice_initialization", "rate_constant_initizalition",
+    "koff_index_table", "koff_reaction_table", "initialize_eventlist", "update_enabled_reaction",
+    "stencil_key", "enabled_reactions", "apply_reaction", "change_lattice", "KERNELS", "scan",
+    "rescan_sites", "update_lattice_configuration", "run_events", "leap_reactions", "BACKEND",
+    "model_bins", "memo_table", "random_streams", "draw_events", "build_rate_tree", "leap_rates",
+    "insert_leaps"]
+
+""" 122 rate constants (cf. rate_constant_initizalition) drawn reaction by 
+    reaction, a reaction changes the enabled reactions of the sites up to 3 
+    rows & 1 protofilament away, a site holds at most 1 detachment + the 
+    hydrolysis, which can be leaped (first-order, site-local)
+"""
+MODEL = ModelSpec("MoTub_effective", 122, (3, 1), 2, "reaction", (0,))
+SLOT = MODEL.slot # width of the lsre rows
+MEMO_SIZE = 8191 # entries (prime) of the memo of the enabled reactions (cf. stencil_key)
+
+""" encoding of the state of a site, stored as an int8 (STATE): 0 for a 
+    vacancy, 1 for a GDP-dimer and -1 for a GTP-dimer (nucleotide = sign), 
+    the motors and the excitation are effective (cf. kMC_Tabulation) and 
+    have no state, as in the MoTub model the state arithmetic is exact 
+    integer arithmetic
+    
+    the event structures (ersl, pos, occ, bocc) are int32 arrays (INDEX)
 """
-def mklist(n):
-    for _ in range(n):
-        yield []
 
 
 def latice_initialization(BOX_LENGTH, BOX_WIDTH, 
@@ -27,10 +51,11 @@ def latice_initialization(BOX_LENGTH, BOX_WIDTH,
         - State = 0 <=> empty site
         - State = 1 <=> tubulin-GDP
         - State = -1 <=> tubulin-GTP
+        (int8, cf. the encoding of STATE)
     """
     
     # Case 1. 
-    lattice = np.zeros((BOX_LENGTH, BOX_WIDTH))
+    lattice = np.zeros((BOX_LENGTH, BOX_WIDTH), dtype=STATE)
     lattice[:LATTICE_HEIGHT, :] = 1 
     lattice[:SEED_HEIGHT, :] = -1 
     lattice[LATTICE_HEIGHT-CAP_HEIGHT:LATTICE_HEIGHT, :] = -1 
@@ -113,117 +138,91 @@ def rate_constant_initizalition(HYDROLYSIS_TIME, k_DIMER_ATTACH,
     
     return k 
                     
-def initial_event_list_reaction(i, j, lattice, occ, ersl, lsre, TABLE_NO_DEFECT, TABLE_DEFECT, D):
+def koff_index_table(TABLE):
+    """ return the array T such that T[a, at, 2*b, 2*bt] is the index of the 
+        row [a, at, b, bt] in TABLE (the last one if repeated, -1 if absent)
     """
-    test which reactions is enabled at site at (i,j) 
-    and return the updated occ & ersl
-    """
-    l = len(lattice[:,0])
-    L = len(lattice[0,:])
-    x = int(j+i*L)
-    ##-------------------------------------------------------------------------
-    if 3 < i < l-3: 
-        ngbr = tl.ngbr_s3(i, j, lattice) ; N_ngbr = sum(ngbr)
-        a = ngbr[0] ; at = ngbr[1]
-        b = ngbr[2] ; bt = ngbr[3]
-        if lattice[i,j] == 0:
-            """ it's a defect """
-            if (0 < N_ngbr < 4 or bt > 0): 
-                """ any defect with at least one non-vacant neighbor 
-                    without a motor upstream can be incorporated a GTP-tubulin
-                """
-                occ[1] += 1
-                ersl[1].append([i,j])
-                lsre[x].append(1)
-                
-        if lattice[i,j] != 0: 
-            """ it's a tubulin dimer
-            """
-            if a+at != 1: 
-                """ it's a dimer far from defect or isolated dimer """
-                found = False
-                ind = len(TABLE_NO_DEFECT[:,0])-1
-                while not(found): 
-                    """ searching for the corresponding koff index"""
-                    if np.all([a,at,b,bt] == TABLE_NO_DEFECT[ind,:]):
-                        found = True
-                    else: 
-                        ind -= 1 
-                occ[2+ind] += 1
-                ersl[2+ind].append([i, j])
-                lsre[x].append(2+ind)
+    T = np.full((3, 3, 5, 5), -1, dtype=int)
+    for ind in range(len(TABLE[:,0])): 
+        a, at, b, bt = TABLE[ind,:]
+        T[int(a), int(at), int(2*b), int(2*bt)] = ind
+    return T
 
-            elif lattice[i+D, j] == 0: 
-                """ there's a defect upstream """  
-                found = False
-                ind = len(TABLE_DEFECT[:,0])-1
-                while not(found): 
-                    """ searching for the corresponding koff index"""
-                    if np.all([a,at,b,bt] == TABLE_DEFECT[ind,:]):
-                        found = True
-                    else: 
-                        ind -= 1 
-                occ[2+60+ind] += 1
-                ersl[2+60+ind].append([i, j])
-                lsre[x].append(2+60+ind)
-
-                
-            elif lattice[i-D, j] == 0: 
-                """ there's a defect downstream """  
-                found = False
-                ind = len(TABLE_DEFECT[:,0])-1
-                while not(found): 
-                    """ searching for the corresponding koff index"""
-                    if np.all([a,at,b,bt] == TABLE_DEFECT[ind,:]):
-                        found = True
-                    else: 
-                        ind -= 1 
-                occ[2+60+30+ind] += 1
-                ersl[2+60+30+ind].append([i, j])
-                lsre[x].append(2+60+30+ind)
 
-        
-        if lattice[i, j] < 0 and lattice[i+1, j] != 0:
-            """ it's a GTP-tubulin incorporated within the lattice """
-            occ[0] += 1
-            ersl[0].append([i,j])
-            lsre[x].append(0)
-                       
-    return (occ, ersl, lsre)
+def koff_reaction_table(TABLE_NO_DEFECT, TABLE_DEFECT):
+    """ compile the koff tables into the direct-address table KOFF such that 
+        KOFF[c, a, at, 2*b, 2*bt] is the detachment reaction of a dimer with 
+        the neighbor counts (a, at, b, bt), for c = 0 far from a defect and 
+        c = 1 (resp. 2) with a defect upstream (resp. downstream), 
+        -1 for a configuration absent from the tables
+    """
+    ind_no_defect = koff_index_table(TABLE_NO_DEFECT)
+    ind_defect = koff_index_table(TABLE_DEFECT)
+    KOFF = np.full((3, 3, 3, 5, 5), -1, dtype=int)
+    KOFF[0] = np.where(ind_no_defect >= 0, 2+ind_no_defect, -1)
+    KOFF[1] = np.where(ind_defect >= 0, 2+60+ind_defect, -1)
+    KOFF[2] = np.where(ind_defect >= 0, 2+60+30+ind_defect, -1)
+    return KOFF
 
 
-def initialize_eventlist(lat, Nbr_reac, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY): 
-    """ initialize the occurence array and the ersl list and lsre list
+def initialize_eventlist(lat, geo, bins, KOFF, DIRECTIONALITY): 
+    """ initialize the occurence arrays and the ersl list and lsre list
         occ[i] = # of site that enable the reaction i 
-        ersl[j] = list of the enable site positions for reaction j 
-        lsre[k] = inverse of ersl = list of the reaction enable for site with index k 
+        bocc[g] = # of enabled pairs (reaction, site) of the bin g, 
+                  i.e. occ[g] as every bin holds one reaction (cf. MODEL)
+        ersl[g] = array of the enabled pairs x*Nr + reac of the bin g, 
+                  only its bocc[g] first entries are meaningful
+        lsre[k] = sorted reactions enabled for the site of flat index k, 
+                  padded with -1 up to SLOT slots
+        pos[k,s] = position of the pair (lsre[k,s], k) in its ersl array
+        the enabled reactions are tested on the whole lattice at once 
     """
+    l = len(lat[:,0])
     D = DIRECTIONALITY
-    occ = np.zeros(Nbr_reac) 
-    ersl = list(mklist(Nbr_reac))                                                     
-    lsre = list(mklist(len(lat[:,0])*len(lat[0,:])))
+    active = np.zeros(lat.shape, dtype=bool)
+    active[4:l-3] = True
     
-    L = len(lat[0,:])
-    l = len(lat[:,0])
-
-    for i in range(l):
-        for j in range(L):
-            occ, ersl, lsre = initial_event_list_reaction(i, j, lat, occ, ersl, lsre, TABLE_NO_DEFECT, TABLE_DEFECT, D)
-    return (occ, ersl, lsre)
+    """ a vacancy counts its GDP & GTP neighbors apart as a GTP-dimer, b & bt 
+        are numbers of lateral half-contacts
+    """
+    a, at, b, bt = ngbr_s3_lattice(lat, geo, lat <= 0)
+    N_ngbr = a + at + (b + bt)/2
+    key = (a, at, b, bt)
+    
+    up = np.roll(lat, -1, axis=0)             # lattice[i+1,j]
+    front = np.roll(lat, -D, axis=0)          # lattice[i+D,j]
+    back = np.roll(lat, D, axis=0)            # lattice[i-D,j]
+    dimer = lat != 0
+    near_defect = dimer & (a+at == 1)
+    
+    enabled = [
+        ((lat == 0) & (((0 < N_ngbr) & (N_ngbr < 4)) | (bt > 0)), 1), 
+        (dimer & (a+at != 1), KOFF[0][key]), 
+        (near_defect & (front == 0), KOFF[1][key]), 
+        (near_defect & (front != 0) & (back == 0), KOFF[2][key]), 
+        ((lat < 0) & (up != 0), 0), 
+    ]
+    X, R = enabled_pairs(lat, enabled, active)
+    return build_event_lists(X, R, bins, lat.size, SLOT)
 
 
 
-def update_enabled_reaction(i, j, lattice, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY):
+@jit
+def update_enabled_reaction(i, j, lattice, geo, KOFF, DIRECTIONALITY):
     """ test which reactions are enabled for the site (i, j)
     """
     lsre_x = []  
+    x = j + i*len(lattice[0,:])
+    flat = lattice.reshape(-1)
     l = len(lattice[:,0])
     D = DIRECTIONALITY
      
     if 3 < i < l-3: 
-        ngbr = tl.ngbr_s3(i, j, lattice) ; N_ngbr = sum(ngbr)
+        """ b & bt are numbers of lateral half-contacts """
+        ngbr = ngbr_s3(x, flat, geo, flat[x] <= 0) 
         a = ngbr[0] ; at = ngbr[1]
         b = ngbr[2] ; bt = ngbr[3]
+        N_ngbr = a + at + (b + bt)/2
         if lattice[i,j] == 0:
             """ it's a defect """
             if (0 < N_ngbr < 4 or bt > 0): 
@@ -233,137 +232,64 @@ def update_enabled_reaction(i, j, lattice, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECT
                 lsre_x.append(1)
                 
         if lattice[i,j] != 0: 
-            """ it's a tubulin dimer
+            """ it's a tubulin dimer, its koff index is read in the 
+                direct-address table KOFF
             """
             if a+at != 1: 
                 """ it's a dimer far from defect or isolated dimer """
-                found = False
-                ind = len(TABLE_NO_DEFECT[:,0])-1
-                while not(found): 
-                    """ searching for the corresponding koff index"""
-                    if np.all([a,at,b,bt] == TABLE_NO_DEFECT[ind,:]):
-                        found = True
-                    else: 
-                        ind -= 1 
-                lsre_x.append(2+ind)
+                lsre_x.append(KOFF[0, a, at, b, bt])
 
             elif lattice[i+D, j] == 0: 
                 """ there's a defect upstream """  
-                found = False
-                ind = len(TABLE_DEFECT[:,0])-1
-                while not(found): 
-                    """ searching for the corresponding koff index"""
-                    if np.all([a,at,b,bt] == TABLE_DEFECT[ind,:]):
-                        found = True
-                    else: 
-                        ind -= 1 
-                lsre_x.append(2+60+ind)
+                lsre_x.append(KOFF[1, a, at, b, bt])
 
-                
             elif lattice[i-D, j] == 0: 
                 """ there's a defect downstream """  
-                found = False
-                ind = len(TABLE_DEFECT[:,0])-1
-                while not(found): 
-                    """ searching for the corresponding koff index"""
-                    if np.all([a,at,b,bt] == TABLE_DEFECT[ind,:]):
-                        found = True
-                    else: 
-                        ind -= 1 
-                lsre_x.append(2+60+30+ind)
+                lsre_x.append(KOFF[2, a, at, b, bt])
 
         if lattice[i, j] < 0 and lattice[i+1, j] != 0:
             """ it's a GTP-tubulin incorporated within the lattice """
             lsre_x.append(0)   
 
     return lsre_x
-#-------------------------------------------------------------------------------
-#-------------------------------------------------------------------------------
-def scan(lsre, ersl, occ, loc, lat, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY):
-    """ scan the neighborhood around the location (i,j) of the new reaction site 
-    to update the enable reaction site list (ersl) + occurence vector (occ)
-    
-    the size of the scan region is determined by its half_width and half_length
-    as ( 2 half_width + 1 x 2 half_lenght + 1)
+
+
+@jit
+def stencil_key(X, lat, geo, rules):
+    """ return the pattern of the stencil read by update_enabled_reaction at 
+    the site of flat index X: the states of the site and of its neighbors 
+    UP, DOWN (the sites i+D & i-D of its protofilament) & LATERAL (across 
+    the seam as read by ngbr_s3), packed 2 bits each (state + 1), or -1 out 
+    of the active rows (no enabled reaction)
+    the enabled reactions only depend on this pattern (cf. 
+    kMC_Kernels.rescan_window)
     """
-    
-    i = int(loc[0])    
-    j = int(loc[1])    
-    l = len(lat[:,0]) 
-    L = len(lat[0,:]) 
-    
-    half_length = 3
-    half_width = 1
-    
-    for I in range(i-half_length,i+half_length+1):
-        for J in range(j-half_width,j+half_width+1):
-            I = I%l ; J = J%L
-            lsre_x = update_enabled_reaction(I, J, lat, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY)
-            lsre_x.sort()
-            X = int(J+I*L)
-            lsre[X].sort()
-            
-            """ check if the enabled reaction list at index x is different
-            from the previous one
-            
-            if it is than update all the eventlist (occ, ersl, lsre) at this 
-            index 
-            """
-            if lsre_x != lsre[X]: 
-                """ add new enabled reaction     
-                """
-                for k in range(len(lsre_x)):
-                    """ if reactions not already enabled then add them
-                    """
-                    if lsre[X].count(lsre_x[k]) == 0: # 
-                        occ[lsre_x[k]] += 1
-                        ersl[lsre_x[k]].append([I,J])
-                        
-                """ if reactions are not anymore enabled then revome them
-                """
-                for k in range(len(lsre[X])):
-                    if lsre_x.count(lsre[X][k]) == 0: 
-                        occ[lsre[X][k]] -= 1
-                        ersl[lsre[X][k]].remove([I,J])
-                        
-                """ update the lsre list 
-                """
-                lsre[X] = lsre_x
-    return (occ, ersl, lsre)
+    l = len(lat[:,0]) ; L = len(lat[0,:])
+    i = X//L
+    if not 3 < i < l-3: 
+        return -1
+    flat = lat.reshape(-1)
+    key = int(flat[X]) + 1
+    for n in (UP, DOWN, LEFT1, LEFT2, RIGHT1, RIGHT2): 
+        key = key*4 + int(flat[geo[n,X]]) + 1
+    return key
 
 
-def next_reaction_draw(k, occ, r):
-    """ compute a probability for each reaction, and select 1 at random
-        return the normalization factor & next reaction type
+@jit
+def enabled_reactions(X, lat, geo, rules):
+    """ return the reactions enabled at the site of flat index X (rule of the 
+    kernels, cf. kMC_Engine.model_kernels), rules = (KOFF, DIRECTIONALITY)
     """
-    Nr = len(k)      
-    kn = np.multiply(k, occ)  
-    P = np.zeros(Nr)
-    for i in range(Nr):
-        """ non-normalized cummulative probability 
-        to define intervals for each reaction
-        """
-        P[i] = np.sum(kn[0:(i+1)%(Nr+1)]) 
-    C = np.sum(kn) # Normalizing factor
-    Pn = np.zeros(Nr+1) 
-    for i in range(Nr):
-        """ normalized cummulative probability interval
-        """
-        Pn[i+1]= P[i]/C
-    for i in range(0,Nr):
-        if Pn[i] <= r < Pn[i+1]: 
-            """ next reaction will be reaction n°i
-            """
-            reac = i  
-    return (C, reac)
+    L = len(lat[0,:])
+    return update_enabled_reaction(X//L, X%L, lat, geo, rules[0], rules[1])
 
 
-def update_lattice_configuration(lat, occ, ersl, lsre, reac, loc, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY):
-    """ change the lattice configuration with new reaction 
-        and create corresponding event lists (ersl + occ + lsre)
+@jit
+def apply_reaction(lat, reac, loc):
+    """ change the lattice configuration with the reaction reac at the site
+        of flat index loc, the event lists are left untouched
     """
-    x = int(loc[0])
-    y = int(loc[1])
+    x = loc//len(lat[0,:]) ; y = loc%len(lat[0,:])
              
     if reac == 0: 
         """ The GTP-dimer get hydrolized 
@@ -379,10 +305,21 @@ def update_lattice_configuration(lat, occ, ersl, lsre, reac, loc, TABLE_NO_DEFEC
         """ the dimer detaches from the lattice 
         """
         lat[x,y] = 0      
+    return lat
+
 
-    """ create the new ersl + occ 
+@jit
+def change_lattice(lat, reac, loc, rules):
+    """ change the lattice configuration with the reaction reac at the site 
+        of flat index loc, rule of the kernels (cf. kMC_Engine.model_kernels)
     """
-    occ, ersl, lsre = scan(lsre, ersl, occ, loc, lat, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY)
-    return (lat, occ, ersl, lsre)
+    return apply_reaction(lat, reac, loc)
 
 
+""" scan, event loop & leap mode of the model """
+KERNELS = model_kernels(MODEL, enabled_reactions, change_lattice, stencil_key)
+scan = KERNELS.scan
+rescan_sites = KERNELS.rescan_sites
+update_lattice_configuration = KERNELS.update_lattice_configuration
+run_events = KERNELS.run_events
+leap_reactions = KERNELS.leap_reactions
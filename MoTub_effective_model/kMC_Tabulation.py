@@ -0,0 +1,181 @@
+"""
+Description:
+cached & interpolated lookup of the tables of detachment probabilities
+(cf. Motor_flow_model/kMC_Tabulation.py for their generation)
+
+the text tables <motor>_taur_<taur>_theta_<theta>_tabulation_detachment_probabilities.dat
+of a motor are converted once into one binary array <motor>_tabulation.npy
+of shape (taur, theta, rho, 7), each row being
+    taur theta rho cg_ND ce_ND cg_D ce_D
+with the rows of a motor without motor (rho = 0: cg = 1, ce = 0) prepended.
+The cache is keyed on the file names & contents of the tables (tables_key,
+written next to it in <motor>_tabulation.json) and rebuilt when a table
+changes or a table is added or removed, and it is opened as a memory map, so
+a run or a sweep of runs only reads the few rows it needs
+
+the probabilities are interpolated for any rho of [0, max rho of the tables]
+with the monotone cubic (PCHIP) of the column along rho, and for any taur
+and theta of the tabulated ranges linearly in log(taur) & log(theta). At a
+tabulated point the interpolation returns the tabulated values exactly. The
+effective constants LAMBDA = cg + ce*exp(DGp) follow for any DGp
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+TABLE_SUFFIX = "_tabulation_detachment_probabilities.dat"
+DIRECTORY = os.path.dirname(os.path.abspath(__file__)) # directory of the tables & caches
+_caches = {} # opened caches, path: (key of the tables, memory map)
+
+
+def table_files(motor, directory=DIRECTORY):
+    """ return the tables of the motor as {(taur, theta): path} """
+    pattern = re.compile(re.escape(motor) + r"_taur_(.+)_theta_(.+)" + re.escape(TABLE_SUFFIX) + "$")
+    tables = {}
+    for path in glob.glob(os.path.join(glob.escape(directory), motor + "_taur_*" + TABLE_SUFFIX)):
+        match = pattern.match(os.path.basename(path))
+        if match is not None:
+            tables[(float(match.group(1)), float(match.group(2)))] = path
+    return tables
+
+
+def build_cache(tables):
+    """ return the cache array of the tables {(taur, theta): path} """
+    taurs = sorted(set(taur for taur, theta in tables)) ; thetas = sorted(set(theta for taur, theta in tables))
+    if len(taurs)*len(thetas) != len(tables):
+        raise ValueError("the tables do not cover a full (taur, theta) grid: %s" % sorted(tables))
+    rhos = None
+    for (taur, theta), path in tables.items():
+        table = np.loadtxt(path, ndmin=2)
+        if rhos is None:
+            rhos = table[:,0]
+            cache = np.zeros((len(taurs), len(thetas), len(rhos) + 1, 7))
+        elif not np.array_equal(table[:,0], rhos):
+            raise ValueError("the densities of %s differ from the other tables" % path)
+        a = taurs.index(taur) ; b = thetas.index(theta)
+        cache[a, b, :, 0] = taur ; cache[a, b, :, 1] = theta
+        cache[a, b, 0, 2:] = (0., 1., 0., 1., 0.)
+        cache[a, b, 1:, 2:] = table
+    return cache
+
+
+def tables_key(tables):
+    """ return the key of the tables {(taur, theta): path}: sha1 of their file
+        names and contents, in the order of the names
+    """
+    sha = hashlib.sha1()
+    for path in sorted(tables.values(), key=os.path.basename):
+        with open(path, "rb") as f:
+            content = f.read()
+        for part in (os.path.basename(path).encode(), content):
+            sha.update(b"%d:" % len(part) + part)
+    return sha.hexdigest()
+
+
+def load_cache(motor, directory=DIRECTORY):
+    """ return the cache of the motor (memory map), built or rebuilt from
+        its tables when the key of the cache is not the one of the tables
+    """
+    tables = table_files(motor, directory)
+    if not tables:
+        raise ValueError("no table of detachment probabilities for the motor %s in %s" % (motor, directory))
+    path = os.path.join(directory, motor + "_tabulation.npy")
+    key_path = os.path.join(directory, motor + "_tabulation.json")
+    key = tables_key(tables)
+    if path in _caches and _caches[path][0] == key:
+        return _caches[path][1]
+
+    cache = None
+    try:
+        with open(key_path) as f:
+            if json.load(f)["key"] == key:
+                cache = np.load(path, mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        """ no cache, or a cache left unfinished """
+        pass
+    if cache is None:
+        cache = build_cache(tables)
+        try:
+            """ written in temporary files then renamed, as the checkpoints,
+                the key last so that it never tells a stale cache
+            """
+            tmp = path + ".tmp.npy"
+            np.save(tmp, cache)
+            os.replace(tmp, path)
+            tmp = key_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"key": key, "tables": sorted(os.path.basename(table) for table in tables.values())}, f)
+            os.replace(tmp, key_path)
+        except OSError:
+            """ read-only directory: the cache is only kept in memory """
+            return cache
+        cache = np.load(path, mmap_mode="r")
+    _caches[path] = (key, cache)
+    return cache
+
+
+def pchip(x, y, x0):
+    """ return the monotone cubic Hermite interpolation (Fritsch-Carlson) at
+        x0 of the columns of y (shape (len(x), c)) sampled at the increasing x
+    """
+    h = np.diff(x) ; delta = np.diff(y, axis=0)/h[:,None]
+    d = np.zeros(y.shape)
+    if len(x) == 2:
+        d[:] = delta
+    else:
+        """ interior slopes: weighted harmonic mean of the secants, 0 at an extremum """
+        w1 = (2*h[1:] + h[:-1])[:,None] ; w2 = (h[1:] + 2*h[:-1])[:,None]
+        same = delta[:-1]*delta[1:] > 0
+        d[1:-1][same] = ((w1 + w2)/(w1/np.where(same, delta[:-1], 1) + w2/np.where(same, delta[1:], 1)))[same]
+        """ end slopes: non-centered 3-point formula kept shape preserving """
+        for e, h0, h1, d0, d1 in ((0, h[0], h[1], delta[0], delta[1]), (-1, h[-1], h[-2], delta[-1], delta[-2])):
+            s = ((2*h0 + h1)*d0 - h0*d1)/(h0 + h1)
+            s[np.sign(s) != np.sign(d0)] = 0
+            steep = (np.sign(d0) != np.sign(d1)) & (np.abs(s) > 3*np.abs(d0))
+            s[steep] = 3*d0[steep]
+            d[e] = s
+    k = min(max(np.searchsorted(x, x0, "right") - 1, 0), len(x) - 2)
+    t = (x0 - x[k])/h[k]
+    return ((2*t**3 - 3*t**2 + 1)*y[k] + (t**3 - 2*t**2 + t)*h[k]*d[k]
+            + (-2*t**3 + 3*t**2)*y[k+1] + (t**3 - t**2)*h[k]*d[k+1])
+
+
+def log_weight(axis, value, name):
+    """ return (a, b, w) such that value is interpolated as (1-w)*[a] + w*[b]
+        linearly in log along the increasing axis
+    """
+    if not axis[0] <= value <= axis[-1]:
+        raise ValueError("%s = %g is out of the tabulated range [%g, %g]" % (name, value, axis[0], axis[-1]))
+    if len(axis) == 1:
+        return (0, 0, 0.)
+    a = min(np.searchsorted(axis, value, "right") - 1, len(axis) - 2)
+    return (a, a + 1, (np.log(value) - np.log(axis[a]))/(np.log(axis[a+1]) - np.log(axis[a])))
+
+
+def detachment_probabilities(motor, rho, taur, theta, directory=DIRECTORY):
+    """ return (cg_ND, ce_ND, cg_D, ce_D) interpolated at (rho, taur, theta) """
+    cache = load_cache(motor, directory)
+    rhos = np.asarray(cache[0, 0, :, 2])
+    if not 0 <= rho <= rhos[-1]:
+        raise ValueError("rho = %g is out of the tabulated range [0, %g]" % (rho, rhos[-1]))
+    a0, a1, u = log_weight(np.asarray(cache[:, 0, 0, 0]), taur, "taur")
+    b0, b1, v = log_weight(np.asarray(cache[0, :, 0, 1]), theta, "theta")
+
+    def at(a, b):
+        return pchip(rhos, np.asarray(cache[a, b, :, 3:]), rho)
+
+    c = (1 - u)*((1 - v)*at(a0, b0) + v*at(a0, b1)) + u*((1 - v)*at(a1, b0) + v*at(a1, b1))
+    return tuple(float(ci) for ci in c)
+
+
+def lambda_coefficients(motor, rho, taur, theta, DGp, directory=DIRECTORY):
+    """ return the effective constants (LAMBDA_NO_DEFECT, LAMBDA_DEFECT) of
+        the dimer detachment, 1 without motor
+    """
+    if rho == 0:
+        return (1, 1)
+    cg_ND, ce_ND, cg_D, ce_D = detachment_probabilities(motor, rho, taur, theta, directory)
+    return (cg_ND + ce_ND*np.exp(DGp), cg_D + ce_D*np.exp(DGp))
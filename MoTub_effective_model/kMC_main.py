@@ -1,177 +1,305 @@
 """
 Created on May 202
 @author: William Lecompte
-Description: 
-kMC simulation based on the VSS method for modelling 
+Description:
+kMC simulation based on the VSS method for modelling
 a simple 2-head motors walk along a 2D lattice + local scan + list of list
+
+Usage:
+    python kMC_main.py [parameters.json] [--set KEY=VALUE ...] [--visualise]
+
+the run is headless unless --visualise is given, matplotlib is only imported
+in that case. With EVENT_LOG set, the reaction, the site and the waiting time
+of every event are streamed to a binary log (cf. kMC_EventLog). The frames of
+--visualise are drawn every VISU_TIME of simulated time (cf. kMC_Scheduler).
+With LEAP_TOLERANCE > 0, the hydrolysis is not selected one by one but fired
+together at fixed leaps of time (approximate mode, cf. kMC_Kernels.leap_reactions
+in kMC_core)
 """
+import argparse
+import json
 import numpy as np
-import random as rd
 import time
-import matplotlib.pyplot as plt
 import kMC_Library as kMC
+import kMC_EventLog as evlog
+import kMC_Scheduler as sched
+import kMC_Tabulation as tab
 import Tools as tl
 
-  
+""" Default parameters for initial lattice configuration
+    and for the MoTub model, a parameter file (json) and the --set KEY=VALUE
+    options override them
+"""
+PARAMETERS = {
+    "SEED": 18, # Seed initialization, an int or [entropy, spawn key...] (cf. kMC_Library.random_streams)
+    "TICK_MAX": 1*10**4, # Stop condiontion on loops
+    "VISU_TIME": 0.1, # simulated time between 2 frames [s]
+
+    "BOX_LENGTH": 125*1,
+    "BOX_WIDTH": 13,
+    "SEAM_START": 3, # helix start number, the seam shifts the protofilaments by SEAM_START/2 dimers
+    "LATTICE_HEIGHT": None, # None for int(0.5*BOX_LENGTH)
+    "SEED_HEIGHT": 3,
+    "CAP_HEIGHT": 3,
+
+    "HYDROLYSIS_TIME": 5/3, # in s
+    "k_DIMER_ATTACH": 20, # in s-1
+    "RELAXATION_TIME": 0.1, # in s
+
+    "TOTAL_BINDING_ENERGY_GDP_TUBULIN": 45, # in kT
+    "ANISOTROPY": 0.5,
+    "CONSTRAST": 1.28,
+
+    # Motor characteristics
+    "motor": "kinesin", # kinesin (m = +1, + end directed) or dynein (m = -1)
+    "rho": 0.0, # steady-density of motors, any value up to the largest tabulated one
+    "taur": .1, # relaxation time [s]
+    "theta": 100, # omega'_d = theta x omega_d
+    "DGp": 1, # motor penalty [kT]
+    "LEAP_TOLERANCE": 0, # approximate leap mode of the hydrolysis, leap time = LEAP_TOLERANCE/k0, 0 for the exact kMC
+
+    "EVENT_LOG": None, # path of the binary log of every event (cf. kMC_EventLog), None for no log
+}
+
+EVENT_BLOCK = 10**4 # number of events per call of the kMC kernel for a headless run
+
+
+def load_parameters(path=None, overrides=()):
+    """ return the default parameters updated with the parameter file (json)
+        at path and then with the "KEY=VALUE" strings of overrides,
+        a VALUE is read as json (a plain string otherwise)
+    """
+    P = dict(PARAMETERS)
+    updates = []
+    if path is not None:
+        with open(path) as f:
+            updates += list(json.load(f).items())
+    for item in overrides:
+        key, _, value = item.partition("=")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        updates.append((key.strip(), value))
+    for key, value in updates:
+        if key not in P:
+            raise KeyError("unknown parameter %s" % key)
+        P[key] = value
+    return P
+
+
 def forceAspect(ax,aspect):
     im = ax.get_images()
     extent =  im[0].get_extent()
     ax.set_aspect(abs((extent[1]-extent[0])/(extent[3]-extent[2]))/aspect)
 
-t_init = time.time()
-rd.seed(18) # Seed initialization 
-tick_max = 1*10**4 # Stop condiontion on loops 
-time_step = np.zeros(tick_max)
-""" Parameters for initial lattice configuration 
-     and for the MoTub model 
-"""
-t = 0 # Initial time
-BOX_LENGTH = 125*1
-BOX_WIDTH = 13 
-LATTICE_HEIGHT = int(0.5*BOX_LENGTH)
-SEED_HEIGHT = 3
-CAP_HEIGHT = 3
-
-DEFECT_X_POSITION = int(0.5*LATTICE_HEIGHT)
-DEFECT_Y_POSITION = int(0.5*BOX_WIDTH)
-
-Nr = 2 + 60 + 30*2 # Nbr of rate constants
-k_MOTOR_DETACH = 1 # in s-1 
-ENHANCED_FACTOR = 100  
-MOTOR_DENSITY = 0 # motor density
-k_MOTOR_ATTACH = tl.attachment_rate_cte(MOTOR_DENSITY, k_MOTOR_DETACH, 0) 
-k_WALK = 100 # in s-1
-
-HYDROLYSIS_TIME = 5/3 # in s
-k_DIMER_ATTACH = 20 # in s-1
-RELAXATION_TIME = 0.1 # in s
-
-TOTAL_BINDING_ENERGY_GDP_TUBULIN = 45 # in kT
-ANISOTROPY = 0.5
-LONGITUDINAL_ENERGY_GDP_TUBULIN = (1/(2*(1+ANISOTROPY)))*TOTAL_BINDING_ENERGY_GDP_TUBULIN
-LATERAL_ENERGY_GDP_TUBULIN = ANISOTROPY*LONGITUDINAL_ENERGY_GDP_TUBULIN
-
-CONSTRAST = 1.28 
-STABILIZATION_GTP_TUBULIN = 0.5*(CONSTRAST-1)*TOTAL_BINDING_ENERGY_GDP_TUBULIN
-LONGITUDINAL_ENERGY_GTP_TUBULIN = LONGITUDINAL_ENERGY_GDP_TUBULIN + STABILIZATION_GTP_TUBULIN
-LATERAL_ENERGY_GTP_TUBULIN = LATERAL_ENERGY_GDP_TUBULIN
-
-""" Motor characteristics """ 
-motor = "kinesin"
-if  motor == "kinesin":
-    DIRECTIONALITY = +1 # directionality of the motor, m = 1 (resp. -1) for + end (resp - end) 
-elif motor == "dynein":
-    DIRECTIONALITY = -1
-rho = 0.0  # steady-density of motors
-taur = .1 # relaxation time [s]
-theta = 100 # omega'_d = theta x omega_d
-DGp = 1 # motor penalty [kT]
-
-""" Effective constants """ 
-tabulation = np.loadtxt("./"+"%s"%motor+'_taur_'+'%.1f'%taur+'_theta_'+'%.f'%theta+'_tabulation_detachment_probabilities.dat')
-
-if rho != 0: 
-    cg_ND = tabulation[int(np.where(tabulation[:,0] == rho)[0]),1] 
-    ce_ND = tabulation[int(np.where(tabulation[:,0] == rho)[0]),2]
-    LAMBDA_NO_DEFECT = cg_ND + ce_ND*np.exp(DGp)  
-    
-    cg_D = tabulation[int(np.where(tabulation[:,0] == rho)[0]),3]
-    ce_D = tabulation[int(np.where(tabulation[:,0] == rho)[0]),4]
-    LAMBDA_DEFECT = cg_D + ce_D*np.exp(DGp)
-else: 
-    LAMBDA_DEFECT = 1
-    LAMBDA_NO_DEFECT = 1
-
-""" Table for koff index for tubulin-tubulin interaction configurations without defect """
-TABLE_NO_DEFECT = np.zeros((60,4)) 
-index = 0 
-for ui,u in enumerate([0,0,1,2]):
-    for v in range(0,5):
-        for vt in range(0,4-v+1):  
-            TABLE_NO_DEFECT[index,0] = u
-            if ui != 0:
-                TABLE_NO_DEFECT[index,1] = 2-u
-            TABLE_NO_DEFECT[index,2] = v/2
-            TABLE_NO_DEFECT[index,3] = vt/2
-            index += 1
-                
-""" Table for koff index for tubulin-tubulin interaction configurations with longitudinal defect """
-TABLE_DEFECT = np.zeros((30,4)) # all different configurations for tubulin-tubulin interaction with 1 missing longitudinal neighbor 
-index = 0       
-for u in reversed(range(0,2)):
-    for v in range(0,5):
-        for vt in range(0,4-v+1):  
-            TABLE_DEFECT[index,0] = u
-            TABLE_DEFECT[index,1] = 1-u
-            TABLE_DEFECT[index,2] = v/2
-            TABLE_DEFECT[index,3] = vt/2
-            index += 1
-
-
-
-""" Initialize the lattice + event lists 
-    lat: lattice of size (n,m)
-    k: rate constant vector
-    occ: number of enabled site for each reaction type, it's the occurence vector
-    ersl: enabled reaction site list, it's an one-hot encoding matrice     
-"""
-lat = kMC.latice_initialization(BOX_LENGTH, BOX_WIDTH, LATTICE_HEIGHT, SEED_HEIGHT, CAP_HEIGHT,
-                                DEFECT_X_POSITION, DEFECT_Y_POSITION)
-k = kMC.rate_constant_initizalition(HYDROLYSIS_TIME, k_DIMER_ATTACH, RELAXATION_TIME,
-                                    LONGITUDINAL_ENERGY_GDP_TUBULIN, LATERAL_ENERGY_GDP_TUBULIN,
-                                    LONGITUDINAL_ENERGY_GTP_TUBULIN, LATERAL_ENERGY_GTP_TUBULIN,
-                                    LAMBDA_NO_DEFECT, LAMBDA_DEFECT)
-occ, ersl, lsre = kMC.initialize_eventlist(lat, Nr, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY)
-
-""" Initialized observables 
-"""
-tick = 0 # number of loops 
-tick_visu = 250 # number of loops between 2 frames
-
-
-# """ Lattice visualisation over time
-# """
-fig, ax = plt.subplots(figsize=(12,12)) # Visu
-title = ax.text(0.5,1.25, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
-                transform=ax.transAxes, ha="center")
-title.set_text(r"# Loops = {},".format(tick)+" t = {}s".format(np.round(t,2)))
-im = ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c_r',animated=True,vmin=-6,vmax=6)
-ax.set_ylim(0,.5)
-ax.set_xlim(0,BOX_LENGTH)
-plt.axis('on')
-plt.draw()
-plt.tight_layout()
-
-""" loop the simulation while the stop condition is not verified
-"""
-while tick < tick_max: 
-    r = rd.random() # 1st draw 
-    C, reac = kMC.next_reaction_draw(k, occ, r)
-    
-    r = rd.random() # 2nd draw
-    t += -(np.log(r)/C) # Simulated time evolution
-    time_step[tick] = -(np.log(r)/C)
-    
-    r = rd.randint(0,int(occ[reac])-1) # 3rd draw
-    loc = ersl[reac][r]
-    
-    lat, occ, ersl, lsre = kMC.update_lattice_configuration(lat, occ, ersl, lsre, reac, loc, TABLE_NO_DEFECT, TABLE_DEFECT, DIRECTIONALITY)
-    tick += 1
-    
-    """ lattice visualisation update
+
+def koff_tables():
+    """ return the tables of the tubulin-tubulin interaction configurations
+        [a, at, b, bt] without defect & with a longitudinal defect
+    """
+    """ Table for koff index for tubulin-tubulin interaction configurations without defect """
+    TABLE_NO_DEFECT = np.zeros((60,4))
+    index = 0
+    for ui,u in enumerate([0,0,1,2]):
+        for v in range(0,5):
+            for vt in range(0,4-v+1):
+                TABLE_NO_DEFECT[index,0] = u
+                if ui != 0:
+                    TABLE_NO_DEFECT[index,1] = 2-u
+                TABLE_NO_DEFECT[index,2] = v/2
+                TABLE_NO_DEFECT[index,3] = vt/2
+                index += 1
+
+    """ Table for koff index for tubulin-tubulin interaction configurations with longitudinal defect """
+    TABLE_DEFECT = np.zeros((30,4)) # all different configurations for tubulin-tubulin interaction with 1 missing longitudinal neighbor
+    index = 0
+    for u in reversed(range(0,2)):
+        for v in range(0,5):
+            for vt in range(0,4-v+1):
+                TABLE_DEFECT[index,0] = u
+                TABLE_DEFECT[index,1] = 1-u
+                TABLE_DEFECT[index,2] = v/2
+                TABLE_DEFECT[index,3] = vt/2
+                index += 1
+    return (TABLE_NO_DEFECT, TABLE_DEFECT)
+
+
+def run(P, visualise=False):
+    """ run the kMC simulation of the effective MoTub model with the
+        parameters P, return the final lattice, the simulated time and the
+        number of events (the loops plus the leaped events)
     """
-    if tick%tick_visu == 0:
-        plt.cla()
-        title = ax.text(0.5, 3, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
-                transform=ax.transAxes, ha="center")
-        title.set_text(r"# Loops= {},".format(tick)+" t = {} s".format(np.round(t,2)))
-        ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-6,vmax=6)
+    rngs = kMC.random_streams(P["SEED"])
+    t = 0 # Initial time
+    tick_max = P["TICK_MAX"]
+
+    LATTICE_HEIGHT = P["LATTICE_HEIGHT"]
+    if LATTICE_HEIGHT is None:
+        LATTICE_HEIGHT = int(0.5*P["BOX_LENGTH"])
+    DEFECT_X_POSITION = int(0.5*LATTICE_HEIGHT)
+    DEFECT_Y_POSITION = int(0.5*P["BOX_WIDTH"])
+
+    TOTAL_BINDING_ENERGY_GDP_TUBULIN = P["TOTAL_BINDING_ENERGY_GDP_TUBULIN"]
+    ANISOTROPY = P["ANISOTROPY"]
+    LONGITUDINAL_ENERGY_GDP_TUBULIN = (1/(2*(1+ANISOTROPY)))*TOTAL_BINDING_ENERGY_GDP_TUBULIN
+    LATERAL_ENERGY_GDP_TUBULIN = ANISOTROPY*LONGITUDINAL_ENERGY_GDP_TUBULIN
+
+    STABILIZATION_GTP_TUBULIN = 0.5*(P["CONSTRAST"]-1)*TOTAL_BINDING_ENERGY_GDP_TUBULIN
+    LONGITUDINAL_ENERGY_GTP_TUBULIN = LONGITUDINAL_ENERGY_GDP_TUBULIN + STABILIZATION_GTP_TUBULIN
+    LATERAL_ENERGY_GTP_TUBULIN = LATERAL_ENERGY_GDP_TUBULIN
+
+    """ Motor characteristics """
+    motor = P["motor"]
+    if  motor == "kinesin":
+        DIRECTIONALITY = +1 # directionality of the motor, m = 1 (resp. -1) for + end (resp - end)
+    elif motor == "dynein":
+        DIRECTIONALITY = -1
+    rho = P["rho"] ; taur = P["taur"] ; theta = P["theta"] ; DGp = P["DGp"]
+
+    """ Effective constants, interpolated in the cached tables (cf. kMC_Tabulation) """
+    LAMBDA_NO_DEFECT, LAMBDA_DEFECT = tab.lambda_coefficients(motor, rho, taur, theta, DGp)
+
+    """ Direct-address table of the koff indices, KOFF[c, a, at, 2*b, 2*bt] """
+    TABLE_NO_DEFECT, TABLE_DEFECT = koff_tables()
+    KOFF = kMC.koff_reaction_table(TABLE_NO_DEFECT, TABLE_DEFECT)
+
+    """ Initialize the lattice + event lists
+        lat: lattice of size (n,m)
+        k: rate constant vector
+        bins: one bin per reaction (cf. kMC_Engine.reaction_bins)
+        occ: number of enabled site for each reaction type, it's the occurence vector
+        bocc: number of enabled pairs (reaction, site) of each bin
+        tree: binary sum tree of the reaction rates k*occ, tree[1] is the total rate
+        ersl: enabled reaction site list, ersl[g] = array of the enabled pairs x*Nr + reac of the bin g
+        lsre: inverse of ersl, lsre[x] = sorted reactions enabled at the site x, padded with -1
+        pos: pos[x,s] = position of the pair (lsre[x,s], x) in its ersl array
+        geo: flat indices of the neighbors of every site, seam included (cf. Tools.lattice_geometry)
+    """
+    lat = kMC.latice_initialization(P["BOX_LENGTH"], P["BOX_WIDTH"], LATTICE_HEIGHT,
+                                    P["SEED_HEIGHT"], P["CAP_HEIGHT"],
+                                    DEFECT_X_POSITION, DEFECT_Y_POSITION)
+    k = kMC.rate_constant_initizalition(P["HYDROLYSIS_TIME"], P["k_DIMER_ATTACH"], P["RELAXATION_TIME"],
+                                        LONGITUDINAL_ENERGY_GDP_TUBULIN, LATERAL_ENERGY_GDP_TUBULIN,
+                                        LONGITUDINAL_ENERGY_GTP_TUBULIN, LATERAL_ENERGY_GTP_TUBULIN,
+                                        LAMBDA_NO_DEFECT, LAMBDA_DEFECT)
+    geo = tl.lattice_geometry(P["BOX_LENGTH"], P["BOX_WIDTH"], P["SEAM_START"])
+
+    """ the hydrolysis is left out of the exact selection and fired every
+    tau_leap, at the times n*tau_leap (cf. kMC_Engine.leap_rates)
+    """
+    tau_leap, k_exact = kMC.leap_rates(kMC.MODEL, k, P["LEAP_TOLERANCE"])
+    n_leap = 1 ; t_leap = tau_leap
+    bins = kMC.model_bins(kMC.MODEL, k_exact)
+    occ, bocc, ersl, pos, lsre = kMC.initialize_eventlist(lat, geo, bins, KOFF, DIRECTIONALITY)
+    tree = kMC.build_rate_tree(k_exact, occ, bins)
+    rules = (KOFF, DIRECTIONALITY)
+    memo = kMC.memo_table(kMC.MEMO_SIZE, kMC.SLOT)
+
+    """ Initialized observables, observers = (interval, callback(T, tick))
+        called at the simulated times n*interval
+    """
+    tick = 0 # number of events
+    observers = []
+
+    if visualise:
+        """ Lattice visualisation over time
+        """
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(12,12)) # Visu
+        title = ax.text(0.5,1.25, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
+                        transform=ax.transAxes, ha="center")
+        title.set_text(r"# Loops = {},".format(tick)+" t = {}s".format(np.round(t,2)))
+        im = ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c_r',animated=True,vmin=-6,vmax=6)
+        ax.set_ylim(0,.5)
+        ax.set_xlim(0,P["BOX_LENGTH"])
         plt.axis('on')
         plt.draw()
-        plt.pause(.1)
+        plt.tight_layout()
+
+        def draw(T, tick):
+            """ lattice visualisation update
+            """
+            plt.cla()
+            title = ax.text(0.5, 3, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
+                    transform=ax.transAxes, ha="center")
+            title.set_text(r"# Loops= {},".format(tick)+" t = {} s".format(np.round(T,2)))
+            ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-6,vmax=6)
+            plt.axis('on')
+            plt.draw()
+            plt.pause(.1)
+        observers.append((P["VISU_TIME"], draw))
+    scheduler = sched.new_scheduler(t, observers)
+
+    """ event log
+    """
+    log = None
+    if P["EVENT_LOG"] is not None:
+        log = evlog.open_event_log(P["EVENT_LOG"], {"model": "MoTub_effective", "shape": lat.shape, "parameters": P})
+
+    """ loop the simulation while the stop condition is not verified
+    """
+    loops = 0 # number of loops of the exact kMC (tick without the leaped events)
+    while loops < tick_max:
+        """ 3 draws per event: reaction, waiting time and reaction site (+ the
+        leaps from rngs[4]), the trajectory does not depend on the size of the
+        blocks of events
+        """
+        n_events = min(EVENT_BLOCK, tick_max - loops)
+        u = kMC.draw_events(rngs, n_events)
+        reacs = np.zeros(n_events, dtype=int) ; sites = np.zeros(n_events, dtype=int) ; dt = np.zeros(n_events)
+        done = 0 ; leaps = [] ; n_leaped = 0
+        while done < n_events:
+            t, n = kMC.run_events(lat, geo, occ, bocc, ersl, pos, lsre, tree, k_exact, bins, u[done:], reacs[done:],
+                                  sites[done:], dt[done:], t, min(sched.next_time(scheduler), t_leap), rngs[3],
+                                  rules, memo)
+            done += n
+            if done < n_events and t_leap <= sched.next_time(scheduler):
+                """ the next event occurs after the next leap, its waiting time
+                restarts at t_leap (memoryless) with the rates after the leap
+                """
+                u[done,1] = max(u[done,1] - (t_leap - t)*tree[1], 0.)
+                leap_reacs, leap_sites = kMC.leap_reactions(lat, geo, occ, bocc, ersl, pos, lsre, tree, k_exact,
+                                                            bins, k, tau_leap, rngs[4], rules, memo)
+                leaps.append((done, leap_reacs, leap_sites, t_leap - t))
+                n_leaped += len(leap_reacs)
+                t = t_leap ; n_leap += 1 ; t_leap = n_leap*tau_leap
+            elif done < n_events:
+                """ the next event occurs after the next sampling time """
+                sched.fire_observers(scheduler, tick + done + n_leaped)
+        loops += n_events
+        tick += n_events + n_leaped
+        if leaps:
+            """ the leaped events are put back in the block at their place """
+            reacs, sites, dt = kMC.insert_leaps(reacs, sites, dt, leaps)
+        if log is not None:
+            evlog.log_events(log, reacs, sites, dt)
+
+    if log is not None:
+        evlog.close_event_log(log)
+    return (lat, t, tick)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="kMC simulation of the effective MoTub model")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter, can be repeated")
+    parser.add_argument("--visualise", action="store_true", help="animate the lattice with matplotlib")
+    args = parser.parse_args(argv)
+    try:
+        P = load_parameters(args.parameters, args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    t_init = time.time()
+    lat, t, tick = run(P, args.visualise)
+    t_comput = time.time() - t_init # time to compute the script
+    v_loop = t_comput/tick
+    print()
+    print("it takes", round(v_loop*10**3, 3), "ms per loop with the", kMC.BACKEND, "backend")
+    print("mean waiting time", t/tick, "s")
+
 
-t_comput = time.time() - t_init # time to compute the script
-v_loop = t_comput/tick
-print()
-print("it takes", round(v_loop*10**3, 3), "ms per loop")
-print(time_step.mean(), time_step.std())
+if __name__ == "__main__":
+    main()
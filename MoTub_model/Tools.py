@@ -2,6 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+from kMC_Backend import jit
+from kMC_core.kMC_Geometry import lattice_geometry
+
+""" public names, with the geometry functions the scripts of the model use through this module """
+__all__ = ["measurement_motor", "flux", "dens", "attachment_rate_cte", "above", "below", "left",
+    "right", "ngbr", "MT_length_measure", "STATES", "OBSERVABLE_KEYS", "observable_counts",
+    "protofilament_tips", "observables", "observables_dtype", "observables_row", "lattice_geometry"]
 
 def measurement_motor(lat):
     Ne = 0 
@@ -32,10 +39,12 @@ def attachment_rate_cte(rho,km,k0):
 ### -------- Lattice Geometry ------------------
 
 #### without seam structure 
+@jit
 def above(lat,i,j):     
     l = len(lat[:,0])
     return (int((i+1)%l),int(j))
 
+@jit
 def below(lat,i,j):     
     l = len(lat[:,0])  
     return (int((i-1)%l),int(j))
@@ -86,126 +95,6 @@ def ngbr(i,j,lat):
             bt += 1/2
     return (a,at,b,bt)
 
-#### with seam structure as S3_start
-def left_s3(lat,i,j):     
-    l = len(lat[:,0])  
-    if j == 0:  
-        I1 = (i+1)%l
-        I2 = (i+2)%l
-        J = len(lat[0,:]) - 1 
-    else:
-        I1 = i
-        I2 = i
-        J = j-1     
-    return (int(J),int(I1),int(I2))
-
-def right_s3(lat,i,j):
-    l = len(lat[:,0])     
-    if j == len(lat[0,:]) - 1: 
-        I1 = (i-1)%l
-        I2 = (i-2)%l
-        J = 0 
-    else: 
-        I1 = i
-        I2 = i 
-        J = j+1
-    return (int(J),int(I1),int(I2))
-
-def ngbr_s3(i,j,lat): 
-    a = 0 
-    at = 0 
-    b = 0 
-    bt = 0 
-    U = above(lat,i,j)
-    D = below(lat,i,j)
-    L = left_s3(lat,i,j)
-    L1 = [L[1],L[0]]
-    L2 = [L[2],L[0]]
-    R = right_s3(lat,i,j)
-    R1 = [R[1],R[0]]
-    R2 = [R[2],R[0]]
-    
-    if lat[i,j] >= 0: # not a GTP-dimer
-        if lat[U[0],U[1]] != 0: 
-            a += 1
-        if lat[D[0],D[1]] != 0:
-            a += 1        
-            
-        if j == 0: 
-            if lat[L1[0],L1[1]] != 0:
-                b += 1
-            if lat[L2[0],L2[1]] != 0:
-                b += 1
-            if lat[R1[0],R1[1]] != 0:
-                b += 2
-                
-        elif j == len(lat[0,:]) - 1: 
-            if lat[R1[0],R1[1]] != 0:
-                b += 1
-            if lat[R2[0],R2[1]] != 0:
-                b += 1
-            if lat[L1[0],L1[1]] != 0:
-                b += 2
-        else: 
-            if lat[R1[0],R1[1]] != 0:
-                b += 2
-            if lat[L1[0],L1[1]] != 0:
-                b += 2
-    else: 
-        if lat[U[0],U[1]] > 0:  
-            a += 1
-        elif lat[U[0],U[1]] < 0:
-            at += 1
-            
-        if lat[D[0],D[1]] > 0:  
-            a += 1
-        elif lat[D[0],D[1]] < 0:
-            at += 1
-        
-        if j == 0: 
-            if lat[L1[0],L1[1]] > 0:  
-                b += 1
-            elif lat[L1[0],L1[1]] < 0:
-                bt += 1
-        
-            if lat[L2[0],L2[1]] > 0:  
-                b += 1
-            elif lat[L2[0],L2[1]] < 0:
-                bt += 1
-            
-            if lat[R1[0],R1[1]] > 0:  
-                b += 2
-            elif lat[R1[0],R1[1]] < 0:
-                bt += 2
-                
-        elif j == len(lat[0,:]) - 1:
-            if lat[R1[0],R1[1]] > 0:  
-                b += 1
-            elif lat[R1[0],R1[1]] < 0:
-                bt += 1
-                
-            if lat[R2[0],R2[1]] > 0:  
-                b += 1
-            elif lat[R2[0],R2[1]] < 0:
-                bt += 1
-                
-            if lat[L1[0],L1[1]] > 0:  
-                b += 2
-            elif lat[L1[0],L1[1]] < 0:
-                bt += 2
-                
-        else: 
-            if lat[L1[0],L1[1]] > 0:  
-                b += 2
-            elif lat[L1[0],L1[1]] < 0:
-                bt += 2
-                
-            if lat[R1[0],R1[1]] > 0:  
-                b += 2
-            elif lat[R1[0],R1[1]] < 0:  
-                bt += 2
-    return (a,at,b,bt)
-
 def MT_length_measure(lat):
     n = len(lat[:,0]) ; m = len(lat[0,:])
     L_pf = np.zeros(m)
@@ -225,3 +114,50 @@ def MT_length_measure(lat):
     # for i in range(n):
     #     kymo[i] = lat[i,:].mean()
     return (L_pf)
+
+### -------- Observables tracker ------------------
+""" the tracker of the observables is (counts, tips), updated by the kMC
+    kernel from the sites changed by every reaction (O(1) per event):
+    counts[v+6] = number of sites in the state v in [-6, 6] of the active
+                  rows (3 < i < l-3)
+    tips[j] = row of the last dimer of the protofilament j (cf. MT_length_measure)
+"""
+STATES = np.arange(-6, 7) # states of the sites in the order of counts
+OBSERVABLE_KEYS = ("N_GTP", "N_GDP", "N_VACANCY", "N_EXCITED", "N_MOTOR_1HEAD", "N_MOTOR_2HEAD")
+
+def observable_counts(lat):
+    """ return the counts of the states of the active rows of the lattice """
+    l = len(lat[:,0])
+    return np.bincount(lat[4:l-3].astype(int).reshape(-1) + 6, minlength=len(STATES))
+
+def protofilament_tips(lat):
+    """ vectorised MT_length_measure: return the row of the last dimer of
+        every protofilament (2 if there is none above the seed)
+    """
+    n = len(lat[:,0])
+    occupied = lat[3:] != 0
+    last = n - 1 - np.argmax(occupied[::-1], axis=0)
+    return np.where(occupied.any(axis=0), last, 2)
+
+def observables(counts, tips):
+    """ return the observables of the tracker (counts, tips) """
+    V = np.abs(STATES)
+    N_MOTOR = int(counts[(V == 3) | (V == 4)].sum()) # motors counted by their rear-head
+    N_MOTOR_2HEAD = int(counts[(V == 5) | (V == 6)].sum()) # front-heads
+    return {"N_GTP": int(counts[STATES < 0].sum()),
+            "N_GDP": int(counts[STATES > 0].sum()),
+            "N_VACANCY": int(counts[STATES == 0].sum()),
+            "N_EXCITED": int(counts[(V != 0) & (V%2 == 0)].sum()),
+            "N_MOTOR_1HEAD": N_MOTOR - N_MOTOR_2HEAD,
+            "N_MOTOR_2HEAD": N_MOTOR_2HEAD,
+            "TIPS": np.array(tips)}
+
+def observables_dtype(L):
+    """ return the dtype of a time series of the observables of a lattice of width L """
+    return np.dtype([("t", "<f8"), ("tick", "<i8")] + [(key, "<i8") for key in OBSERVABLE_KEYS]
+                    + [("TIPS", "<i8", (L,))])
+
+def observables_row(T, tick, counts, tips):
+    """ return the row of the time series of the observables at the time T """
+    obs = observables(counts, tips)
+    return (T, tick) + tuple(obs[key] for key in OBSERVABLE_KEYS) + (obs["TIPS"],)
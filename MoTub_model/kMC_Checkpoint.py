@@ -0,0 +1,80 @@
+"""
+Checkpoint & resume of the complete state of a MoTub simulation
+
+a checkpoint is a single .npz file holding
+    lat: lattice (int8, every state of the MoTub model fits in [-6, 6])
+    events: enabled pairs x*Nr + reac of every rate bin concatenated in bin
+            order, in their ersl order
+    t, tick, loops: simulated time, number of events and number of loops of
+                    the exact kMC (the leaped events excluded, cf. LEAP_TOLERANCE)
+    rng: json of the states of the random generators (cf. kMC_Library.random_streams)
+    parameters: json of the parameters of the run
+
+ersl is stored as it is in memory since the pair drawn for an event depends
+on the order of the pairs of its bin: a rebuilt ersl would be sorted and the
+resumed run would not be identical. occ, pos & lsre are rebuilt from ersl (one
+vectorised pass, much smaller file) and the rate tree from k & occ (every
+node is the same sum of the same leaves, hence bit-identical). The bins are
+rebuilt from the rates of the resumed run, the pairs are regrouped by bin in
+their stored order, which keeps ersl as it was for the same rates
+
+the file is written in a temporary file of the same directory then renamed,
+so a job killed while writing leaves the previous checkpoint untouched
+"""
+import json
+import os
+import numpy as np
+import kMC_Library as kMC
+
+FORMAT = 4 # version of the checkpoint layout
+
+
+def save_checkpoint(path, lat, bocc, ersl, t, tick, loops, rngs, P):
+    """ write atomically the state of the simulation in path (.npz) """
+    events = np.concatenate([np.asarray(ersl[g][:bocc[g]]) for g in range(len(bocc))])
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, format=FORMAT,
+                 lat=lat.astype(np.int8), events=events.astype(np.int64),
+                 t=np.float64(t), tick=np.int64(tick), loops=np.int64(loops),
+                 rng=json.dumps([rng.bit_generator.state for rng in rngs]),
+                 parameters=json.dumps(P))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_parameters(path):
+    """ return the parameters of the run saved in the checkpoint path """
+    with np.load(path) as data:
+        return json.loads(str(data["parameters"]))
+
+
+def read_tick(path):
+    """ return the number of events of the run saved in the checkpoint path """
+    with np.load(path) as data:
+        return int(data["tick"])
+
+
+def load_checkpoint(path, bins):
+    """ return the state saved in path as
+        (lat, occ, bocc, ersl, pos, lsre, t, tick, loops, rngs)
+        with the event lists grouped by the rate bins of the resumed run
+    """
+    with np.load(path) as data:
+        if int(data["format"]) != FORMAT:
+            raise ValueError("unsupported checkpoint format %d" % int(data["format"]))
+        lat = data["lat"].astype(kMC.STATE)
+        events = data["events"].astype(int)
+        t = float(data["t"])
+        tick = int(data["tick"])
+        loops = int(data["loops"])
+        rngs = []
+        for state in json.loads(str(data["rng"])):
+            rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+            rng.bit_generator.state = state
+            rngs.append(rng)
+
+    occ, bocc, ersl, pos, lsre = kMC.event_lists_from_pairs(events, bins, lat.size, kMC.SLOT)
+    return (lat, occ, bocc, ersl, pos, lsre, t, tick, loops, rngs)
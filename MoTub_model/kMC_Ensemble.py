@@ -0,0 +1,136 @@
+"""
+Description:
+ensemble of replicas of one MoTub lattice run in a single process
+
+the N replicas are stacked in one ensemble: the lattices in one
+(N, BOX_LENGTH, BOX_WIDTH) array, the occurence vectors, positions, enabled
+reactions, rate trees, observables trackers, clocks and ticks in batched
+arrays with the replica first, the ersl of each replica in a list. The rate
+constants, the rate bins, the geometry and the compiled kernel are shared,
+and every replica advances through the same jitted kernel as kMC_main.run on
+its own views of the batched arrays
+
+the replicas advance in lockstep of simulated time: at each sampling time
+every replica runs its events up to that time (one kernel call per replica
+and per block of events, the cost of the interpreter is paid per block, not
+per event) and the observables of the whole ensemble are sampled at once,
+which gives ensemble averages and first passage times (e.g. fracture time)
+at common times
+
+the replica r draws from the streams of the seed [SEED, r] and, the kernel
+being independent of the size of the blocks of events, it follows exactly
+the run of kMC_main with SEED = [SEED, r]
+
+Usage:
+    python kMC_Ensemble.py [parameters.json] --replicas 256 --time 10
+                           [--sample 0.1] [--set KEY=VALUE ...] [--out ensemble.npy]
+
+the time series of the observables are saved as one structured array of
+shape (samples, replicas) (cf. Tools.observables_dtype)
+"""
+import argparse
+import time
+import numpy as np
+import kMC_Library as kMC
+import kMC_main as main
+import Tools as tl
+
+
+def new_ensemble(P, N):
+    """ return the ensemble (dict) of N replicas of the initial lattice of
+        the parameters P (cf. kMC_main.run for the event structures)
+    """
+    k = main.rate_constants(P)
+    bins = kMC.model_bins(kMC.MODEL, k)
+    geo = tl.lattice_geometry(P["BOX_LENGTH"], P["BOX_WIDTH"], P["SEAM_START"])
+    lat = main.initial_lattice(P)
+    occ, bocc, ersl, pos, lsre = kMC.initialize_eventlist(lat, geo, bins, P["DIRECTIONALITY"])
+    tree = kMC.build_rate_tree(k, occ, bins)
+    counts = tl.observable_counts(lat) ; tips = tl.protofilament_tips(lat)
+
+    def stack(a):
+        return np.repeat(np.asarray(a)[np.newaxis], N, axis=0)
+
+    return {"k": k, "bins": bins, "geo": geo, "DIRECTIONALITY": P["DIRECTIONALITY"],
+            "memo": kMC.memo_table(kMC.MEMO_SIZE, kMC.SLOT),
+            "lat": stack(lat), "occ": stack(occ), "bocc": stack(bocc), "pos": stack(pos),
+            "lsre": stack(lsre), "tree": stack(tree), "counts": stack(counts), "tips": stack(tips),
+            "ersl": [kMC.new_list([np.array(a) for a in ersl]) for r in range(N)],
+            "t": np.zeros(N), "tick": np.zeros(N, dtype=np.int64),
+            "rngs": [kMC.random_streams(kMC.spawn_seed(P["SEED"], r)) for r in range(N)],
+            "u": [np.zeros((0, 3)) for r in range(N)], "done": np.zeros(N, dtype=np.int64)}
+
+
+def advance(ensemble, r, t_stop, block=main.EVENT_BLOCK):
+    """ run the events of the replica r up to the simulated time t_stop,
+        the random numbers of a block are kept from one call to the next
+    """
+    E = ensemble
+    while True:
+        if E["done"][r] == len(E["u"][r]):
+            E["u"][r] = kMC.draw_events(E["rngs"][r], block)
+            E["done"][r] = 0
+        done = E["done"][r]
+        n_events = len(E["u"][r]) - done
+        reacs = np.zeros(n_events, dtype=int) ; sites = np.zeros(n_events, dtype=int) ; dt = np.zeros(n_events)
+        t, n = kMC.run_events(E["lat"][r], E["geo"], E["occ"][r], E["bocc"][r], E["ersl"][r], E["pos"][r],
+                              E["lsre"][r], E["tree"][r], E["k"], E["bins"], E["u"][r][done:], reacs, sites, dt,
+                              E["t"][r], t_stop, E["rngs"][r][3], (E["DIRECTIONALITY"], E["counts"][r], E["tips"][r]),
+                              E["memo"])
+        E["t"][r] = t
+        E["tick"][r] += n
+        E["done"][r] += n
+        if n < n_events:
+            """ the next event of the replica occurs after t_stop """
+            return
+
+
+def sample(ensemble, T):
+    """ return the row of observables of every replica at the time T """
+    E = ensemble
+    return np.array([tl.observables_row(T, E["tick"][r], E["counts"][r], E["tips"][r])
+                     for r in range(len(E["t"]))], dtype=tl.observables_dtype(E["lat"].shape[2]))
+
+
+def run_ensemble(P, N, t_max, sample_time=0.1):
+    """ run N replicas of the MoTub model with the parameters P up to the
+        simulated time t_max, return the ensemble and the time series of the
+        observables of every replica sampled every sample_time,
+        of shape (samples, N)
+    """
+    ensemble = new_ensemble(P, N)
+    times = sample_time*np.arange(int(np.floor(t_max/sample_time + 1e-9)) + 1)
+    series = []
+    for T in times:
+        for r in range(N):
+            advance(ensemble, r, T)
+        series.append(sample(ensemble, T))
+    return (ensemble, np.array(series))
+
+
+def main_ensemble(argv=None):
+    parser = argparse.ArgumentParser(description="ensemble of replicas of the MoTub model in one process")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults of kMC_main")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter, can be repeated")
+    parser.add_argument("--replicas", type=int, required=True, help="number of replicas")
+    parser.add_argument("--time", type=float, required=True, help="simulated time of the run [s]")
+    parser.add_argument("--sample", type=float, default=0.1, help="simulated time between 2 samples [s]")
+    parser.add_argument("--out", default="ensemble.npy", help="file of the time series of the observables (.npy)")
+    args = parser.parse_args(argv)
+    try:
+        P = main.load_parameters(args.parameters, args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    t_init = time.time()
+    ensemble, series = run_ensemble(P, args.replicas, args.time, args.sample)
+    np.save(args.out, series)
+    t_comput = time.time() - t_init
+    n_events = int(ensemble["tick"].sum())
+    print(n_events, "events of", args.replicas, "replicas in", round(t_comput, 1), "s,",
+          round(n_events/t_comput), "events per s")
+
+
+if __name__ == "__main__":
+    main_ensemble()
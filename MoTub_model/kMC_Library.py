@@ -1,15 +1,53 @@
 """
-kMC functions for VSS method + local scan + use of list of list
-for a simple model (flux of processive 2-head motors)
+kMC functions of the MoTub model: its rules (enabled reactions & lattice 
+changes) plugged into the shared engine (cf. kMC_core/kMC_Engine.py) for 
+the VSS method + local scan + array-backed event lists
 """
 import numpy as np
-import Tools as tl
+from kMC_Backend import BACKEND, jit, new_list
+from kMC_core.kMC_Geometry import UP, DOWN, LEFT1, LEFT2, RIGHT1, RIGHT2, ngbr_s3, ngbr_s3_lattice
+from kMC_core.kMC_Engine import (ModelSpec, STATE, model_bins, build_event_lists, event_lists_from_pairs, 
+    enabled_pairs, model_kernels, memo_table, random_streams, spawn_seed, draw_events, build_rate_tree, 
+    leap_rates, insert_leaps)
 
-""" magical function to create list of list
+""" public names, with the engine functions the scripts of the model use through this module """
+__all__ = ["MODEL", "SLOT", "MEMO_SIZE", "DETACHMENT", "latice_initialization",
+    "rate_constant_initizalition", "initialize_eventlist", "update_enabled_reaction", "stencil_key",
+    "enabled_reactions", "apply_reaction", "count_sites", "update_tips", "change_lattice",
+    "KERNELS", "scan", "rescan_sites", "update_lattice_configuration", "run_events",
+    "leap_reactions", "replay_events", "BACKEND", "new_list", "STATE", "model_bins",
+    "event_lists_from_pairs", "memo_table", "random_streams", "spawn_seed", "draw_events",
+    "build_rate_tree", "leap_rates", "insert_leaps"]
+
+""" 457 rate constants (cf. rate_constant_initizalition), a reaction changes 
+    the enabled reactions of the sites up to 3 rows & 1 protofilament away, a 
+    site holds at most 1 detachment + 3 other reactions, the hydrolysis 
+    & relaxation can be leaped (first-order, site-local)
+"""
+MODEL = ModelSpec("MoTub", 457, (3, 1), 4, "composition-rejection", (4, 6))
+SLOT = MODEL.slot # width of the lsre rows
+MEMO_SIZE = 8191 # entries (prime) of the memo of the enabled reactions (cf. stencil_key)
+
+""" encoding of the state of a site, stored as an int8 (STATE): 
+    lat = 0 for a vacancy, otherwise lat = s*(1 + e + 2*h) with 
+        s = -1 for a GTP-dimer, +1 for a GDP-dimer (nucleotide = sign)
+        e = 1 for an excited dimer, 0 in the ground state (excitation = 
+            parity, even |lat|)
+        h = 0 without motor, 1 under a rear head, 2 under a front head 
+            (motor head = (|lat|-1)//2)
+    so every state is in [-6, 6] and the state arithmetic is exact integer 
+    arithmetic, e.g. a rear head binds a dimer with lat += 2*s
+    
+    the event structures (ersl, pos, occ, bocc) are int32 arrays (INDEX), 
+    the enabled pairs x*Nr + reac fit in them up to 2^31/Nr sites
+"""
+
+""" direct-address table of the dimer detachment reactions: 
+    DETACHMENT[e, a, at, b, bt] = reaction index for a non-excited (e=0) or 
+    excited (e=1) dimer with the neighbor counts (a, at, b, bt) of ngbr_s3, 
+    in the order of rate_constant_initizalition 
 """
-def mklist(n):
-    for _ in range(n):
-        yield []
+DETACHMENT = 7 + np.arange(2*3*3*5*5).reshape(2, 3, 3, 5, 5)
 
 
 def latice_initialization(BOX_LENGTH, BOX_WIDTH, 
@@ -27,6 +65,7 @@ def latice_initialization(BOX_LENGTH, BOX_WIDTH,
         - State = 0 <=> empty site
         - State = 1 <=> tubulin-GDP
         - State = -1 <=> tubulin-GTP
+        (int8, cf. the encoding of STATE)
     """
     
     """ case 1: 
@@ -34,7 +73,7 @@ def latice_initialization(BOX_LENGTH, BOX_WIDTH,
     	it depends on the LATTICE_HEIGHT and CAP_HEIGHT
     """
     
-    lattice = np.zeros((BOX_LENGTH, BOX_WIDTH))
+    lattice = np.zeros((BOX_LENGTH, BOX_WIDTH), dtype=STATE)
     lattice[:LATTICE_HEIGHT, :] = 1 
     lattice[:SEED_HEIGHT, :] = -1 
     lattice[LATTICE_HEIGHT-CAP_HEIGHT:LATTICE_HEIGHT, :] = -1 
@@ -42,7 +81,7 @@ def latice_initialization(BOX_LENGTH, BOX_WIDTH,
     """ Case 2:
 	suited for fracture dynamics 
     """ 
-    lattice = np.ones((BOX_LENGTH, BOX_WIDTH))
+    lattice = np.ones((BOX_LENGTH, BOX_WIDTH), dtype=STATE)
 
     """ case 3: 
     	MT is not attached to the box walls
@@ -116,138 +155,58 @@ def rate_constant_initizalition(k_MOTOR_ATTACH, k_MOTOR_DETACH,
     return k 
 
 
-def initial_event_list_reaction(i, j, lattice, occ, ersl, lsre, DIRECTIONALITY):
-    """
-    test which reactions is enabled at site at (i,j) 
-    and update occ & ersl & lsre for the initial lattice configuration
-    """
-    L = len(lattice[0,:])
-    l = len(lattice[:,0])
-    x = int(j+i*L)
-    m = DIRECTIONALITY
-        
-    if 3 < i < l-3:  
-        if lattice[i,j] == 0:
-            """ it's a defect """
-            ngbr = tl.ngbr_s3(i, j, lattice) 
-            a = ngbr[0] ; at = ngbr[1]
-            b = ngbr[2] ; bt = ngbr[3]  
-            N_ngbr = a + at + (b+bt)/2 
-            if (0 < N_ngbr < 4 or bt > 0) and np.abs(lattice[i-m,j]) != 3 and np.abs(lattice[i-m,j]) != 4: 
-                """ any defect with at least one non-vacant neighbor 
-                    without a motor upstream can be incorporated with a GTP-tubulin
-                """
-                occ[5] += 1
-                ersl[5].append([i,j])
-                lsre[x].append(5)
-        
-        if lattice[i,j] != 0 and lattice[i,j]%2 == 0: 
-            """ any excited dimer can relax to its fondamental level
-            """
-            occ[6] += 1
-            ersl[6].append([i,j])
-            lsre[x].append(6)
-                
-        if lattice[i,j] < 0 and lattice[i+1,j] != 0: 
-            """ any GTP-dimer incorporated into the lattice can be hydrolized 
-                incorporated = presence of 1 neighbor in the (+) direction
-            """
-            occ[4] += 1
-            ersl[4].append([i,j])
-            lsre[x].append(4)
-
-        if  0 < np.abs(lattice[i,j]) <= 2: 
-            """ it's a dimer without a motor can detach from the lattice 
-            """
-            ngbr = tl.ngbr_s3(i, j, lattice) 
-            a = ngbr[0] ; at = ngbr[1]
-            b = ngbr[2] ; bt = ngbr[3]  
-            ind = int(a*(5*5*3) + at*(5*5) + b*5 + bt) 
-            if lattice[i,j]%2 != 0: 
-                # non-excited state 
-                occ[7+ind] += 1
-                ersl[7+ind].append([i,j])
-                lsre[x].append(7+ind)
-            else: 
-                # excited state 
-                occ[7+225+ind] += 1
-                ersl[7+225+ind].append([i,j])
-                lsre[x].append(7+225+ind)
-            if 0 < np.abs(lattice[i+m,j]) <= 2: 
-                """ when the adjacent dimer is without motor, a new motor can attach
-                """
-                occ[0] += 1
-                ersl[0].append([i,j])
-                lsre[x].append(0)
-
-        if 2 < np.abs(lattice[i,j]) <= 4: 
-            """ it's a dimer with a rear-head above 
-            """
-            if 4 < abs(lattice[i+m,j]) <= 6: 
-                """ when the 2-head are attached, the motor can detach 
-                """
-                occ[1] += 1
-                ersl[1].append([i,j])
-                lsre[x].append(1)
-                if 0 <= np.abs(lattice[i+2*m,j]) <= 2: 
-                    """ when the dimer next to the front head is vacant, 
-                    the motor can walk 
-                    """
-                    occ[3] += 3
-                    ersl[3].append([i,j])
-                    lsre[x].append(3)
-            elif lattice[i+m,j] == 0: 
-                """ if only one head is bound to the lattice, then the 
-                    enhanced detachment is enabled and the below dimer can 
-                    detach according to its state
-                """
-                occ[2] += 2
-                ersl[2].append([i,j])
-                lsre[x].append(2)
-                
-                ngbr = tl.ngbr_s3(i, j, lattice) 
-                a = ngbr[0] ; at = ngbr[1]
-                b = ngbr[2] ; bt = ngbr[3]  
-                ind = int(a*(5*5*3) + at*(5*5) + b*5 + bt) 
-                
-                if lattice[i,j]%2 != 0: 
-                    # non-excited dimer
-                    occ[7+ind] += 1
-                    ersl[7+ind].append([i,j])
-                    lsre[x].append(7+ind)
-                else: 
-                    # excited state 
-                    occ[7+225+ind] += 1
-                    ersl[7+225+ind].append([i,j])
-                    lsre[x].append(7+225+ind)        
-                
-    return (occ, ersl, lsre)
-
-
-def initialize_eventlist(lat, Nbr_reac, DIRECTIONALITY): 
-    """ initialize the occurence array and the ersl list and lsre list
+def initialize_eventlist(lat, geo, bins, DIRECTIONALITY): 
+    """ initialize the occurence arrays and the ersl list and lsre list
         occ[i] = # of site that enable the reaction i 
-        ersl[j] = list of the enable site positions for reaction j 
-        lsre[k] = inverse of ersl = list of the reaction enable for site with index k 
+        bocc[g] = # of enabled pairs (reaction, site) of the rate bin g
+        ersl[g] = array of the enabled pairs x*Nr + reac of the rate bin g 
+                  (cf. rate_bins), only its bocc[g] first entries are meaningful
+        lsre[k] = sorted reactions enabled for the site of flat index k, 
+                  padded with -1 up to SLOT slots
+        pos[k,s] = position of the pair (lsre[k,s], k) in its ersl array
+        the enabled reactions are tested on the whole lattice at once 
     """
-    occ = np.zeros(Nbr_reac) 
-    ersl = list(mklist(Nbr_reac))                                                     
-    lsre = list(mklist(len(lat[:,0])*len(lat[0,:])))
-    
-    L = len(lat[0,:])
     l = len(lat[:,0])
-
-    for i in range(l):
-        for j in range(L):
-            occ, ersl, lsre = initial_event_list_reaction(i, j, lat, occ, ersl, lsre, DIRECTIONALITY)
-    return (occ, ersl, lsre)
+    m = DIRECTIONALITY
+    active = np.zeros(lat.shape, dtype=bool)
+    active[4:l-3] = True
+    
+    a, at, b, bt = ngbr_s3_lattice(lat, geo, lat < 0)
+    N_ngbr = a + at + (b+bt)/2 
+    koff = DETACHMENT[(lat%2 == 0).astype(int), a, at, b, bt]
+    
+    V = np.abs(lat)
+    up = np.roll(lat, -1, axis=0)             # lattice[i+1,j]
+    front = np.roll(V, -m, axis=0)            # |lattice[i+m,j]|
+    back = np.roll(V, m, axis=0)              # |lattice[i-m,j]|
+    front2 = np.roll(V, -2*m, axis=0)         # |lattice[i+2*m,j]|
+    dimer = (0 < V) & (V <= 2)                # dimer without a motor
+    rear = (2 < V) & (V <= 4)                 # dimer with a rear-head above
+    two_heads = rear & (4 < front) & (front <= 6)
+    one_head = rear & (front == 0)
+    
+    enabled = [
+        ((lat == 0) & (((0 < N_ngbr) & (N_ngbr < 4)) | (bt > 0)) & (back != 3) & (back != 4), 5), 
+        ((lat != 0) & (lat%2 == 0), 6), 
+        ((lat < 0) & (up != 0), 4), 
+        (dimer | one_head, koff), 
+        (dimer & (0 < front) & (front <= 2), 0), 
+        (two_heads, 1), 
+        (two_heads & (front2 <= 2), 3), 
+        (one_head, 2), 
+    ]
+    X, R = enabled_pairs(lat, enabled, active)
+    return build_event_lists(X, R, bins, lat.size, SLOT)
 
 
 
-def update_enabled_reaction(i, j, lattice, DIRECTIONALITY):
+@jit
+def update_enabled_reaction(i, j, lattice, geo, DIRECTIONALITY):
     """ test which reactions are enabled for the site (i, j)
     """
     lsre_x = []  
+    x = j + i*len(lattice[0,:])
+    flat = lattice.reshape(-1)
     L = len(lattice[0,:])
     l = len(lattice[:,0])
     m = DIRECTIONALITY
@@ -255,7 +214,7 @@ def update_enabled_reaction(i, j, lattice, DIRECTIONALITY):
     if 3 < i < l-3: 
         if lattice[i,j] == 0:
             """ it's a defect """
-            ngbr = tl.ngbr_s3(i, j, lattice) 
+            ngbr = ngbr_s3(x, flat, geo, flat[x] < 0) 
             a = ngbr[0] ; at = ngbr[1]
             b = ngbr[2] ; bt = ngbr[3]  
             N_ngbr = a + at + (b+bt)/2 
@@ -280,16 +239,11 @@ def update_enabled_reaction(i, j, lattice, DIRECTIONALITY):
         if  0 < np.abs(lattice[i,j]) <= 2: 
             """ it's a dimer without a motor can detach from the lattice 
             """
-            ngbr = tl.ngbr_s3(i, j, lattice) 
+            ngbr = ngbr_s3(x, flat, geo, flat[x] < 0) 
             a = ngbr[0] ; at = ngbr[1]
             b = ngbr[2] ; bt = ngbr[3]      
-            ind = int(a*(5*5*3) + at*(5*5) + b*5 + bt) 
-            if lattice[i,j]%2 != 0: 
-                # non-excited state 
-                lsre_x.append(7+ind)
-            else: 
-                # excited state 
-                lsre_x.append(7+225+ind)
+            e = int(lattice[i,j]%2 == 0) # 0 for non-excited, 1 for excited state 
+            lsre_x.append(DETACHMENT[e, a, at, b, bt])
             if 0 < np.abs(lattice[i+m,j]) <= 2: 
                 """ when the adjacent dimer is without motor, a new motor can attach
                 """
@@ -314,116 +268,61 @@ def update_enabled_reaction(i, j, lattice, DIRECTIONALITY):
                 """
                 lsre_x.append(2)
                 
-                ngbr = tl.ngbr_s3(i, j, lattice) 
+                ngbr = ngbr_s3(x, flat, geo, flat[x] < 0) 
                 a = ngbr[0] ; at = ngbr[1]
                 b = ngbr[2] ; bt = ngbr[3]     
-                ind = int(a*(5*5*3) + at*(5*5) + b*5 + bt) 
-                
-                if lattice[i,j]%2 != 0: 
-                    # non-excited dimer
-                    lsre_x.append(7+ind)
-                else: 
-                    # excited state 
-                    lsre_x.append(7+225+ind)    
+                e = int(lattice[i,j]%2 == 0) # 0 for non-excited, 1 for excited state 
+                lsre_x.append(DETACHMENT[e, a, at, b, bt])
 
     return lsre_x
-#-------------------------------------------------------------------------------
-#-------------------------------------------------------------------------------
-def scan(lsre, ersl, occ, loc, lat, DIRECTIONALITY):
-    """ scan the neighborhood around the location (i,j) of the new reaction site 
-    to update the enable reaction site list (ersl) + occurence vector (occ)
-    
-    the size of the scan region is determined by its half_width and half_length
-    as ( 2 half_width + 1 x 2 half_lenght + 1)
+
+
+@jit
+def stencil_key(X, lat, geo, rules):
+    """ return the pattern of the stencil read by update_enabled_reaction at 
+    the site of flat index X: the states of the site, of its neighbors UP, 
+    DOWN & LATERAL (across the seam as read by ngbr_s3) and of the sites 
+    i-m, i+m & i+2m of its protofilament, packed 4 bits each (state + 6), 
+    or -1 out of the active rows (no enabled reaction)
+    the enabled reactions only depend on this pattern (cf. 
+    kMC_Kernels.rescan_window)
     """
-    
-    i = int(loc[0])    
-    j = int(loc[1])    
-    l = len(lat[:,0]) 
-    L = len(lat[0,:]) 
-    
-    half_length = 3
-    half_width = 1
-    
-    for I in range(i-half_length,i+half_length+1):
-        for J in range(j-half_width,j+half_width+1):
-            I = I%l ; J = J%L
-            lsre_x = update_enabled_reaction(I, J, lat, DIRECTIONALITY)
-            lsre_x.sort()
-            X = int(J+I*L)
-            lsre[X].sort()
-            
-            """ check if the enabled reaction list at index x is different
-            from the previous one
-            
-            if it is than update all the eventlist (occ, ersl, lsre) at this 
-            index 
-            """
-            if lsre_x != lsre[X]: 
-                """ add new enabled reaction     
-                """
-                for k in range(len(lsre_x)):
-                    """ if reactions not already enabled then add them
-                    """
-                    if lsre[X].count(lsre_x[k]) == 0: # 
-                        occ[lsre_x[k]] += 1
-                        ersl[lsre_x[k]].append([I,J])
-                        
-                """ if reactions are not anymore enabled then revome them
-                """
-                for k in range(len(lsre[X])):
-                    if lsre_x.count(lsre[X][k]) == 0: 
-                        occ[lsre[X][k]] -= 1
-                        ersl[lsre[X][k]].remove([I,J])
-                        
-                """ update the lsre list 
-                """
-                lsre[X] = lsre_x
-    return (occ, ersl, lsre)
+    l = len(lat[:,0]) ; L = len(lat[0,:])
+    i = X//L ; j = X%L
+    if not 3 < i < l-3: 
+        return -1
+    flat = lat.reshape(-1)
+    m = rules[0]
+    key = int(lat[i,j]) + 6
+    for n in (UP, DOWN, LEFT1, LEFT2, RIGHT1, RIGHT2): 
+        key = key*16 + int(flat[geo[n,X]]) + 6
+    for d in (-m, m, 2*m): 
+        key = key*16 + int(lat[i+d,j]) + 6
+    return key
 
 
-def next_reaction_draw(k, occ, r):
-    """ compute a probability for each reaction, and select 1 at random
-        return the normalization factor & next reaction type
+@jit
+def enabled_reactions(X, lat, geo, rules):
+    """ return the reactions enabled at the site of flat index X (rule of the 
+    kernels, cf. kMC_Engine.model_kernels), rules = (DIRECTIONALITY, counts, 
+    tips)
     """
-    Nr = len(k)      
-    kn = np.multiply(k, occ)  
-    P = np.zeros(Nr)
-    for i in range(Nr):
-        """ non-normalized cummulative probability 
-        to define intervals for each reaction
-        """
-        P[i] = np.sum(kn[0:(i+1)%(Nr+1)]) 
-    C = np.sum(kn) # Normalizing factor
-    Pn = np.zeros(Nr+1) 
-    for i in range(Nr):
-        """ normalized cummulative probability interval
-        """
-        Pn[i+1]= P[i]/C
-    for i in range(0,Nr):
-        if Pn[i] <= r < Pn[i+1]: 
-            """ next reaction will be reaction n°i
-            """
-            reac = i  
-    return (C, reac)
+    L = len(lat[0,:])
+    return update_enabled_reaction(X//L, X%L, lat, geo, rules[0])
 
 
-def update_lattice_configuration(lat, occ, ersl, lsre, reac, loc, DIRECTIONALITY):
-    """ change the lattice configuration with new reaction 
-        and create corresponding event lists (ersl + occ + lsre)
+@jit
+def apply_reaction(lat, reac, loc, DIRECTIONALITY):
+    """ change the lattice configuration with the reaction reac at the site
+        of flat index loc, the event lists are left untouched
     """
-    x = int(loc[0])
-    y = int(loc[1])
+    x = loc//len(lat[0,:]) ; y = loc%len(lat[0,:])
     m = DIRECTIONALITY
     
-    """ check if there is some defect around
+    """ check if there is some defect around, s = sign of the nucleotide 
+    state (0 for a defect)
     """
-    if lat[x,y] != 0: 
-        s = abs(lat[x,y])/lat[x,y]
-    if lat[x+m,y] != 0: # not a defect
-        s1 = abs(lat[x+m,y])/lat[x+m,y]
-    if lat[x+2*m,y] != 0: # not a defect
-        s2 = abs(lat[x+2*m,y])/lat[x+2*m,y]
+    s = np.sign(lat[x,y]) ; s1 = np.sign(lat[x+m,y]) ; s2 = np.sign(lat[x+2*m,y])
         
         
     if reac == 0:  
@@ -485,10 +384,68 @@ def update_lattice_configuration(lat, occ, ersl, lsre, reac, loc, DIRECTIONALITY
         """ the dimer detaches from the lattice 
         """
         lat[x,y] = 0         
+    return lat
+
+
+@jit
+def count_sites(lat, counts, loc, w, DIRECTIONALITY):
+    """ add w to the counts of the states of the sites loc, loc+m, loc+2m 
+        (every site a reaction at loc can change) in the active rows 
+    """
+    l = len(lat[:,0]) ; L = len(lat[0,:])
+    x = loc//L ; y = loc%L
+    for r in range(3):
+        i = x + r*DIRECTIONALITY
+        if 3 < i < l-3:
+            counts[int(lat[i,y]) + 6] += w
+    return counts
+
+
+@jit
+def update_tips(lat, tips, reac, loc):
+    """ update the row of the last dimer of the protofilament of loc, only 
+        a dimer attachment or detachment can move it 
+    """
+    L = len(lat[0,:])
+    x = loc//L ; y = loc%L
+    if reac == 5 and x > tips[y]:
+        tips[y] = x
+    elif reac >= 7 and x == tips[y]:
+        """ go down to the next dimer below the detached tip """
+        while tips[y] >= 3 and lat[tips[y], y] == 0:
+            tips[y] -= 1
+    return tips
+
 
-    """ create the new ersl + occ 
+@jit
+def change_lattice(lat, reac, loc, rules):
+    """ change the lattice configuration with the reaction reac at the site 
+        of flat index loc and update the observables tracker (counts, tips, 
+        cf. Tools.observables) of rules = (DIRECTIONALITY, counts, tips), 
+        rule of the kernels (cf. kMC_Engine.model_kernels)
     """
-    occ, ersl, lsre = scan(lsre, ersl, occ, loc, lat, DIRECTIONALITY)    
-    return (lat, occ, ersl, lsre)
+    DIRECTIONALITY, counts, tips = rules
+    count_sites(lat, counts, loc, -1, DIRECTIONALITY)
+    apply_reaction(lat, reac, loc, DIRECTIONALITY)
+    count_sites(lat, counts, loc, 1, DIRECTIONALITY)
+    update_tips(lat, tips, reac, loc)
+    return lat
 
 
+""" scan, event loop & leap mode of the model """
+KERNELS = model_kernels(MODEL, enabled_reactions, change_lattice, stencil_key)
+scan = KERNELS.scan
+rescan_sites = KERNELS.rescan_sites
+update_lattice_configuration = KERNELS.update_lattice_configuration
+run_events = KERNELS.run_events
+leap_reactions = KERNELS.leap_reactions
+
+
+@jit
+def replay_events(lat, reacs, sites, DIRECTIONALITY):
+    """ re-apply in order the lattice changes of the events (reacs[n], sites[n])
+        of a run, the state of the lattice only depends on them
+    """
+    for n in range(len(reacs)):
+        apply_reaction(lat, reacs[n], sites[n], DIRECTIONALITY)
+    return lat
@@ -0,0 +1,184 @@
+"""
+Description:
+synchronous sublattice parallel kMC of the MoTub model for long lattices
+
+an event only changes the rows up to REACH = 2 away from its site and the
+reactions enabled at a site only depend on the rows up to 3 away from it
+(the 7 rows of the scan window). The active rows are split in n_domains
+domains along the long axis, each domain in a lower and an upper half of at
+least HALF_MIN rows, and the lattice is shared by n_domains worker processes
+
+a cycle runs the same half of every domain at once for the simulated time
+cycle_time, each worker with the exact kMC of its half (the event lists are
+built for the half only) while the other halves are frozen. A worker copies
+the rows [first-BELOW, end+ABOVE) of its half [first, end) at the start of
+the cycle and writes back the rows [first-REACH, end+REACH) at its end. Two
+running halves are one frozen half of at least HALF_MIN = BELOW + REACH
+rows apart, so the rows a worker copies and the rows another worker writes
+back in the same cycle are disjoint, whatever the order of the copies and
+write-backs of the workers. The workers wait for each other at the end of
+every cycle (barrier) and the half of the next cycle is drawn at random,
+the same for every domain. A site only evolves during half of the cycles, so the
+simulated time of the run advances by cycle_time/2 per cycle. The boundary
+of the halves is the only approximation, it vanishes as cycle_time goes
+below the inverse of the fastest rates of the run, while the number of
+events per cycle and worker must stay large for the workers to pay off
+
+every worker has its own random streams spawned from the seed of the run,
+so the final lattice only depends on the seed, the domains and cycle_time
+
+Usage:
+    python kMC_Parallel.py [parameters.json] --domains 4 --time 10
+                           [--cycle 0.01] [--set KEY=VALUE ...] [--out lattice.npy]
+"""
+import argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+import time
+import numpy as np
+import kMC_Library as kMC
+import kMC_main as main
+import Tools as tl
+
+BELOW = 4 ; ABOVE = 3 # inactive rows below & above the half in the copy of a worker (cf. initialize_eventlist)
+REACH = 2 # rows an event can change away from its site, written back at the end of a cycle
+HALF_MIN = max(BELOW, ABOVE) + REACH # minimal height of a half domain (frozen gap between the copies and the writes)
+CYCLE_BLOCK = 2**10 # number of events per call of the kMC kernel
+
+
+def domain_rows(l, n_domains):
+    """ split the active rows [4, l-3) of a lattice of l rows in n_domains
+        domains, return the (n_domains, 3) array of the first, middle and
+        end row of each domain (lower half [first, middle), upper half
+        [middle, end))
+    """
+    edges = 4 + (l - 7)*np.arange(n_domains + 1)//n_domains
+    rows = np.stack((edges[:-1], (edges[:-1] + edges[1:])//2, edges[1:]), axis=1)
+    if np.diff(rows, axis=1).min() < HALF_MIN:
+        raise ValueError("a lattice of %d rows is too short for %d domains" % (l, n_domains))
+    return rows
+
+
+def sublattice_choices(SEED, n_cycles):
+    """ return the half (0 lower, 1 upper) run at each cycle, every worker
+        draws the same ones from the first stream of the run
+    """
+    return kMC.random_streams(SEED)[0].integers(0, 2, n_cycles)
+
+
+def run_cycle(slab, geo, k, bins, rngs, cycle_time, DIRECTIONALITY):
+    """ run the kMC of the active rows of the slab for the simulated time
+        cycle_time, return the number of events
+    """
+    occ, bocc, ersl, pos, lsre = kMC.initialize_eventlist(slab, geo, bins, DIRECTIONALITY)
+    tree = kMC.build_rate_tree(k, occ, bins)
+    counts = tl.observable_counts(slab) ; tips = tl.protofilament_tips(slab)
+    memo = kMC.memo_table(kMC.MEMO_SIZE, kMC.SLOT)
+    reacs = np.zeros(CYCLE_BLOCK, dtype=int) ; sites = np.zeros(CYCLE_BLOCK, dtype=int) ; dt = np.zeros(CYCLE_BLOCK)
+    t = 0. ; n_events = 0
+    while True:
+        """ the draws left when the cycle ends are dropped """
+        u = kMC.draw_events(rngs, CYCLE_BLOCK)
+        t, n = kMC.run_events(slab, geo, occ, bocc, ersl, pos, lsre, tree, k, bins, u, reacs, sites, dt,
+                              t, cycle_time, rngs[3], (DIRECTIONALITY, counts, tips), memo)
+        n_events += n
+        if n < CYCLE_BLOCK:
+            return n_events
+
+
+def run_domain(d, rows, shape, name, P, n_cycles, cycle_time, barrier, results):
+    """ worker of the domain d: run its half of every cycle on the shared
+        lattice name and put (d, number of events) in results
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        lat = np.ndarray(shape, dtype=kMC.STATE, buffer=shm.buf)
+        k = main.rate_constants(P)
+        bins = kMC.model_bins(kMC.MODEL, k)
+        DIRECTIONALITY = P["DIRECTIONALITY"]
+        rngs = kMC.random_streams(kMC.spawn_seed(P["SEED"], d))
+        choices = sublattice_choices(P["SEED"], n_cycles)
+        halves = [(rows[d,0], rows[d,1]), (rows[d,1], rows[d,2])]
+        geos = [tl.lattice_geometry(end - first + BELOW + ABOVE, shape[1], P["SEAM_START"])
+                for first, end in halves]
+
+        n_events = 0
+        for c in range(n_cycles):
+            first, end = halves[choices[c]]
+            slab = lat[first-BELOW:end+ABOVE].copy()
+            n_events += run_cycle(slab, geos[choices[c]], k, bins, rngs, cycle_time, DIRECTIONALITY)
+            """ write back the rows the events of the half can change """
+            lat[first-REACH:end+REACH] = slab[BELOW-REACH:BELOW+end-first+REACH]
+            barrier.wait()
+        results.put((d, n_events))
+    except Exception as e:
+        """ release the other workers waiting at the barrier """
+        barrier.abort()
+        results.put((d, e))
+    finally:
+        shm.close()
+
+
+def run_parallel(P, n_domains, t_max, cycle_time=0.01):
+    """ run the MoTub model with the parameters P on n_domains worker
+        processes up to the simulated time t_max, return the final lattice,
+        the simulated time, the number of events and the final observables
+        (cf. Tools.observables)
+    """
+    lat0 = main.initial_lattice(P)
+    rows = domain_rows(lat0.shape[0], n_domains)
+    n_cycles = int(np.ceil(2*t_max/cycle_time))
+
+    shm = shared_memory.SharedMemory(create=True, size=lat0.nbytes)
+    try:
+        lat = np.ndarray(lat0.shape, dtype=kMC.STATE, buffer=shm.buf)
+        lat[:] = lat0
+        barrier = mp.Barrier(n_domains)
+        results = mp.Queue()
+        workers = [mp.Process(target=run_domain, args=(d, rows, lat0.shape, shm.name, P, n_cycles,
+                                                       cycle_time, barrier, results))
+                   for d in range(n_domains)]
+        for worker in workers:
+            worker.start()
+        events = dict(results.get() for worker in workers)
+        for worker in workers:
+            worker.join()
+        errors = [e for e in events.values() if isinstance(e, Exception)]
+        if errors:
+            """ the error of the worker that aborted the barrier first """
+            raise min(errors, key=lambda e: isinstance(e, threading.BrokenBarrierError))
+        lat = lat.copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return (lat, n_cycles*cycle_time/2, sum(events.values()),
+            tl.observables(tl.observable_counts(lat), tl.protofilament_tips(lat)))
+
+
+def main_parallel(argv=None):
+    parser = argparse.ArgumentParser(description="synchronous sublattice parallel kMC of the MoTub model")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults of kMC_main")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter, can be repeated")
+    parser.add_argument("--domains", type=int, default=mp.cpu_count(), help="number of domains (worker processes)")
+    parser.add_argument("--time", type=float, required=True, help="simulated time of the run [s]")
+    parser.add_argument("--cycle", type=float, default=0.01, help="simulated time run by a half in a cycle [s]")
+    parser.add_argument("--out", default=None, help="file of the final lattice (.npy)")
+    args = parser.parse_args(argv)
+    try:
+        P = main.load_parameters(args.parameters, args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    t_init = time.time()
+    lat, t, n_events, obs = run_parallel(P, args.domains, args.time, args.cycle)
+    t_comput = time.time() - t_init
+    if args.out is not None:
+        np.save(args.out, lat)
+    print(n_events, "events in", round(t_comput, 1), "s on", args.domains, "domains,",
+          round(n_events/t_comput), "events per s")
+
+
+if __name__ == "__main__":
+    main_parallel()
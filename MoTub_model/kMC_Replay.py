@@ -0,0 +1,133 @@
+"""
+Description:
+replay of a MoTub run from its event log (cf. kMC_EventLog)
+
+the lattice only depends on the initial lattice and on the sequence of the
+(reaction, site) events, so any frame of a run is rebuilt by re-applying the
+lattice changes of the events (kMC_Library.replay_events), without the event
+lists nor the random numbers
+
+a keyframe index stores the lattice (int8) every KEYFRAME_TICKS events with
+the tick, the simulated time and the record offset of each keyframe in the
+log: a frame at any tick, or at any simulated time, is rebuilt from the
+nearest keyframe before it by replaying at most KEYFRAME_TICKS events, so a
+run of 10^9 events is analysed without storing all its snapshots
+
+Usage:
+    python kMC_Replay.py events.log [--every 100000] [--out events.keys.npz]
+"""
+import argparse
+import os
+import numpy as np
+import kMC_Library as kMC
+import kMC_EventLog as evlog
+import kMC_main as main
+
+KEYFRAME_TICKS = 10**5 # default number of events between 2 keyframes
+CHUNK = 2**20 # number of events read from the log at once
+
+
+def build_keyframe_index(log_path, every=KEYFRAME_TICKS, lat=None):
+    """ replay the whole event log and return its keyframe index, a dict of
+        ticks, times, offsets: tick, simulated time and byte offset in the log
+                               of each keyframe
+        frames: lattice (int8) of each keyframe
+        log, DIRECTIONALITY, shape: replay settings
+        lat is the initial lattice of the run, rebuilt from the parameters of
+        the log header by default
+    """
+    header, records = evlog.read_event_log(log_path)
+    P = header["parameters"]
+    if lat is None:
+        lat = main.initial_lattice(P)
+    lat = np.array(lat, dtype=kMC.STATE)
+    DIRECTIONALITY = P["DIRECTIONALITY"]
+    offset = records.offset if isinstance(records, np.memmap) else 0
+
+    n_events = len(records)
+    ticks = np.arange(0, n_events + 1, every)
+    times = np.zeros(len(ticks))
+    frames = np.zeros((len(ticks),) + lat.shape, dtype=np.int8)
+    frames[0] = lat
+
+    t = 0.
+    for key in range(1, len(ticks)):
+        for start in range(ticks[key-1], ticks[key], CHUNK):
+            end = min(start + CHUNK, ticks[key])
+            chunk = np.array(records[start:end])
+            kMC.replay_events(lat, chunk["reac"], chunk["site"], DIRECTIONALITY)
+            """ same sequential sum as the simulated time of the run """
+            t = np.cumsum(np.concatenate(([t], chunk["dt"])))[-1]
+        times[key] = t
+        frames[key] = lat
+
+    return {"ticks": ticks, "times": times,
+            "offsets": offset + ticks*evlog.EVENT_DTYPE.itemsize,
+            "frames": frames, "log": os.path.abspath(log_path),
+            "DIRECTIONALITY": DIRECTIONALITY, "shape": lat.shape}
+
+
+def save_keyframe_index(path, index):
+    """ save the keyframe index in path (.npz) """
+    np.savez_compressed(path, **index)
+
+
+def load_keyframe_index(path):
+    """ return the keyframe index saved in path """
+    with np.load(path) as data:
+        index = {key: data[key] for key in data.files}
+    index["log"] = str(index["log"])
+    index["DIRECTIONALITY"] = int(index["DIRECTIONALITY"])
+    index["shape"] = tuple(index["shape"])
+    return index
+
+
+def lattice_at(index, tick):
+    """ return the lattice after the first tick events of the run """
+    header, records = evlog.read_event_log(index["log"])
+    if not 0 <= tick <= len(records):
+        raise ValueError("tick %d is out of the log (%d events)" % (tick, len(records)))
+    key = np.searchsorted(index["ticks"], tick, side="right") - 1
+    lat = index["frames"][key].astype(kMC.STATE)
+    for start in range(index["ticks"][key], tick, CHUNK):
+        chunk = np.array(records[start:min(start + CHUNK, tick)])
+        kMC.replay_events(lat, chunk["reac"], chunk["site"], index["DIRECTIONALITY"])
+    return lat
+
+
+def tick_at_time(index, t):
+    """ return the number of events of the run done at the simulated time t """
+    header, records = evlog.read_event_log(index["log"])
+    key = np.searchsorted(index["times"], t, side="right") - 1
+    tick = index["ticks"][key] ; t_event = index["times"][key]
+    while tick < len(records):
+        chunk = np.array(records[tick:tick + CHUNK]["dt"])
+        times = np.cumsum(np.concatenate(([t_event], chunk)))[1:]
+        n = np.searchsorted(times, t, side="right")
+        tick += n
+        if n < len(chunk):
+            break
+        t_event = times[-1]
+    return int(tick)
+
+
+def lattice_at_time(index, t):
+    """ return the lattice at the simulated time t and the corresponding tick """
+    tick = tick_at_time(index, t)
+    return (lattice_at(index, tick), tick)
+
+
+def main_replay(argv=None):
+    parser = argparse.ArgumentParser(description="keyframe index of the event log of a MoTub run")
+    parser.add_argument("log", help="event log of the run (cf. EVENT_LOG)")
+    parser.add_argument("--every", type=int, default=KEYFRAME_TICKS, help="number of events between 2 keyframes")
+    parser.add_argument("--out", default=None, help="keyframe index file (default: LOG.keys.npz)")
+    args = parser.parse_args(argv)
+    out = args.out if args.out is not None else args.log + ".keys.npz"
+    index = build_keyframe_index(args.log, args.every)
+    save_keyframe_index(out, index)
+    print(len(index["ticks"]), "keyframes saved in", out)
+
+
+if __name__ == "__main__":
+    main_replay()
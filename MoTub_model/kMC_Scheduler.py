@@ -0,0 +1,3 @@
+""" Physical-time scheduler of the observers of a run (cf. kMC_core/kMC_Scheduler.py) """
+import kMC_Backend
+from kMC_core.kMC_Scheduler import *
@@ -0,0 +1,168 @@
+"""
+Chunked & compressed store of lattice snapshots
+
+a store is a directory holding
+    meta.json: format, lattice shape, number of snapshots per chunk and
+               parameters of the run
+    data.bin: the chunks one after the other, a chunk is CHUNK snapshots
+              of the lattice as int8 (every state of the MoTub model fits in
+              [-6, 6]) compressed with zlib
+    chunks.npy: offset, size in bytes and number of snapshots of each chunk
+    snapshots.npy: simulated time, tick and chunk of each snapshot
+
+the bulk of a lattice is made of long runs of the same state and two close
+snapshots are nearly the same, so a chunk compresses much more than one
+snapshot alone. The snapshots of the current chunk are kept in memory,
+write_snapshot only compresses & appends a full chunk, flush_snapshot_store
+writes the partial one (e.g. before a checkpoint)
+
+read_snapshot_store maps data.bin in memory and decompresses a chunk only
+when one of its snapshots is read (the last chunk read is kept)
+"""
+import json
+import os
+import zlib
+import numpy as np
+
+FORMAT = 1 # version of the store layout
+CHUNK = 64 # number of snapshots per chunk
+LEVEL = 6 # zlib compression level
+SNAPSHOT_DTYPE = np.dtype([("t", "<f8"), ("tick", "<i8"), ("chunk", "<i8")])
+CHUNK_DTYPE = np.dtype([("offset", "<i8"), ("size", "<i8"), ("count", "<i8")])
+
+
+def save_array(path, array):
+    """ replace atomically the array saved in path (.npy) """
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def read_store_index(path):
+    """ return the chunks & snapshots tables of the store path """
+    chunks = np.load(os.path.join(path, "chunks.npy"))
+    snapshots = np.load(os.path.join(path, "snapshots.npy"))
+    return (chunks, snapshots)
+
+
+def decompress_chunk(data, chunk, shape):
+    """ return the snapshots (int8) of the chunk of the store data """
+    raw = zlib.decompress(bytes(data[chunk["offset"]:chunk["offset"] + chunk["size"]]))
+    return np.frombuffer(raw, dtype=np.int8).reshape((int(chunk["count"]),) + tuple(shape))
+
+
+def open_snapshot_store(path, shape, P, t=None, chunk=CHUNK):
+    """ return the store path (dict) to give to write_snapshot,
+        a new store is created for t = None, otherwise the store of the same
+        run is kept up to the snapshots before the simulated time t (resumed run)
+    """
+    store = {"path": path, "shape": tuple(shape), "chunk": chunk, "buffer": [], "times": [], "ticks": []}
+    if t is None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"format": FORMAT, "shape": list(shape), "chunk": chunk, "parameters": P}, f)
+        open(os.path.join(path, "data.bin"), "wb").close()
+        store["chunks"] = np.zeros(0, dtype=CHUNK_DTYPE)
+        store["snapshots"] = np.zeros(0, dtype=SNAPSHOT_DTYPE)
+        store["data"] = open(os.path.join(path, "data.bin"), "ab")
+        save_array(os.path.join(path, "chunks.npy"), store["chunks"])
+        save_array(os.path.join(path, "snapshots.npy"), store["snapshots"])
+        return store
+
+    chunks, snapshots = read_store_index(path)
+    keep = np.searchsorted(snapshots["t"], t, side="left") # snapshots before t
+    c = snapshots["chunk"][keep] if keep < len(snapshots) else len(chunks)
+    if c < len(chunks):
+        """ the snapshots of the chunk c before t are put back in memory
+        """
+        with open(os.path.join(path, "data.bin"), "rb") as f:
+            data = f.read()
+        first = keep - np.searchsorted(snapshots["chunk"], c, side="left")
+        lats = decompress_chunk(data, chunks[c], shape)[:first]
+        store["buffer"] = [lat.copy() for lat in lats]
+        store["times"] = list(snapshots["t"][keep-first:keep])
+        store["ticks"] = list(snapshots["tick"][keep-first:keep])
+        keep -= first
+    end = chunks["offset"][c] if c < len(chunks) else (chunks["offset"][-1] + chunks["size"][-1] if len(chunks) else 0)
+    with open(os.path.join(path, "data.bin"), "r+b") as f:
+        f.truncate(end)
+    store["chunks"] = chunks[:c]
+    store["snapshots"] = snapshots[:keep]
+    store["data"] = open(os.path.join(path, "data.bin"), "ab")
+    save_array(os.path.join(path, "chunks.npy"), store["chunks"])
+    save_array(os.path.join(path, "snapshots.npy"), store["snapshots"])
+    return store
+
+
+def write_snapshot(store, lat, t, tick):
+    """ add the snapshot of the lattice lat at the simulated time t """
+    store["buffer"].append(lat.astype(np.int8))
+    store["times"].append(t)
+    store["ticks"].append(tick)
+    if len(store["buffer"]) >= store["chunk"]:
+        flush_snapshot_store(store)
+
+
+def flush_snapshot_store(store):
+    """ compress & append the snapshots in memory as one chunk """
+    if not store["buffer"]:
+        return
+    raw = zlib.compress(np.stack(store["buffer"]).tobytes(), LEVEL)
+    f = store["data"]
+    offset = f.tell()
+    f.write(raw)
+    f.flush()
+    os.fsync(f.fileno())
+
+    chunk = np.array([(offset, len(raw), len(store["buffer"]))], dtype=CHUNK_DTYPE)
+    snapshots = np.zeros(len(store["buffer"]), dtype=SNAPSHOT_DTYPE)
+    snapshots["t"] = store["times"]
+    snapshots["tick"] = store["ticks"]
+    snapshots["chunk"] = len(store["chunks"])
+    store["chunks"] = np.concatenate((store["chunks"], chunk))
+    store["snapshots"] = np.concatenate((store["snapshots"], snapshots))
+    save_array(os.path.join(store["path"], "chunks.npy"), store["chunks"])
+    save_array(os.path.join(store["path"], "snapshots.npy"), store["snapshots"])
+    store["buffer"] = [] ; store["times"] = [] ; store["ticks"] = []
+
+
+def close_snapshot_store(store):
+    """ write the snapshots in memory and close the store """
+    flush_snapshot_store(store)
+    store["data"].close()
+
+
+def read_snapshot_store(path):
+    """ return the store path (dict) to read lazily, with
+        t, tick: simulated time & tick of every snapshot
+        parameters, shape: parameters of the run & shape of the lattice
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["format"] != FORMAT:
+        raise ValueError("unsupported snapshot store format %d" % meta["format"])
+    chunks, snapshots = read_store_index(path)
+    data = np.zeros(0, dtype=np.uint8)
+    if len(chunks):
+        data = np.memmap(os.path.join(path, "data.bin"), dtype=np.uint8, mode="r",
+                         shape=(int(chunks["offset"][-1] + chunks["size"][-1]),))
+    return {"t": snapshots["t"], "tick": snapshots["tick"], "parameters": meta["parameters"],
+            "shape": tuple(meta["shape"]), "chunks": chunks, "snapshots": snapshots,
+            "data": data, "cache": (-1, None)}
+
+
+def snapshot(reader, i):
+    """ return the i-th snapshot (int8) of the store opened by read_snapshot_store """
+    c = int(reader["snapshots"]["chunk"][i])
+    if reader["cache"][0] != c:
+        reader["cache"] = (c, decompress_chunk(reader["data"], reader["chunks"][c], reader["shape"]))
+    first = np.searchsorted(reader["snapshots"]["chunk"], c, side="left")
+    return reader["cache"][1][i - first]
+
+
+def snapshot_at_time(reader, t):
+    """ return the last snapshot at or before the simulated time t and its index """
+    i = np.searchsorted(reader["t"], t, side="right") - 1
+    if i < 0:
+        raise ValueError("no snapshot before t = %g" % t)
+    return (snapshot(reader, i), i)
@@ -1,123 +1,359 @@
 """
 Created on May 202
 @author: William Lecompte
-Description: 
-kMC simulation based on the VSS method for modelling 
+Description:
+kMC simulation based on the VSS method for modelling
 a simple 2-head motors walk along a 2D lattice + local scan + list of list
+
+Usage:
+    python kMC_main.py [parameters.json] [--set KEY=VALUE ...] [--visualise]
+    python kMC_main.py --resume checkpoint.npz [--set KEY=VALUE ...]
+
+the run is headless unless --visualise is given, matplotlib is only imported
+in that case. With CHECKPOINT_FILE set, the complete state is saved every
+CHECKPOINT_TICKS loops and/or CHECKPOINT_SECONDS of wall time (and at the
+end), --resume continues such a run exactly as if it was never stopped
+(--set TICK_MAX=... to extend it). With EVENT_LOG set, the reaction, the site
+and the waiting time of every event are streamed to a binary log
+(cf. kMC_EventLog). With SNAPSHOT_STORE set, the lattice is sampled every
+SNAPSHOT_TIME of simulated time in a compressed store (cf. kMC_Snapshot),
+with OBSERVABLES_FILE set, the observables are sampled every OBSERVABLES_TIME
+in a .npy time series (cf. Tools.observables). The frames of --visualise, the
+snapshots and the observables are sampled at fixed simulated times
+(cf. kMC_Scheduler). With LEAP_TOLERANCE > 0, the hydrolysis and the
+relaxation are not selected one by one but fired together at fixed leaps of
+time (approximate mode, cf. kMC_Kernels.leap_reactions in kMC_core)
 """
+import argparse
+import json
+import os
 import numpy as np
-import random as rd
 import time
-import matplotlib.pyplot as plt
 import kMC_Library as kMC
+import kMC_Checkpoint as ckpt
+import kMC_EventLog as evlog
+import kMC_Snapshot as snap
+import kMC_Scheduler as sched
 import Tools as tl
 
+""" Default parameters for initial lattice configuration
+    and for the MoTub model, a parameter file (json) and the --set KEY=VALUE
+    options override them
+"""
+PARAMETERS = {
+    "SEED": 18, # Seed initialization, an int or [entropy, spawn key...] (cf. kMC_Library.random_streams)
+    "TICK_MAX": 1*10**4, # Stop condiontion on loops
+    "VISU_TIME": 0.1, # simulated time between 2 frames [s]
+
+    "BOX_LENGTH": 200,
+    "BOX_WIDTH": 13,
+    "SEAM_START": 3, # helix start number, the seam shifts the protofilaments by SEAM_START/2 dimers
+    "LATTICE_HEIGHT": 100, # int(0.5*BOX_LENGTH)
+    "SEED_HEIGHT": 3,
+    "CAP_HEIGHT": 3,
+
+    "k_MOTOR_DETACH": 1, # in s-1
+    "ENHANCED_FACTOR": 100,
+    "MOTOR_DENSITY": 0.0, # motor density
+    "k_WALK": 100, # in s-1
+
+    "HYDROLYSIS_TIME": 5/3, # in s
+    "k_DIMER_ATTACH": 20, # in s-1
+    "RELAXATION_TIME": 0.1, # in s
+
+    "TOTAL_BINDING_ENERGY_GDP_TUBULIN": 45, # in kT
+    "ANISOTROPY": 0.5,
+    "CONSTRAST": 1.28,
+
+    "MOTOR_DESTABILIZATION": 2, # in kT
+    "DIRECTIONALITY": 1,
+    "LEAP_TOLERANCE": 0, # approximate leap mode of the hydrolysis & relaxation, leap time = LEAP_TOLERANCE/max(k4, k6), 0 for the exact kMC
+
+    "CHECKPOINT_FILE": None, # path of the checkpoint (.npz), None for no checkpoint
+    "CHECKPOINT_TICKS": 0, # loops between 2 checkpoints, 0 for no periodic checkpoint
+    "CHECKPOINT_SECONDS": 0, # wall time between 2 checkpoints [s], 0 for no periodic checkpoint
+
+    "EVENT_LOG": None, # path of the binary log of every event (cf. kMC_EventLog), None for no log
+    "SNAPSHOT_STORE": None, # directory of the lattice snapshots (cf. kMC_Snapshot), None for no snapshot
+    "SNAPSHOT_TIME": 1, # simulated time between 2 snapshots [s]
+    "OBSERVABLES_FILE": None, # path of the time series of the observables (.npy), None for no time series
+    "OBSERVABLES_TIME": 0.1, # simulated time between 2 samples of the observables [s]
+}
+
+EVENT_BLOCK = 10**4 # number of events per call of the kMC kernel for a headless run
+
+
+def load_parameters(path=None, overrides=(), defaults=PARAMETERS):
+    """ return the default parameters updated with the parameter file (json)
+        at path and then with the "KEY=VALUE" strings of overrides,
+        a VALUE is read as json (a plain string otherwise)
+    """
+    P = dict(PARAMETERS)
+    P.update(defaults)
+    updates = []
+    if path is not None:
+        with open(path) as f:
+            updates += list(json.load(f).items())
+    for item in overrides:
+        key, _, value = item.partition("=")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        updates.append((key.strip(), value))
+    for key, value in updates:
+        if key not in P:
+            raise KeyError("unknown parameter %s" % key)
+        P[key] = value
+    return P
+
+
+def save_series(path, series, L):
+    """ replace atomically the time series of the observables saved in path """
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.array(series, dtype=tl.observables_dtype(L)))
+    os.replace(path + ".tmp", path)
+
+
 def forceAspect(ax,aspect):
     im = ax.get_images()
     extent =  im[0].get_extent()
     ax.set_aspect(abs((extent[1]-extent[0])/(extent[3]-extent[2]))/aspect)
 
-t_init = time.time()
-rd.seed(18) # Seed initialization 
-tick_max = 1*10**4 # Stop condiontion on loops 
 
-""" Parameters for initial lattice configuration 
-     and for the MoTub model 
-"""
-t = 0 # Initial time
-BOX_LENGTH = 200 
-BOX_WIDTH = 13 
-LATTICE_HEIGHT = 100# int(0.5*BOX_LENGTH)
-SEED_HEIGHT = 3
-CAP_HEIGHT = 3
-
-DEFECT_X_POSITION = int(0.5*LATTICE_HEIGHT)
-DEFECT_Y_POSITION = int(0.5*BOX_WIDTH)
-
-Nr = 7 + (3*3*5*5)*2 # Nbr of rate constants
-k_MOTOR_DETACH = 1 # in s-1 
-ENHANCED_FACTOR = 100  
-MOTOR_DENSITY = 0.0 # motor density
-k_MOTOR_ATTACH = tl.attachment_rate_cte(MOTOR_DENSITY, k_MOTOR_DETACH, 0) 
-k_WALK = 100 # in s-1
-
-HYDROLYSIS_TIME = 5/3 # in s
-k_DIMER_ATTACH = 20 # in s-1
-RELAXATION_TIME = 0.1 # in s
-
-TOTAL_BINDING_ENERGY_GDP_TUBULIN = 45 # in kT
-ANISOTROPY = 0.5
-LONGITUDINAL_ENERGY_GDP_TUBULIN = (1/(2*(1+ANISOTROPY)))*TOTAL_BINDING_ENERGY_GDP_TUBULIN
-LATERAL_ENERGY_GDP_TUBULIN = ANISOTROPY*LONGITUDINAL_ENERGY_GDP_TUBULIN
-
-CONSTRAST = 1.28 
-STABILIZATION_GTP_TUBULIN = 0.5*(CONSTRAST-1)*TOTAL_BINDING_ENERGY_GDP_TUBULIN
-LONGITUDINAL_ENERGY_GTP_TUBULIN = LONGITUDINAL_ENERGY_GDP_TUBULIN + STABILIZATION_GTP_TUBULIN
-LATERAL_ENERGY_GTP_TUBULIN = LATERAL_ENERGY_GDP_TUBULIN
-
-MOTOR_DESTABILIZATION = 2 # in kT
-DIRECTIONALITY = 1 
-
-""" Initialize the lattice + event lists 
-    lat: lattice of size (n,m)
-    k: rate constant vector
-    occ: number of enabled site for each reaction type, it's the occurence vector
-    ersl: enabled reaction site list, it's an one-hot encoding matrice     
-"""
-lat = kMC.latice_initialization(BOX_LENGTH, BOX_WIDTH, LATTICE_HEIGHT, SEED_HEIGHT, CAP_HEIGHT,
-                                DEFECT_X_POSITION, DEFECT_Y_POSITION)
-k = kMC.rate_constant_initizalition(k_MOTOR_ATTACH, k_MOTOR_DETACH, ENHANCED_FACTOR, k_WALK,
-                                    HYDROLYSIS_TIME, k_DIMER_ATTACH, RELAXATION_TIME, LONGITUDINAL_ENERGY_GDP_TUBULIN,
-                                    LATERAL_ENERGY_GDP_TUBULIN, LONGITUDINAL_ENERGY_GTP_TUBULIN,
-                                    LATERAL_ENERGY_GTP_TUBULIN, MOTOR_DESTABILIZATION)
-occ, ersl, lsre = kMC.initialize_eventlist(lat, Nr, DIRECTIONALITY)
-
-""" Initialized observables 
-"""
-tick = 0 # number of loops 
-tick_visu = 250 # number of loops between 2 frames
+def initial_lattice(P):
+    """ return the initial lattice of a run with the parameters P """
+    DEFECT_X_POSITION = int(0.5*P["LATTICE_HEIGHT"])
+    DEFECT_Y_POSITION = int(0.5*P["BOX_WIDTH"])
+    return kMC.latice_initialization(P["BOX_LENGTH"], P["BOX_WIDTH"], P["LATTICE_HEIGHT"],
+                                     P["SEED_HEIGHT"], P["CAP_HEIGHT"],
+                                     DEFECT_X_POSITION, DEFECT_Y_POSITION)
 
-""" Lattice visualisation over time
-"""
-fig, ax = plt.subplots(figsize=(12,12)) # Visu
-title = ax.text(0.5,1.25, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
-                transform=ax.transAxes, ha="center")
-title.set_text(r"# Loops = {},".format(tick)+" t = {}s".format(np.round(t,2)))
-im = ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-1,vmax=1)
-ax.set_ylim(0,.5)
-ax.set_xlim(0,BOX_LENGTH)
-plt.axis('on')
-plt.draw()
-plt.tight_layout()
-
-""" loop the simulation while the stop condition is not verified
-"""
-while tick < tick_max: 
-    r = rd.random() # 1st draw 
-    C, reac = kMC.next_reaction_draw(k, occ, r)
-    
-    r = rd.random() # 2nd draw
-    t += -(np.log(r)/C) # Simulated time evolution
-    
-    r = rd.randint(0,int(occ[reac])-1) # 3rd draw
-    loc = ersl[reac][r]
-    
-    lat, occ, ersl, lsre = kMC.update_lattice_configuration(lat, occ, ersl, lsre, reac, loc, DIRECTIONALITY)
-    tick += 1
-    
-    """ lattice visualisation update
+
+def rate_constants(P):
+    """ return the rate constant vector k of the MoTub model with the parameters P """
+    k_MOTOR_ATTACH = tl.attachment_rate_cte(P["MOTOR_DENSITY"], P["k_MOTOR_DETACH"], 0)
+
+    TOTAL_BINDING_ENERGY_GDP_TUBULIN = P["TOTAL_BINDING_ENERGY_GDP_TUBULIN"]
+    ANISOTROPY = P["ANISOTROPY"]
+    LONGITUDINAL_ENERGY_GDP_TUBULIN = (1/(2*(1+ANISOTROPY)))*TOTAL_BINDING_ENERGY_GDP_TUBULIN
+    LATERAL_ENERGY_GDP_TUBULIN = ANISOTROPY*LONGITUDINAL_ENERGY_GDP_TUBULIN
+
+    STABILIZATION_GTP_TUBULIN = 0.5*(P["CONSTRAST"]-1)*TOTAL_BINDING_ENERGY_GDP_TUBULIN
+    LONGITUDINAL_ENERGY_GTP_TUBULIN = LONGITUDINAL_ENERGY_GDP_TUBULIN + STABILIZATION_GTP_TUBULIN
+    LATERAL_ENERGY_GTP_TUBULIN = LATERAL_ENERGY_GDP_TUBULIN
+
+    k = kMC.rate_constant_initizalition(k_MOTOR_ATTACH, P["k_MOTOR_DETACH"], P["ENHANCED_FACTOR"], P["k_WALK"],
+                                        P["HYDROLYSIS_TIME"], P["k_DIMER_ATTACH"], P["RELAXATION_TIME"],
+                                        LONGITUDINAL_ENERGY_GDP_TUBULIN, LATERAL_ENERGY_GDP_TUBULIN,
+                                        LONGITUDINAL_ENERGY_GTP_TUBULIN, LATERAL_ENERGY_GTP_TUBULIN,
+                                        P["MOTOR_DESTABILIZATION"])
+    return k
+
+
+def run(P, visualise=False, resume=None):
+    """ run the kMC simulation of the MoTub model with the parameters P,
+        or continue the one saved in the checkpoint file resume,
+        return the final lattice, the simulated time, the number of events
+        and the final observables (cf. Tools.observables)
     """
-    if tick%tick_visu == 0:
-        plt.cla()
-        title = ax.text(0.5, 3, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
-                transform=ax.transAxes, ha="center")
-        title.set_text(r"# Loops= {},".format(tick)+" t = {} s".format(np.round(t,2)))
-        ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-6,vmax=6)
+    DIRECTIONALITY = P["DIRECTIONALITY"]
+
+    """ Initialize the lattice + event lists
+        lat: lattice of size (n,m)
+        k: rate constant vector
+        bins: power-of-2 rate bins of the reactions (cf. kMC_Engine.rate_bins)
+        occ: number of enabled site for each reaction type, it's the occurence vector
+        bocc: number of enabled (reaction, site) pairs of each rate bin
+        tree: binary sum tree of the total rates of the bins, tree[1] is the total rate
+        ersl: enabled reaction site list, ersl[g] = array of the enabled pairs x*Nr + reac of the bin g
+        lsre: lsre[x] = sorted reactions enabled at the site x, padded with -1
+        pos: pos[x,s] = position of the pair (lsre[x,s], x) in its ersl array
+        geo: flat indices of the neighbors of every site, seam included (cf. Tools.lattice_geometry)
+        counts, tips: observables tracker updated at every event (cf. Tools.observables)
+    """
+    k = rate_constants(P)
+    """ the leaped reactions (hydrolysis & relaxation) are left out of the
+    exact selection and fired together every tau_leap, at the times
+    n*tau_leap (cf. kMC_Engine.leap_rates)
+    """
+    tau_leap, k_exact = kMC.leap_rates(kMC.MODEL, k, P["LEAP_TOLERANCE"])
+    leap = tau_leap < np.inf
+    bins = kMC.model_bins(kMC.MODEL, k_exact)
+    geo = tl.lattice_geometry(P["BOX_LENGTH"], P["BOX_WIDTH"], P["SEAM_START"])
+    if resume is None:
+        rngs = kMC.random_streams(P["SEED"])
+        t = 0 # Initial time
+        tick = 0 # number of events
+        loops = 0 # number of loops of the exact kMC (tick without the leaped events)
+        lat = initial_lattice(P)
+        occ, bocc, ersl, pos, lsre = kMC.initialize_eventlist(lat, geo, bins, DIRECTIONALITY)
+    else:
+        """ the random generators are restored with the lattice and event lists
+        """
+        lat, occ, bocc, ersl, pos, lsre, t, tick, loops, rngs = ckpt.load_checkpoint(resume, bins)
+    tree = kMC.build_rate_tree(k_exact, occ, bins)
+    memo = kMC.memo_table(kMC.MEMO_SIZE, kMC.SLOT)
+    n_leap = int(np.floor(t/tau_leap)) + 1 if leap else 0
+    t_leap = n_leap*tau_leap if leap else np.inf
+    counts = tl.observable_counts(lat) ; tips = tl.protofilament_tips(lat)
+    rules = (DIRECTIONALITY, counts, tips)
+
+    """ Initialized observables, observers = (interval, callback(T, tick))
+        called at the simulated times n*interval
+    """
+    tick_max = P["TICK_MAX"]
+    observers = []
+
+    if visualise:
+        """ Lattice visualisation over time
+        """
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(12,12)) # Visu
+        title = ax.text(0.5,1.25, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
+                        transform=ax.transAxes, ha="center")
+        title.set_text(r"# Loops = {},".format(tick)+" t = {}s".format(np.round(t,2)))
+        im = ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-1,vmax=1)
+        ax.set_ylim(0,.5)
+        ax.set_xlim(0,P["BOX_LENGTH"])
         plt.axis('on')
         plt.draw()
-        plt.pause(.1)
+        plt.tight_layout()
+
+        def draw(T, tick):
+            """ lattice visualisation update
+            """
+            plt.cla()
+            title = ax.text(0.5, 3, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
+                    transform=ax.transAxes, ha="center")
+            title.set_text(r"# Loops= {},".format(tick)+" t = {} s".format(np.round(T,2)))
+            ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-6,vmax=6)
+            plt.axis('on')
+            plt.draw()
+            plt.pause(.1)
+        observers.append((P["VISU_TIME"], draw))
+
+    """ checkpoints, every_ticks (resp. every_seconds) = 0 for no periodic
+        checkpoint on loops (resp. on wall time)
+    """
+    checkpoint = P["CHECKPOINT_FILE"]
+    every_ticks = P["CHECKPOINT_TICKS"] if checkpoint is not None else 0
+    every_seconds = P["CHECKPOINT_SECONDS"] if checkpoint is not None else 0
+    last_checkpoint = time.time()
+
+    """ event log, a resumed run continues the log of its checkpoint
+    """
+    log = None
+    if P["EVENT_LOG"] is not None:
+        log = evlog.open_event_log(P["EVENT_LOG"], {"model": "MoTub", "shape": lat.shape, "parameters": P}, tick)
+
+    """ snapshots of the lattice every SNAPSHOT_TIME
+    """
+    store = None
+    if P["SNAPSHOT_STORE"] is not None:
+        store = snap.open_snapshot_store(P["SNAPSHOT_STORE"], lat.shape, P, None if resume is None else t)
+        observers.append((P["SNAPSHOT_TIME"], lambda T, tick: snap.write_snapshot(store, lat, T, tick)))
+
+    """ time series of the observables every OBSERVABLES_TIME, a resumed run
+        keeps the samples before its checkpoint
+    """
+    series_file = P["OBSERVABLES_FILE"] ; series = []
+    if series_file is not None:
+        if resume is not None and os.path.exists(series_file):
+            series = [row for row in np.load(series_file) if row["t"] < t]
+        observers.append((P["OBSERVABLES_TIME"],
+                          lambda T, tick: series.append(tl.observables_row(T, tick, counts, tips))))
+    scheduler = sched.new_scheduler(t, observers)
+
+    """ loop the simulation while the stop condition is not verified
+    """
+    while loops < tick_max:
+        """ 3 draws per event: rate bin, waiting time and reaction & site in
+        the bin (+ the rejected trials from rngs[3] and the leaps from 
+        rngs[4]), the trajectory does not depend on the size of the blocks of 
+        events
+        """
+        n_events = min(EVENT_BLOCK, tick_max - loops)
+        if every_ticks:
+            n_events = min(n_events, every_ticks - loops%every_ticks)
+        u = kMC.draw_events(rngs, n_events)
+        reacs = np.zeros(n_events, dtype=int) ; sites = np.zeros(n_events, dtype=int) ; dt = np.zeros(n_events)
+        done = 0 ; leaps = [] ; n_leaped = 0
+        while done < n_events:
+            t, n = kMC.run_events(lat, geo, occ, bocc, ersl, pos, lsre, tree, k_exact, bins, u[done:], reacs[done:],
+                                  sites[done:], dt[done:], t, min(sched.next_time(scheduler), t_leap), rngs[3],
+                                  rules, memo)
+            done += n
+            if done < n_events and t_leap <= sched.next_time(scheduler):
+                """ the next event occurs after the next leap, its waiting time
+                restarts at t_leap (memoryless) with the rates after the leap
+                """
+                u[done,1] = max(u[done,1] - (t_leap - t)*tree[1], 0.)
+                leap_reacs, leap_sites = kMC.leap_reactions(lat, geo, occ, bocc, ersl, pos, lsre, tree, k_exact,
+                                                            bins, k, tau_leap, rngs[4], rules, memo)
+                leaps.append((done, leap_reacs, leap_sites, t_leap - t))
+                n_leaped += len(leap_reacs)
+                t = t_leap ; n_leap += 1 ; t_leap = n_leap*tau_leap
+            elif done < n_events:
+                """ the next event occurs after the next sampling time """
+                sched.fire_observers(scheduler, tick + done + n_leaped)
+        loops += n_events
+        tick += n_events + n_leaped
+        if leaps:
+            """ the leaped events are put back in the block at their place, the
+            first one of a leap waits from the previous event to the leap (the
+            next event for an empty leap)
+            """
+            reacs, sites, dt = kMC.insert_leaps(reacs, sites, dt, leaps)
+        if log is not None:
+            evlog.log_events(log, reacs, sites, dt)
+
+        if (every_ticks and loops%every_ticks == 0) or (every_seconds and time.time() - last_checkpoint >= every_seconds):
+            if log is not None:
+                evlog.flush_event_log(log)
+            if store is not None:
+                snap.flush_snapshot_store(store)
+            if series_file is not None:
+                save_series(series_file, series, lat.shape[1])
+            ckpt.save_checkpoint(checkpoint, lat, bocc, ersl, t, tick, loops, rngs, P)
+            last_checkpoint = time.time()
+
+    if log is not None:
+        evlog.close_event_log(log)
+    if store is not None:
+        snap.close_snapshot_store(store)
+    if series_file is not None:
+        save_series(series_file, series, lat.shape[1])
+    if checkpoint is not None:
+        ckpt.save_checkpoint(checkpoint, lat, bocc, ersl, t, tick, loops, rngs, P)
+    return (lat, t, tick, tl.observables(counts, tips))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="kMC simulation of the MoTub model")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter, can be repeated")
+    parser.add_argument("--visualise", action="store_true", help="animate the lattice with matplotlib")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="continue the run saved in a checkpoint file (.npz)")
+    args = parser.parse_args(argv)
+    try:
+        if args.resume is not None:
+            """ the parameters of the checkpointed run are the defaults """
+            P = load_parameters(args.parameters, args.set, ckpt.read_parameters(args.resume))
+        else:
+            P = load_parameters(args.parameters, args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    t_init = time.time()
+    tick_init = 0 if args.resume is None else ckpt.read_tick(args.resume)
+    lat, t, tick, obs = run(P, args.visualise, args.resume)
+    t_comput = time.time() - t_init # time to compute the script
+    v_loop = t_comput/max(tick - tick_init, 1)
+    print()
+    print("it takes", round(v_loop*10**3, 3), "ms per loop with the", kMC.BACKEND, "backend")
+
 
-t_comput = time.time() - t_init # time to compute the script
-v_loop = t_comput/tick
-print()
-print("it takes", round(v_loop*10**3, 3), "ms per loop")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Description:
+parameter sweep of the MoTub model over a local process pool
+
+every (parameter point, replica) job runs kMC_main.run headless with its own
+random streams: the seed of the n-th job is [root seed, n], i.e. the n-th
+child spawned from the root numpy SeedSequence, so the jobs are statistically
+independent and the whole sweep is reproducible from the root seed whatever
+the number of processes
+
+Usage:
+    python kMC_sweep.py [parameters.json] --grid MOTOR_DENSITY=0.05,0.1,0.2
+                        --grid MOTOR_DESTABILIZATION=1,2 --replicas 16
+                        [--set KEY=VALUE ...] [--seed 18] [--processes 64]
+                        [--out sweep.npy]
+
+the results are collected in one numpy structured array (1 row per job)
+saved with np.save, read it back with np.load(path)
+
+the output paths of a run (OUTPUT_KEYS, e.g. --set CHECKPOINT_FILE=run.npz)
+get the index of the job, run_<index>.npz, so that the jobs of the pool
+never write the same file
+"""
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import kMC_main as main
+
+
+""" columns measured at the end of every job, besides the swept parameters """
+RESULT_FIELDS = [
+    ("replica", np.int64), # replica index of the parameter point
+    ("t", np.float64), # simulated time [s]
+    ("tick", np.int64), # number of loops
+    ("N_DEFECT", np.int64), # vacancies in the active part of the lattice
+    ("N_GTP", np.int64), # GTP-dimers
+    ("N_MOTOR", np.int64), # motors (counted by their rear-head)
+    ("N_EXCITED", np.int64), # excited dimers
+    ("wall_time", np.float64), # wall time of the job [s]
+]
+
+""" parameters holding an output path of a run, made unique per job (cf. job_path) """
+OUTPUT_KEYS = ("CHECKPOINT_FILE", "EVENT_LOG", "SNAPSHOT_STORE", "OBSERVABLES_FILE")
+
+
+def parse_grid(items):
+    """ return the list of (KEY, values) of the "KEY=v1,v2,..." strings,
+        the values are read as json (plain strings otherwise)
+    """
+    grid = []
+    for item in items:
+        key, _, values = item.partition("=")
+        parsed = []
+        for value in values.split(","):
+            try:
+                parsed.append(json.loads(value))
+            except ValueError:
+                parsed.append(value)
+        grid.append((key.strip(), parsed))
+    return grid
+
+
+def job_seeds(root_seed, n_jobs):
+    """ return one seed per job, [root_seed, n] seeds the streams of the
+        n-th child of the root SeedSequence (cf. kMC_Library.random_streams)
+    """
+    return [[root_seed, n] for n in range(n_jobs)]
+
+
+def job_path(path, index):
+    """ return the output path of the job index: path with _<index> inserted
+        before its extension, e.g. run.npz -> run_3.npz
+    """
+    root, ext = os.path.splitext(path)
+    return "%s_%d%s" % (root, index, ext)
+
+
+def measure(obs):
+    """ return the columns of the final observables obs of a run (cf. RESULT_FIELDS) """
+    return {"N_DEFECT": obs["N_VACANCY"],
+            "N_GTP": obs["N_GTP"],
+            "N_MOTOR": obs["N_MOTOR_1HEAD"] + obs["N_MOTOR_2HEAD"],
+            "N_EXCITED": obs["N_EXCITED"]}
+
+
+def run_job(job):
+    """ run one job (index, parameters, replica) and return (index, row) """
+    index, P, replica = job
+    t_init = time.time()
+    lat, t, tick, obs = main.run(P)
+    row = measure(obs)
+    row.update({"replica": replica, "t": t, "tick": tick, "wall_time": time.time() - t_init})
+    return (index, row)
+
+
+def sweep(P, grid, replicas, root_seed=18, processes=None):
+    """ run every (parameter point, replica) of the grid over a pool of
+        processes and return the results as a structured array, one row per
+        job in the order of the grid (the last key varies the fastest)
+    """
+    keys = [key for key, values in grid]
+    for key in keys:
+        if key not in P:
+            raise KeyError("unknown parameter %s" % key)
+    points = list(itertools.product(*[values for key, values in grid]))
+    seeds = job_seeds(root_seed, len(points)*replicas)
+
+    jobs = []
+    for p, point in enumerate(points):
+        for replica in range(replicas):
+            index = p*replicas + replica
+            Pj = dict(P)
+            Pj.update(zip(keys, point))
+            Pj["SEED"] = seeds[index]
+            for key in OUTPUT_KEYS:
+                if Pj.get(key) is not None:
+                    Pj[key] = job_path(Pj[key], index)
+            jobs.append((index, Pj, replica))
+
+    dtype = []
+    for key, values in grid:
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            dtype.append((key, np.float64))
+        else:
+            dtype.append((key, "U32"))
+    results = np.zeros(len(jobs), dtype=dtype + RESULT_FIELDS)
+
+    with mp.Pool(processes) as pool:
+        for index, row in pool.imap_unordered(run_job, jobs):
+            for key in keys:
+                results[key][index] = jobs[index][1][key]
+            for key, _ in RESULT_FIELDS:
+                results[key][index] = row[key]
+    return results
+
+
+def main_sweep(argv=None):
+    parser = argparse.ArgumentParser(description="parameter sweep of the MoTub model over a process pool")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults of kMC_main")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter for every job, can be repeated")
+    parser.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2,...",
+                        help="values of one swept parameter, can be repeated (cartesian product)")
+    parser.add_argument("--replicas", type=int, default=1, help="number of replicas per parameter point")
+    parser.add_argument("--seed", type=int, default=18, help="root seed of the independent random streams")
+    parser.add_argument("--processes", type=int, default=None, help="size of the pool (default: number of cores)")
+    parser.add_argument("--out", default="sweep.npy", help="output file of the structured results table")
+    args = parser.parse_args(argv)
+    try:
+        P = main.load_parameters(args.parameters, args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+    grid = parse_grid(args.grid)
+    for key, values in grid:
+        if key not in P:
+            parser.error("unknown parameter %s" % key)
+
+    t_init = time.time()
+    results = sweep(P, grid, args.replicas, args.seed, args.processes)
+    np.save(args.out, results)
+    print(len(results), "jobs in", round(time.time() - t_init, 1), "s, results saved in", os.path.abspath(args.out))
+
+
+if __name__ == "__main__":
+    main_sweep()
@@ -10,6 +10,11 @@ of the dynamics of kinesin-1 and MT
 
 
 import numpy as np
+import kMC_Backend # puts the root of the repository on the import path
+from kMC_core.kMC_Geometry import lattice_geometry
+
+""" public names, with the geometry functions the scripts of the model use through this module """
+__all__ = ["measurement_motor", "flux", "dens", "attachment_rate_cte", "lattice_geometry"]
 
 
 def measurement_motor(lat):
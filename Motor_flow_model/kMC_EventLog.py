@@ -0,0 +1,3 @@
+""" Append-only binary log of the kMC events (cf. kMC_core/kMC_EventLog.py) """
+import kMC_Backend
+from kMC_core.kMC_EventLog import *
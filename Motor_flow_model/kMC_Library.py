@@ -1,22 +1,46 @@
 """
-kMC functions for VSS method + local scan + use of list of list
-for a simple model (flux of processive 2-head motors)
+kMC functions of the motor flow model: its rules (enabled reactions & lattice 
+changes) plugged into the shared engine (cf. kMC_core/kMC_Engine.py) for the 
+VSS method + local scan + array-backed event lists
 """
 import numpy as np
-
-""" magical function to create list of list
+from kMC_Backend import BACKEND, jit
+from kMC_core.kMC_Geometry import UP
+from kMC_core.kMC_Engine import (ModelSpec, STATE, model_bins, build_event_lists, 
+    enabled_pairs, model_kernels, memo_table, random_streams, draw_events, build_rate_tree)
+
+""" public names, with the engine functions the scripts of the model use through this module """
+__all__ = ["MODEL", "SLOT", "MEMO_SIZE", "latice_init", "rate_constant_init",
+    "initialize_eventlist", "update_enabled_reaction", "stencil_key", "enabled_reactions",
+    "apply_reaction", "change_lattice", "KERNELS", "scan", "update_lattice_configuration",
+    "run_events", "integrate_site", "integrate_sites", "measure_events", "BACKEND", "model_bins",
+    "memo_table", "random_streams", "draw_events", "build_rate_tree"]
+
+""" 4 rate constants (cf. rate_constant_init) drawn reaction by reaction, a 
+    reaction changes the sites x, x+1, x+2 and the reactions of a site only 
+    depend on the site and the 2 next ones, so only the sites up to 2 rows 
+    away on its protofilament are rescanned, a site holds at most the 
+    detachment + the walk
+"""
+MODEL = ModelSpec("Motor_flow", 4, (2, 0), 2, "reaction")
+SLOT = MODEL.slot # width of the lsre rows
+MEMO_SIZE = 0 # no memo, the rule reads 3 sites, as fast as a lookup (cf. stencil_key)
+
+""" encoding of the state of a site, stored as an int8 (STATE): 0 for a 
+    free site, 1 under a rear head, 2 under a front head, -1 for a lattice 
+    defect (as the motor heads of the MoTub model, without nucleotide nor 
+    excitation), the state arithmetic is exact integer arithmetic
+    
+    the event structures (ersl, pos, occ, bocc) are int32 arrays (INDEX)
 """
-def mklist(n):
-    for _ in range(n):
-        yield []
 
 
 def latice_init(n, m):
     """ initialize the first configuration of the 2D lattice of size (n,m)
-        initial configuration: empty lattice 
+        initial configuration: empty lattice (int8, cf. the encoding of STATE)
     """
     
-    lat = np.zeros((n, m)) 
+    lat = np.zeros((n, m), dtype=STATE) 
     
     """ add a rectangle defect at mid length """
     
@@ -41,67 +65,34 @@ def rate_constant_init(Nr, kp, kw, km, theta):
     return k 
 
 
-def initial_event_list_reaction(i, j, lat, occ, ersl, lsre):
-    """
-    test which reactions is enabled at site at (i,j) 
-    and update occ & ersl & lsre for the initial lattice configuration
-    """
-    L = len(lat[0,:])
-    l = len(lat[:,0])
-    x = int(j+i*L)
-
-        
-    if lat[i,j] == 0 and lat[(i+1)%l,j] == 0:
-        """ 2 vacant sites that are adjacent -> motor can attach 
-        """
-        occ[0] += 1
-        ersl[0].append([i,j])
-        lsre[x].append(0)
-        
-    elif lat[i,j] == 1 and lat[(i+1)%l,j] == 2: 
-        """ presence of both heads = "normal" detachment 
-        """
-        occ[2] += 1
-        ersl[2].append([i,j])
-        lsre[x].append(2)
-        if lat[(i+2)%l,j] != 1:
-            """ if site ahead is not a rear head motor -> motor can walk
-                not rear head = either a vacant or a defect site
-            """
-            occ[1] += 1
-            ersl[1].append([i,j])
-            lsre[x].append(1)
-        
-    elif lat[i,j] == 1 and lat[(i+1)%l,j] == -1: 
-        """ presence of only one head and defect ahead = "modified" detachment 
-        """
-        occ[3] += 1
-        ersl[3].append([i,j])
-        lsre[x].append(3)
-        
-    return (occ, ersl, lsre)
-
-
-def initialize_eventlist(lat, Nbr_reac): 
-    """ initialize the occurence array and the ersl list and lsre list
+def initialize_eventlist(lat, bins): 
+    """ initialize the occurence arrays and the ersl list and lsre list
         occ[i] = # of site that enable the reaction i 
-        ersl[j] = list of the enable site positions for reaction j 
-        lsre[k] = inverse of ersl = list of the reaction enable for site with index k 
+        bocc[g] = # of enabled pairs (reaction, site) of the bin g, 
+                  i.e. occ[g] as every bin holds one reaction (cf. MODEL)
+        ersl[g] = array of the enabled pairs x*Nr + reac of the bin g, 
+                  only its bocc[g] first entries are meaningful
+        lsre[k] = sorted reactions enabled for the site of flat index k, 
+                  padded with -1 up to SLOT slots
+        pos[k,s] = position of the pair (lsre[k,s], k) in its ersl array
+        the enabled reactions are tested on the whole lattice at once 
     """
-    occ = np.zeros(Nbr_reac) 
-    ersl = list(mklist(Nbr_reac))                                                     
-    lsre = list(mklist(len(lat[:,0])*len(lat[0,:])))
+    up = np.roll(lat, -1, axis=0)             # lat[(i+1)%l,j]
+    up2 = np.roll(lat, -2, axis=0)            # lat[(i+2)%l,j]
+    two_heads = (lat == 1) & (up == 2)
     
-    L = len(lat[0,:])
-    l = len(lat[:,0])
-
-    for i in range(l):
-        for j in range(L):
-            occ, ersl, lsre = initial_event_list_reaction(i, j, lat, occ, ersl, lsre)
-    return (occ, ersl, lsre)
+    enabled = [
+        ((lat == 0) & (up == 0), 0), 
+        (two_heads, 2), 
+        (two_heads & (up2 != 1), 1), 
+        ((lat == 1) & (up == -1), 3), 
+    ]
+    X, R = enabled_pairs(lat, enabled, np.ones(lat.shape, dtype=bool))
+    return build_event_lists(X, R, bins, lat.size, SLOT)
 
 
 
+@jit
 def update_enabled_reaction(i, j, lat):
     """ test which reactions are enabled for the site (i, j)
     """
@@ -128,93 +119,39 @@ def update_enabled_reaction(i, j, lat):
         """
         lsre_x.append(3)
     return lsre_x
-#-------------------------------------------------------------------------------
-#-------------------------------------------------------------------------------
-def scan(lsre, ersl, occ, loc, lat):
-    """ scan the neighborhood around the location (i,j) of the new reaction site 
-    to update the enable reaction site list (ersl) + occurence vector (occ)
-    
-    the size of the scan region is determined by its half_width and half_length
-    as ( 2 half_width + 1 x 2 half_lenght + 1)
+@jit
+def stencil_key(X, lat, geo, rules):
+    """ return the pattern of the stencil read by update_enabled_reaction at 
+    the site of flat index X: the states of the site and of the 2 next sites 
+    of its protofilament, packed 2 bits each (state + 1)
+    the enabled reactions only depend on this pattern (cf. 
+    kMC_Kernels.rescan_window)
     """
-    
-    i = int(loc[0])    
-    j = int(loc[1])    
-    l = len(lat[:,0]) 
-    L = len(lat[0,:]) 
-    
-    half_length = 3
-    half_width = 0
-    
-    for I in range(i-half_length,i+half_length+1):
-        for J in range(j-half_width,j+half_width+1):
-            I = I%l ; J = J%L
-            lsre_x = update_enabled_reaction(I, J, lat)
-            lsre_x.sort()
-            X = int(J+I*L)
-            lsre[X].sort()
-            
-            """ check if the enabled reaction list at index x is different
-            from the previous one
-            
-            if it is than update all the eventlist (occ, ersl, lsre) at this 
-            index 
-            """
-            if lsre_x != lsre[X]: 
-                """ add new enabled reaction     
-                """
-                for k in range(len(lsre_x)):
-                    """ if reactions not already enabled then add them
-                    """
-                    if lsre[X].count(lsre_x[k]) == 0: # 
-                        occ[lsre_x[k]] += 1
-                        ersl[lsre_x[k]].append([I,J])
-                        
-                """ if reactions are not anymore enabled then revome them
-                """
-                for k in range(len(lsre[X])):
-                    if lsre_x.count(lsre[X][k]) == 0: 
-                        occ[lsre[X][k]] -= 1
-                        ersl[lsre[X][k]].remove([I,J])
-                        
-                """ update the lsre list 
-                """
-                lsre[X] = lsre_x
-    return (occ, ersl, lsre)
-
-
-def next_reaction_draw(k, occ, r):
-    """ compute a probability for each reaction, and select 1 at random
-        return the normalization factor & next reaction type
+    flat = lat.reshape(-1)
+    key = 0
+    for r in range(3): 
+        key = key*4 + int(flat[X]) + 1
+        X = geo[UP,X]
+    return key
+
+
+@jit
+def enabled_reactions(X, lat, geo, rules):
+    """ return the reactions enabled at the site of flat index X (rule of the 
+    kernels, cf. kMC_Engine.model_kernels), the model has no rules parameter 
+    (rules = ())
     """
-    Nr = len(k)      
-    kn = np.multiply(k, occ)  
-    P = np.zeros(Nr)
-    for i in range(Nr):
-        """ non-normalized cummulative probability 
-        to define intervals for each reaction
-        """
-        P[i] = np.sum(kn[0:(i+1)%(Nr+1)]) 
-    C = np.sum(kn) # Normalizing factor
-    Pn = np.zeros(Nr+1) 
-    for i in range(Nr):
-        """ normalized cummulative probability interval
-        """
-        Pn[i+1]= P[i]/C
-    for i in range(0,Nr):
-        if Pn[i] <= r < Pn[i+1]: 
-            """ next reaction will be reaction n°i
-            """
-            reac = i  
-    return (C, reac)
+    L = len(lat[0,:])
+    return update_enabled_reaction(X//L, X%L, lat)
 
 
-def update_lattice_configuration(lat, occ, ersl, lsre, reac, loc):
-    """ change the lattice configuration with new reaction 
-        and create corresponding event lists (lsre + ersl + occ)
+@jit
+def apply_reaction(lat, reac, loc):
+    """ change the lattice configuration with the reaction reac at the site
+        of flat index loc, the event lists are left untouched
     """
-    x = int(loc[0]) ; y = int(loc[1])
     l = len(lat[:, 0]) 
+    x = loc//len(lat[0, :]) ; y = loc%len(lat[0, :])
     
     if reac == 0:  
         """ a motor attaches the lattice 
@@ -245,9 +182,71 @@ def update_lattice_configuration(lat, occ, ersl, lsre, reac, loc):
         """ one-headed motor detaches from the lattice
         """
         lat[x, y] = 0        
+    return lat
+
 
-    """ update the event lists (lsre + ersl + occ)
+@jit
+def change_lattice(lat, reac, loc, rules):
+    """ change the lattice configuration with the reaction reac at the site 
+        of flat index loc, rule of the kernels (cf. kMC_Engine.model_kernels)
     """
-    occ, erls, lsre = scan(lsre, ersl, occ, loc, lat)
-    return (lat, occ, ersl, lsre)
+    return apply_reaction(lat, reac, loc)
+
 
+""" scan & event loop of the model """
+KERNELS = model_kernels(MODEL, enabled_reactions, change_lattice, stencil_key)
+scan = KERNELS.scan
+update_lattice_configuration = KERNELS.update_lattice_configuration
+run_events = KERNELS.run_events
+
+
+@jit
+def integrate_site(lat, i, j, t, t_mark, t_exc, det, exc, taur):
+    """ integrate the site (i, j) from t_mark[i,j] to the simulated time t in 
+        its current state: det[i,j] += time the dimer of the site can detach 
+        (no motor, or the rear head of a 1-head motor), exc[i,j] += expected 
+        part of this time the dimer is excited, i.e. exp(-(t - t_exc)/taur) 
+        integrated, t_exc[i,j] being the time of its last excitation (the 
+        excitation is integrated instead of drawn, cf. measure_events)
+    """
+    l = len(lat[:,0])
+    if lat[i,j] == 0 or (lat[i,j] == 1 and lat[(i+1)%l,j] == -1): 
+        det[i,j] += t - t_mark[i,j]
+        exc[i,j] += taur*(np.exp(-(t_mark[i,j] - t_exc[i,j])/taur) - np.exp(-(t - t_exc[i,j])/taur))
+    t_mark[i,j] = t
+
+
+@jit
+def integrate_sites(lat, t, t_mark, t_exc, det, exc, taur):
+    """ integrate every site up to the simulated time t (cf. integrate_site) """
+    for i in range(len(lat[:,0])): 
+        for j in range(len(lat[0,:])): 
+            if lat[i,j] != -1: 
+                integrate_site(lat, i, j, t, t_mark, t_exc, det, exc, taur)
+
+
+@jit
+def measure_events(lat, reacs, sites, dt, t, t_mark, t_exc, det, exc, taur):
+    """ replay the events (reacs, sites, dt) of a run from the simulated time 
+        t on lat, the lattice of the run before them, and integrate the 
+        detachable & excited times of the sites (cf. integrate_site), return 
+        the simulated time after the events
+        
+        a step excites the dimer left by the front head of the motor (as in 
+        the MoTub model) and an excited dimer relaxes with the rate 1/taur 
+        whatever the motors, so the motors never see the excitation and its 
+        probability exp(-(t - t_exc)/taur) is integrated exactly between 
+        the events instead of drawing the relaxations (Rao-Blackwellisation)
+        the sites are integrated lazily, only when their state changes 
+    """
+    l = len(lat[:,0]) ; L = len(lat[0,:])
+    for n in range(len(reacs)): 
+        t += dt[n]
+        x = sites[n]//L ; y = sites[n]%L
+        for r in range(3): 
+            """ the sites x, x+1, x+2 are the ones a reaction can change """
+            integrate_site(lat, (x+r)%l, y, t, t_mark, t_exc, det, exc, taur)
+        if reacs[n] == 1: 
+            t_exc[(x+1)%l, y] = t
+        apply_reaction(lat, reacs[n], sites[n])
+    return t
@@ -0,0 +1,194 @@
+"""
+Description:
+tabulation of the detachment probabilities of the dimers read by the MoTub
+effective model, measured on the motor flow
+
+for each motor density rho of a grid, the flow of motors is run on the
+lattice of kMC_main (one rectangle defect at mid length) and every dimer is
+followed in time: it can detach when it bears no motor or only the rear
+head of a 1-head motor, and a step of a motor excites the dimer left by its
+front head, which relaxes with the rate 1/taur (as in the MoTub model).
+The columns of the table are the fractions of time a dimer can detach and
+is in the ground (cg) or excited (ce) state
+
+    rho cg_ND ce_ND cg_D ce_D
+
+ND: dimers of the protofilaments without defect
+D: dimers just in front of the defect (the next site along the walk is
+   the defect), i.e. where the motors become 1-head motors
+
+the excitation never changes the motors, so it is integrated exactly from
+the steps of the run instead of being drawn (cf. kMC_Library.measure_events).
+After a warm-up of one batch, the run is cut in batches of batch_time and
+stops when the standard error of the batch means of every column is below
+tol (at least MIN_BATCHES and at most max_batches batches). The densities are
+independent jobs spread over a local process pool, the job n draws from the
+streams of the seed [seed, n]
+
+the tables shipped with the effective model agree with this measure on the
+D columns. Their ND columns are averaged over the first ~20 s of the flow
+from an empty lattice, before it reaches its steady density: the excited
+fraction is lower than the steady one, by up to 0.02 (rho 0.05, taur 1), and
+a regenerated table gives the steady values
+
+Usage:
+    python kMC_Tabulation.py --motor kinesin --taur 0.1 --theta 100
+                             [--rho 0.01,0.02,...] [--tol 0.005] [--batch 10]
+                             [--processes 8] [--set KEY=VALUE ...] [--out-dir .]
+
+the table is written as <motor>_taur_<taur>_theta_<theta>_tabulation_detachment_probabilities.dat,
+the file loaded by MoTub_effective_model/kMC_main.py
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import kMC_Library as kMC
+import kMC_main as main
+import Tools as tl
+
+MOTORS = {"kinesin": 100, "dynein": 10} # walking rate kw of the motors [sites/s]
+RHO_GRID = np.round(0.01*np.arange(1, 41), 2) # densities of the tables of the effective model
+MIN_BATCHES = 10 # minimal number of batches of a density
+RECOVERY_LENGTHS = 10 # minimal length of the lattice in run lengths kw/km of a motor
+
+
+def tabulation_name(motor, taur, theta):
+    """ return the name of the table loaded by the effective model """
+    return "%s"%motor+'_taur_'+'%.1f'%taur+'_theta_'+'%.f'%theta+'_tabulation_detachment_probabilities.dat'
+
+
+def defect_masks(lat):
+    """ return the masks (ND, D) of the measured sites of the lattice lat """
+    ND = np.zeros(lat.shape, dtype=bool)
+    ND[:, ~np.any(lat == -1, axis=0)] = True
+    D = (lat != -1) & (np.roll(lat, -1, axis=0) == -1)
+    return (ND, D)
+
+
+def advance(run, t_stop):
+    """ run the flow up to the simulated time t_stop and integrate its
+        events, the random numbers of a block are kept from one call to the next
+    """
+    while True:
+        if run["done"] == len(run["u"]):
+            run["u"] = kMC.draw_events(run["rngs"], main.EVENT_BLOCK)
+            run["done"] = 0
+        n_events = len(run["u"]) - run["done"]
+        reacs = np.zeros(n_events, dtype=int) ; sites = np.zeros(n_events, dtype=int) ; dt = np.zeros(n_events)
+        t, n = kMC.run_events(run["lat"], run["geo"], run["occ"], run["bocc"], run["ersl"], run["pos"], run["lsre"],
+                              run["tree"], run["k"], run["bins"], run["u"][run["done"]:], reacs, sites, dt, run["t"],
+                              t_stop, run["rngs"][3], (), run["memo"])
+        """ the measured lattice lags the run by the events of the block """
+        kMC.measure_events(run["mlat"], reacs[:n], sites[:n], dt[:n], run["t"], run["t_mark"], run["t_exc"],
+                           run["det"], run["exc"], run["taur"])
+        run["t"] = t
+        run["tick"] += n
+        run["done"] += n
+        if n < n_events:
+            """ the next event occurs after t_stop """
+            kMC.integrate_sites(run["mlat"], t_stop, run["t_mark"], run["t_exc"], run["det"], run["exc"], run["taur"])
+            return
+
+
+def measure_density(P, taur, tol=0.005, batch_time=None, max_batches=400):
+    """ measure the row (rho, cg_ND, ce_ND, cg_D, ce_D) of the flow of the
+        parameters P, return the row, the standard errors of its columns and
+        the number of batches, batch_time defaults to 10 times the longest of
+        the binding time 1/km and the crossing time n/kw of the lattice
+
+        the lattice is at least RECOVERY_LENGTHS run lengths kw/km long: past
+        the defect the flow is depleted over about one run length, and the D
+        sites must see the bulk flow coming round the periodic lattice
+    """
+    n = max(P["n"], int(np.ceil(RECOVERY_LENGTHS*P["kw"]/P["km"])))
+    if batch_time is None:
+        batch_time = 10*max(1/P["km"], n/P["kw"])
+    lat = kMC.latice_init(n, P["m"])
+    k = kMC.rate_constant_init(kMC.MODEL.Nr, tl.attachment_rate_cte(P["rho"], P["km"], 0), P["kw"], P["km"], P["theta"])
+    bins = kMC.model_bins(kMC.MODEL, k)
+    occ, bocc, ersl, pos, lsre = kMC.initialize_eventlist(lat, bins)
+    run = {"lat": lat, "mlat": lat.copy(), "geo": tl.lattice_geometry(n, P["m"], 0), "occ": occ, "bocc": bocc,
+           "ersl": ersl, "pos": pos, "lsre": lsre, "tree": kMC.build_rate_tree(k, occ, bins), "k": k, "bins": bins,
+           "memo": kMC.memo_table(kMC.MEMO_SIZE, kMC.SLOT), "taur": taur, "t": 0., "tick": 0,
+           "rngs": kMC.random_streams(P["SEED"]), "u": np.zeros((0, 3)), "done": 0,
+           "t_mark": np.zeros(lat.shape), "t_exc": np.full(lat.shape, -np.inf),
+           "det": np.zeros(lat.shape), "exc": np.zeros(lat.shape)}
+    ND, D = defect_masks(lat)
+
+    advance(run, batch_time)
+    batches = []
+    while True:
+        run["det"][:] = 0 ; run["exc"][:] = 0
+        advance(run, (len(batches) + 2)*batch_time)
+        cg = (run["det"] - run["exc"])/batch_time ; ce = run["exc"]/batch_time
+        batches.append((cg[ND].mean(), ce[ND].mean(), cg[D].mean(), ce[D].mean()))
+        if len(batches) >= MIN_BATCHES:
+            error = np.std(batches, axis=0, ddof=1)/np.sqrt(len(batches))
+            if error.max() <= tol or len(batches) == max_batches:
+                return (np.concatenate(([P["rho"]], np.mean(batches, axis=0))), error, len(batches))
+
+
+def run_job(job):
+    """ run one job (index, parameters, taur, tol, batch_time, max_batches)
+        and return (index, row, errors, number of batches)
+    """
+    index, P, taur, tol, batch_time, max_batches = job
+    return (index,) + measure_density(P, taur, tol, batch_time, max_batches)
+
+
+def tabulate(P, motor, taur, rhos=RHO_GRID, tol=0.005, batch_time=None, max_batches=400,
+             root_seed=18, processes=None):
+    """ measure the rows of the densities rhos over a pool of processes,
+        return the table (one row per density, in the order of rhos) and
+        the standard errors of its columns
+    """
+    jobs = []
+    for index, rho in enumerate(rhos):
+        Pj = dict(P)
+        Pj.update({"kw": MOTORS[motor], "rho": float(rho), "SEED": [root_seed, index]})
+        jobs.append((index, Pj, taur, tol, batch_time, max_batches))
+
+    table = np.zeros((len(jobs), 5)) ; errors = np.zeros((len(jobs), 4))
+    with mp.Pool(processes) as pool:
+        for index, row, error, n_batches in pool.imap_unordered(run_job, jobs):
+            table[index] = row ; errors[index] = error
+            if error.max() > tol:
+                print("rho = %g did not converge in %d batches (error %.4f)" % (row[0], n_batches, error.max()))
+    return (table, errors)
+
+
+def main_tabulation(argv=None):
+    parser = argparse.ArgumentParser(description="tabulation of the detachment probabilities of the effective model")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults of kMC_main")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter of the flow (n, m, km), can be repeated")
+    parser.add_argument("--motor", choices=sorted(MOTORS), required=True, help="motor of the flow")
+    parser.add_argument("--taur", type=float, required=True, help="relaxation time of the excited dimers [s]")
+    parser.add_argument("--theta", type=float, required=True, help="detachment coefficient of the 1-head motors")
+    parser.add_argument("--rho", default=None, metavar="RHO1,RHO2,...",
+                        help="motor densities (default: 0.01 to 0.40 by 0.01)")
+    parser.add_argument("--tol", type=float, default=0.005, help="standard error of the columns to reach")
+    parser.add_argument("--batch", type=float, default=None, help="simulated time of a batch [s]")
+    parser.add_argument("--max-batches", type=int, default=400, help="maximal number of batches of a density")
+    parser.add_argument("--seed", type=int, default=18, help="root seed of the independent random streams")
+    parser.add_argument("--processes", type=int, default=None, help="size of the pool (default: number of cores)")
+    parser.add_argument("--out-dir", default=".", help="directory of the table")
+    args = parser.parse_args(argv)
+    try:
+        P = main.load_parameters(args.parameters, args.set + ["theta=%r" % args.theta])
+    except KeyError as e:
+        parser.error(e.args[0])
+    rhos = RHO_GRID if args.rho is None else [float(rho) for rho in args.rho.split(",")]
+
+    t_init = time.time()
+    table, errors = tabulate(P, args.motor, args.taur, rhos, args.tol, args.batch, args.max_batches,
+                             args.seed, args.processes)
+    path = os.path.join(args.out_dir, tabulation_name(args.motor, args.taur, args.theta))
+    np.savetxt(path, table, fmt="%.5f")
+    print(len(table), "densities in", round(time.time() - t_init, 1), "s, table saved in", os.path.abspath(path))
+
+
+if __name__ == "__main__":
+    main_tabulation()
@@ -1,99 +1,200 @@
 """
 Created on May 2022
 @author: William Lecompte
-Description: 
-kMC simulation based on the VSS method for modelling 
+Description:
+kMC simulation based on the VSS method for modelling
 a simple 2-head motors walk along a 2D lattice + local scan + list of list
+
+Usage:
+    python kMC_main.py [parameters.json] [--set KEY=VALUE ...] [--visualise]
+
+the run is headless unless --visualise is given, matplotlib is only imported
+in that case. With EVENT_LOG set, the reaction, the site and the waiting time
+of every event are streamed to a binary log (cf. kMC_EventLog). The frames of
+--visualise are drawn every VISU_TIME of simulated time (cf. kMC_Scheduler)
 """
+import argparse
+import json
 import numpy as np
-import random as rd
 import time
-import matplotlib.pyplot as plt
 import kMC_Library as kMC
+import kMC_EventLog as evlog
+import kMC_Scheduler as sched
 import Tools as tl
 
+""" Default parameters for initial lattice configuration
+    and for the motor walk model, a parameter file (json) and the
+    --set KEY=VALUE options override them
+"""
+PARAMETERS = {
+    "SEED": 108, # Seed initialization, an int or [entropy, spawn key...] (cf. kMC_Library.random_streams)
+    "TICK_MAX": 10**4, # Stop condiontion on loops
+    "VISU_TIME": 0.1, # simulated time between 2 frames [s]
+
+    "n": 125*1, # Nbr of dimer
+    "m": 13, # Nbr of Protofilaments
+
+    "kw": 100, # Cte rate of walking process
+    "km": 1, # Cte rate of detachment process
+    "theta": 1, # detachment coefficient, theta = kM/km
+    "rho": 0.1, # motor density at steady-state
+
+    "EVENT_LOG": None, # path of the binary log of every event (cf. kMC_EventLog), None for no log
+}
+
+EVENT_BLOCK = 10**4 # number of events per call of the kMC kernel for a headless run
+
+
+def load_parameters(path=None, overrides=()):
+    """ return the default parameters updated with the parameter file (json)
+        at path and then with the "KEY=VALUE" strings of overrides,
+        a VALUE is read as json (a plain string otherwise)
+    """
+    P = dict(PARAMETERS)
+    updates = []
+    if path is not None:
+        with open(path) as f:
+            updates += list(json.load(f).items())
+    for item in overrides:
+        key, _, value = item.partition("=")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        updates.append((key.strip(), value))
+    for key, value in updates:
+        if key not in P:
+            raise KeyError("unknown parameter %s" % key)
+        P[key] = value
+    return P
+
 
 def forceAspect(ax,aspect):
     im = ax.get_images()
     extent =  im[0].get_extent()
     ax.set_aspect(abs((extent[1]-extent[0])/(extent[3]-extent[2]))/aspect)
 
-t_init = time.time()
-rd.seed(108) # Seed initialization 
-tick_max = 10**4 # Stop condiontion on loops 
-time_step = np.zeros(tick_max)
-""" Parameters for initial lattice configuration 
-     and for the motor walk model 
-"""
-t = 0 # Initial time
-n = 125*1 # Nbr of dimer 
-m = 13 # Nbr of Protofilaments 
-
-Nr = 4 # Nbr of rate constants
-kw = 100 # Cte rate of walking process  
-km = 1 # Cte rate of detachment process 
-theta = 1 # detachment coefficient, theta = kM/km 
-rho = 0.1 # motor density at steady-state
-kp = tl.attachment_rate_cte(rho, km, 0) # Cte rate of attachment process 
-
-""" Initialize the lattice + event lists 
-    lat: lattice of size (n,m)
-    k: rate constant vector
-    occ: number of enabled site for each reaction type, it's the occurence vector
-    ersl[j] = list of the enable site positions for reaction j 
-    lsre[k] = inverse of ersl = list of the reaction enable for site with index k 
-    
-"""
-lat = kMC.latice_init(n, m)
-k = kMC.rate_constant_init(Nr, kp, kw, km, theta)
-occ, ersl, lsre = kMC.initialize_eventlist(lat, Nr)
 
-""" Initialized observables 
-"""
-tick = 0 # number of loops 
-tick_visu = 250 # number of loops between 2 frames
+def run(P, visualise=False):
+    """ run the kMC simulation of the motor flow with the parameters P
+        return the final lattice, the simulated time and the number of loops
+    """
+    rngs = kMC.random_streams(P["SEED"])
+    t = 0 # Initial time
+    tick_max = P["TICK_MAX"]
 
-""" Lattice visualisation over time
-"""
-fig, ax = plt.subplots(figsize=(12,12)) # Visu
-title = ax.text(0.5,1.25, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
-                transform=ax.transAxes, ha="center")
-title.set_text(r"# Loops = {},".format(tick)+" t = {}s".format(np.round(t,2)))
-im = ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c_r',animated=True,vmin=-6,vmax=6)
-ax.set_ylim(0,.5)
-ax.set_xlim(0,n)
-plt.axis('on')
-plt.draw()
-plt.tight_layout()
-
-""" loop the simulation while the stop condition is not verified
-"""
-while tick < tick_max: 
-    r = rd.random() # 1st draw 
-    C, reac = kMC.next_reaction_draw(k, occ, r)
-    
-    r = rd.random() # 2nd draw
-    t += -(np.log(r)/C) # Simulated time evolution
-    time_step[tick] = -(np.log(r)/C)
-    r = rd.randint(0,int(occ[reac])-1) # 3rd draw
-    loc = ersl[reac][r]
-    
-    lat, occ, ersl, lsre = kMC.update_lattice_configuration(lat, occ, ersl, lsre, reac, loc)
-    tick += 1
-    
-    """ lattice visualisation update
+    n = P["n"] ; m = P["m"]
+    Nr = kMC.MODEL.Nr # Nbr of rate constants
+    kp = tl.attachment_rate_cte(P["rho"], P["km"], 0) # Cte rate of attachment process
+
+    """ Initialize the lattice + event lists
+        lat: lattice of size (n,m)
+        k: rate constant vector
+        bins: one bin per reaction (cf. kMC_Engine.reaction_bins)
+        occ: number of enabled site for each reaction type, it's the occurence vector
+        bocc: number of enabled pairs (reaction, site) of each bin
+        tree: binary sum tree of the reaction rates k*occ, tree[1] is the total rate
+        ersl[g] = array of the enabled pairs x*Nr + reac of the bin g
+        lsre[x] = inverse of ersl = sorted reactions enabled at the site x, padded with -1
+        pos[x,s] = position of the pair (lsre[x,s], x) in its ersl array
+        geo: flat indices of the neighbors of every site, periodic lattice (cf. Tools.lattice_geometry)
+        memo: enabled reactions of the stencil patterns met (cf. kMC_Engine.memo_table)
+
+    """
+    lat = kMC.latice_init(n, m)
+    k = kMC.rate_constant_init(Nr, kp, P["kw"], P["km"], P["theta"])
+    geo = tl.lattice_geometry(n, m, 0)
+    bins = kMC.model_bins(kMC.MODEL, k)
+    occ, bocc, ersl, pos, lsre = kMC.initialize_eventlist(lat, bins)
+    tree = kMC.build_rate_tree(k, occ, bins)
+    memo = kMC.memo_table(kMC.MEMO_SIZE, kMC.SLOT)
+
+    """ Initialized observables, observers = (interval, callback(T, tick))
+        called at the simulated times n*interval
     """
-    if tick%tick_visu == 0:
-        plt.cla()
-        title = ax.text(0.5, 3, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
-                transform=ax.transAxes, ha="center")
-        title.set_text(r"# Loops= {},".format(tick)+" t = {} s".format(np.round(t,2)))
-        ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-6,vmax=6)
+    tick = 0 # number of loops
+    observers = []
+
+    if visualise:
+        """ Lattice visualisation over time
+        """
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(12,12)) # Visu
+        title = ax.text(0.5,1.25, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
+                        transform=ax.transAxes, ha="center")
+        title.set_text(r"# Loops = {},".format(tick)+" t = {}s".format(np.round(t,2)))
+        im = ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c_r',animated=True,vmin=-6,vmax=6)
+        ax.set_ylim(0,.5)
+        ax.set_xlim(0,n)
         plt.axis('on')
         plt.draw()
-        plt.pause(.1)
+        plt.tight_layout()
+
+        def draw(T, tick):
+            """ lattice visualisation update
+            """
+            plt.cla()
+            title = ax.text(0.5, 3, "", bbox={'facecolor':'w','edgecolor':'black', 'alpha':0.75, 'pad':5},
+                    transform=ax.transAxes, ha="center")
+            title.set_text(r"# Loops= {},".format(tick)+" t = {} s".format(np.round(T,2)))
+            ax.imshow(np.swapaxes(lat,1,0), interpolation='nearest',cmap='tab20c',animated=True,vmin=-6,vmax=6)
+            plt.axis('on')
+            plt.draw()
+            plt.pause(.1)
+        observers.append((P["VISU_TIME"], draw))
+    scheduler = sched.new_scheduler(t, observers)
+
+    """ event log
+    """
+    log = None
+    if P["EVENT_LOG"] is not None:
+        log = evlog.open_event_log(P["EVENT_LOG"], {"model": "Motor_flow", "shape": lat.shape, "parameters": P})
+
+    """ loop the simulation while the stop condition is not verified
+    """
+    while tick < tick_max:
+        """ 3 draws per event: reaction, waiting time and reaction site,
+        the trajectory does not depend on the size of the blocks of events
+        """
+        n_events = min(EVENT_BLOCK, tick_max - tick)
+        u = kMC.draw_events(rngs, n_events)
+        reacs = np.zeros(n_events, dtype=int) ; sites = np.zeros(n_events, dtype=int) ; dt = np.zeros(n_events)
+        done = 0
+        while done < n_events:
+            t, n = kMC.run_events(lat, geo, occ, bocc, ersl, pos, lsre, tree, k, bins, u[done:], reacs[done:],
+                                  sites[done:], dt[done:], t, sched.next_time(scheduler), rngs[3], (), memo)
+            done += n
+            if done < n_events:
+                """ the next event occurs after the next sampling time """
+                sched.fire_observers(scheduler, tick + done)
+        tick += n_events
+        if log is not None:
+            evlog.log_events(log, reacs, sites, dt)
+
+    if log is not None:
+        evlog.close_event_log(log)
+    return (lat, t, tick)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="kMC simulation of a flow of processive motors")
+    parser.add_argument("parameters", nargs="?", help="parameter file (json) overriding the defaults")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one parameter, can be repeated")
+    parser.add_argument("--visualise", action="store_true", help="animate the lattice with matplotlib")
+    args = parser.parse_args(argv)
+    try:
+        P = load_parameters(args.parameters, args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    t_init = time.time()
+    lat, t, tick = run(P, args.visualise)
+    t_comput = time.time() - t_init # time to compute the script
+    v_loop = t_comput/tick
+    print()
+    print("it takes", round(v_loop*10**3, 3), "ms per loop with the", kMC.BACKEND, "backend")
+
 
-t_comput = time.time() - t_init # time to compute the script
-v_loop = t_comput/tick
-print()
-print("it takes", round(v_loop*10**3, 3), "ms per loop")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
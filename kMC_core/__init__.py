@@ -0,0 +1,17 @@
+"""
+kMC engine shared by the MoTub, MoTub effective and motor flow models
+
+    kMC_Backend: numba or pure Python backend of the kernels
+    kMC_Engine: event lists, rate bins & sum tree, selection of the events,
+                update of the enabled reactions of a site, scan windows and
+                random streams
+    kMC_Geometry: neighbor tables of the lattices
+    kMC_EventLog, kMC_Scheduler: event log and physical-time observers of a run
+
+a model plugs into the engine with its description (kMC_Engine.ModelSpec:
+number of reactions, scan stencil, lsre width and selection over its rate
+table) and its rules, i.e. the reactions enabled at a site and the lattice
+change of each reaction, in the kMC_Library of its directory. The model
+directories put the root of the repository on the import path through their
+kMC_Backend module
+"""
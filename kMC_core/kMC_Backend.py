@@ -0,0 +1,102 @@
+"""
+Selection of the backend running the kMC kernels
+
+The kernels (neighborhood, enabled reactions, scan, rate tree, lattice update
+and event loop) are plain Python functions decorated with jit. When numba is
+installed they are compiled in nopython mode, otherwise they run as pure
+Python. Both backends execute the same code on the same random numbers, hence
+give the same trajectory for the same seed.
+
+The pure Python backend can be forced with the environment variable
+KMC_BACKEND=python (it is read once, at the first import).
+
+The compiled kernels are cached on disk, in a directory named after a hash of
+the sources of the engine and of the models (cf. source_hash): a kernel inlines
+the jit functions it calls, possibly from another module, and numba only checks
+the timestamp of the file of the kernel itself. A change to any source hence
+starts a fresh cache, and the caches of the other sources are deleted.
+module_instance loads one source file as several modules (the event loop of
+every model, cf. kMC_Engine.model_kernels), each one with its own cache.
+"""
+import glob
+import hashlib
+import importlib.util
+import os
+import shutil
+import sys
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def source_hash():
+    """ return the hash of the python sources of kMC_core and of the model
+        directories (the ones with a kMC_Backend module)
+    """
+    digest = hashlib.sha1()
+    directories = [os.path.join(ROOT, "kMC_core")] + [os.path.dirname(p) for p in glob.glob(os.path.join(ROOT, "*", "kMC_Backend.py"))]
+    for directory in sorted(set(directories)):
+        for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+            digest.update(os.path.relpath(path, ROOT).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def cache_directory(base):
+    """ return the cache directory kMC_<source hash> in base, after deleting
+        the ones of other sources
+    """
+    directory = os.path.join(base, "kMC_" + source_hash())
+    for stale in glob.glob(os.path.join(base, "kMC_*")):
+        if stale != directory:
+            shutil.rmtree(stale, ignore_errors=True)
+    return directory
+
+
+if numba is not None and os.environ.get("KMC_BACKEND", "numba") != "python":
+    BACKEND = "numba"
+    numba.config.CACHE_DIR = cache_directory(numba.config.CACHE_DIR or os.path.join(ROOT, "__pycache__", "numba"))
+    jit = numba.njit(cache=True)
+
+    def new_list(arrays):
+        """ return the arrays as a typed list that nopython kernels can
+            modify in place (e.g. to grow one of its arrays)
+        """
+        typed = numba.typed.List()
+        for a in arrays:
+            typed.append(a)
+        return typed
+else:
+    BACKEND = "python"
+
+    def jit(f):
+        return f
+
+    def new_list(arrays):
+        return list(arrays)
+
+
+def module_instance(path, name):
+    """ import the python file at path as a new module name, the jit
+        functions of each instance of a file are compiled with its own
+        globals and cached in a directory of their own
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    """ numba reloads a cached function from its module by name """
+    sys.modules[name] = module
+    if BACKEND == "numba":
+        base = numba.config.CACHE_DIR
+        numba.config.CACHE_DIR = os.path.join(base, name)
+        try:
+            spec.loader.exec_module(module)
+        finally:
+            numba.config.CACHE_DIR = base
+    else:
+        spec.loader.exec_module(module)
+    return module
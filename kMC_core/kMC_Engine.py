@@ -0,0 +1,550 @@
+"""
+kMC engine shared by the models: VSS method + local scan + array-backed
+event lists
+
+a model is described by its ModelSpec and its rules (the reactions enabled
+at a site and the lattice change of each reaction, in its kMC_Library). The
+engine keeps the enabled pairs (reaction, site) of the model grouped by
+rate bin:
+    occ[i] = # of site that enable the reaction i
+    bocc[g] = # of enabled pairs (reaction, site) of the rate bin g
+    ersl[g] = array of the enabled pairs x*Nr + reac of the rate bin g,
+              only its bocc[g] first entries are meaningful
+    lsre[k] = sorted reactions enabled for the site of flat index k,
+              padded with -1 up to the slot of the model
+    pos[k,s] = position of the pair (lsre[k,s], k) in its ersl array
+and draws the next event from the binary sum tree of the rates of the bins
+(next_reaction_draw) and the pairs of the drawn bin (select_event). After a
+reaction, the scan of a model tests the rules of every site of the window
+of its stencil (scan_window) and updates the sites whose enabled reactions
+changed (site_changed, update_site). The rules of a site only depend on the
+states of a few sites around it, they are memoised by stencil pattern
+(memo_table, memo_slot, memo_store, memo_changed)
+
+the selection over the rate table of the model is either
+    "composition-rejection": power-of-2 rate bins (rate_bins), for the
+        hundreds of rate constants of the MoTub model
+    "reaction": one bin per reaction (reaction_bins), i.e. the plain
+        selection of a reaction then of one of its sites, for a few rate
+        constants
+both give the same event for the same random numbers when every bin holds
+one reaction
+
+the scan, the event loop and the leap mode are written once in kMC_Kernels
+and built around the rules of a model by model_kernels (numba does not cache
+a kernel taking another kernel as argument, the rules are plugged as the
+globals of an instance of kMC_Kernels instead)
+"""
+import os
+from collections import namedtuple
+import numpy as np
+from kMC_core.kMC_Backend import BACKEND, jit, new_list, module_instance
+from kMC_core.kMC_Geometry import UP, DOWN, WEST, EAST
+
+STATE = np.int8 # dtype of the lattices
+INDEX = np.int32 # dtype of the event structures
+
+""" description of a model plugged into the engine:
+    name: name of the model
+    Nr: number of rate constants (reactions)
+    stencil: (half_length, half_width) of the scan window around a reaction,
+             it holds every site whose enabled reactions the reaction can change
+    slot: width of the lsre rows, i.e. the maximal number of reactions
+          enabled at one site
+    selection: "composition-rejection" or "reaction" (cf. model_bins)
+    leaped: reactions the approximate leap mode fires in batch (cf.
+            leap_rates), first-order reactions that only change their own
+            site and never disable one another, () for none
+"""
+ModelSpec = namedtuple("ModelSpec", ["name", "Nr", "stencil", "slot", "selection", "leaped"], defaults=((),))
+
+
+def model_kernels(model, enabled_reactions, change_lattice, stencil_key):
+    """ return the kernels (scan, rescan_sites, update_lattice_configuration,
+        run_events, leap_reactions) of the ModelSpec model with its jit rules,
+        as the attributes of a new instance of kMC_Kernels (cf. its
+        docstring for the signatures of the rules)
+    """
+    kernels = module_instance(os.path.join(os.path.dirname(os.path.abspath(__file__)), "kMC_Kernels.py"),
+                              "kMC_Kernels_" + model.name)
+    kernels.enabled_reactions = enabled_reactions
+    kernels.change_lattice = change_lattice
+    kernels.stencil_key = stencil_key
+    kernels.SLOT = model.slot
+    kernels.HALF_LENGTH, kernels.HALF_WIDTH = model.stencil
+    kernels.LEAPED = np.array(model.leaped, dtype=np.int64)
+    return kernels
+
+
+def rate_bins(k):
+    """ group the reactions in power-of-2 rate bins for the composition-
+        rejection selection of the next reaction, return bins =
+        (BIN, KMAX, CLASSES) with
+        BIN[j] = bin of the reaction j, the rates of a bin are in
+                 [2^(e-1), 2^e) with e the exponent of frexp, hence within a
+                 factor 2 of KMAX (k/KMAX >= 1/2: a pair is accepted by
+                 select_event with probability at least 1/2), the bins are
+                 sorted by increasing e and the reactions of rate 0 are in
+                 the last bin
+        KMAX[g] = largest rate of the bin g
+        CLASSES[g] = reactions of the bin g by increasing index, padded with -1
+                     up to at least 2 columns (a single column marks the
+                     bins of reaction_bins, cf. select_event)
+    """
+    positive = k > 0
+    e = np.frexp(np.where(positive, k, 1))[1] # k in [2^(e-1), 2^e)
+    exponents = np.unique(e[positive])
+    G = len(exponents) + 1
+    BIN = np.where(positive, np.searchsorted(exponents, e), G-1)
+    KMAX = np.zeros(G)
+    np.maximum.at(KMAX, BIN, k)
+    size = np.bincount(BIN, minlength=G)
+    CLASSES = np.full((G, max(size.max(), 2)), -1, dtype=int)
+    for g in range(G):
+        CLASSES[g, :size[g]] = np.flatnonzero(BIN == g)
+    return (BIN, KMAX, CLASSES)
+
+
+def reaction_bins(k):
+    """ return the bins (BIN, KMAX, CLASSES) of one reaction each, the bin g
+        is the reaction g and its pair is always accepted by select_event
+    """
+    Nr = len(k)
+    return (np.arange(Nr), np.array(k, dtype=float), np.arange(Nr).reshape(Nr, 1))
+
+
+def model_bins(model, k):
+    """ return the rate bins of the rates k for the selection of the model """
+    if model.selection == "composition-rejection":
+        return rate_bins(k)
+    elif model.selection == "reaction":
+        return reaction_bins(k)
+    raise ValueError("unknown selection %r of the model %s" % (model.selection, model.name))
+
+
+@jit
+def add_enabled_site(ersl, bocc, occ, bins, reac, x):
+    """ add the pair (reac, x) at the end of the enabled pair array of the
+        rate bin of reac and return its position in this array, the array
+        capacity is doubled when it is full, a pair is stored as x*Nr + reac
+    """
+    BIN = bins[0]
+    g = BIN[reac]
+    n = bocc[g]
+    if n == len(ersl[g]):
+        ersl[g] = np.concatenate((ersl[g], np.zeros_like(ersl[g])))
+    ersl[g][n] = x*len(BIN) + reac
+    bocc[g] += 1
+    occ[reac] += 1
+    return n
+
+
+@jit
+def remove_enabled_site(ersl, bocc, occ, pos, lsre, bins, reac, x, p):
+    """ remove the pair (reac, x) found at the position p of the enabled
+        pair array of the rate bin of reac in O(1): the last pair of the
+        array takes its place and its position is updated in pos
+    """
+    BIN = bins[0]
+    Nr = len(BIN)
+    g = BIN[reac]
+    bocc[g] -= 1
+    occ[reac] -= 1
+    last = ersl[g][bocc[g]]
+    if last != x*Nr + reac:
+        ersl[g][p] = last
+        x_last = last//Nr ; reac_last = last%Nr
+        for s in range(lsre.shape[1]):
+            if lsre[x_last, s] == reac_last:
+                pos[x_last, s] = p
+    return (occ, ersl, pos)
+
+
+def build_event_lists(X, R, bins, Nbr_site, slot):
+    """ build occ, bocc, ersl, pos & lsre in one pass from the flat arrays
+        of the enabled pairs (site X[n], reaction R[n]): the pairs of a bin
+        are sorted by increasing site and reaction index and the rows of
+        lsre by increasing reaction index
+    """
+    order = np.lexsort((R, X))
+    events = X[order]*len(bins[0]) + R[order]
+    occ, bocc, ersl, pos, lsre = event_lists_from_pairs(events, bins, Nbr_site, slot)
+    return (occ, bocc, ersl, pos, lsre)
+
+
+def event_lists_from_pairs(events, bins, Nbr_site, slot):
+    """ build occ, bocc, ersl, pos & lsre from the enabled pairs events
+        (x*Nr + reac), they are grouped by rate bin keeping their order, so
+        that the concatenation of the bins of ersl is kept as it is
+    """
+    BIN, KMAX, CLASSES = bins
+    Nr = len(BIN)
+    if Nbr_site*Nr > np.iinfo(INDEX).max:
+        raise ValueError("%d sites x %d reactions overflow the event structures" % (Nbr_site, Nr))
+    X = events//Nr ; R = events%Nr
+    order = np.argsort(BIN[R], kind="stable")
+    events = events[order] ; X = X[order] ; R = R[order]
+
+    occ = np.bincount(R, minlength=Nr).astype(INDEX)
+    bocc = np.bincount(BIN[R], minlength=len(KMAX)).astype(INDEX)
+    start = np.cumsum(bocc) - bocc
+    rank = np.arange(len(events)) - start[BIN[R]]
+
+    arrays = []
+    for g in range(len(bocc)):
+        """ same capacity as the one reached by doubling from 16 """
+        size = 16
+        while size < bocc[g]:
+            size *= 2
+        e = np.zeros(size, dtype=INDEX)
+        e[:bocc[g]] = events[start[g]:start[g]+bocc[g]]
+        arrays.append(e)
+    ersl = new_list(arrays)
+
+    order = np.lexsort((R, X))
+    X = X[order] ; R = R[order] ; rank = rank[order]
+    slots = np.arange(len(X)) - np.searchsorted(X, X)
+    lsre = np.full((Nbr_site, slot), -1, dtype=np.int16)
+    pos = np.zeros((Nbr_site, slot), dtype=INDEX)
+    lsre[X, slots] = R
+    pos[X, slots] = rank
+    return (occ, bocc, ersl, pos, lsre)
+
+
+def enabled_pairs(lat, enabled, active):
+    """ concatenate the (site, reaction) pairs of the list of (mask, reaction)
+        enabled, where reaction is either an index or an array of the lattice
+        shape, restricted to the active sites
+    """
+    x = np.arange(lat.size).reshape(lat.shape)
+    X = np.concatenate([x[mask & active] for mask, reac in enabled])
+    R = np.concatenate([np.broadcast_to(reac, lat.shape)[mask & active] for mask, reac in enabled])
+    return (X, R.astype(int))
+
+
+@jit
+def site_changed(X, lsre_x, lsre):
+    """ sort the reactions lsre_x enabled at the site of flat index X and
+    return True if they differ from its lsre row (both are sorted), most
+    rescanned sites are unchanged and skip update_site
+
+    the few reactions of a site are sorted by insertion in place, which is
+    much cheaper than a call of list.sort on this hot path
+    """
+    n_x = len(lsre_x)
+    for s in range(1, n_x):
+        r = lsre_x[s]
+        i = s
+        while i > 0 and lsre_x[i-1] > r:
+            lsre_x[i] = lsre_x[i-1]
+            i -= 1
+        lsre_x[i] = r
+    if n_x < lsre.shape[1] and lsre[X, n_x] >= 0:
+        return True
+    for s in range(n_x):
+        if lsre[X, s] != lsre_x[s]:
+            return True
+    return False
+
+
+@jit
+def update_site(X, lsre_x, lsre, ersl, pos, occ, bocc, tree, k, bins, pos_x):
+    """ set the reactions enabled at the site of flat index X to the sorted
+    lsre_x and update the enable reaction site list (ersl + pos) + occurence
+    vectors (occ + bocc) + reactions enabled per site (lsre) and the sum tree
+    of the rates of the bins (tree), pos_x is a work array of slot entries
+    (cf. site_changed)
+    """
+    SLOT = lsre.shape[1]
+    n_x = len(lsre_x)
+
+    """ if reactions are not anymore enabled then revome them
+    """
+    for s in range(SLOT):
+        r = lsre[X, s]
+        if r >= 0 and r not in lsre_x:
+            remove_enabled_site(ersl, bocc, occ, pos, lsre, bins, r, X, pos[X, s])
+            update_rate_tree(tree, bins[0][r], bin_rate(k, occ, bins, bins[0][r]))
+
+    """ if reactions not already enabled then add them,
+    otherwise keep their position
+    """
+    for s in range(n_x):
+        r = lsre_x[s]
+        pos_x[s] = -1
+        for s_old in range(SLOT):
+            if lsre[X, s_old] == r:
+                pos_x[s] = pos[X, s_old]
+        if pos_x[s] < 0:
+            pos_x[s] = add_enabled_site(ersl, bocc, occ, bins, r, X)
+            update_rate_tree(tree, bins[0][r], bin_rate(k, occ, bins, bins[0][r]))
+
+    """ update the lsre row
+    """
+    for s in range(SLOT):
+        if s < n_x:
+            lsre[X, s] = lsre_x[s]
+            pos[X, s] = pos_x[s]
+        else:
+            lsre[X, s] = -1
+            pos[X, s] = 0
+
+
+@jit
+def scan_window(loc, geo, half_length, half_width):
+    """ return the flat indices of the scan region around the site of flat
+    index loc, row by row from (i-half_length, j-half_width): its size is
+    ( 2 half_width + 1 x 2 half_lenght + 1) and it is walked through the
+    geometry table geo (cf. kMC_Geometry)
+    """
+    window = np.empty((2*half_length+1)*(2*half_width+1), dtype=np.int64)
+    row = loc
+    for _ in range(half_length):
+        row = geo[DOWN, row]
+    for _ in range(half_width):
+        row = geo[WEST, row]
+    n = 0
+    for I0 in range(2*half_length+1):
+        X = row
+        for J0 in range(2*half_width+1):
+            window[n] = X
+            n += 1
+            X = geo[EAST, X]
+        row = geo[UP, row]
+    return window
+
+
+@jit
+def window_union(locs, geo, half_length, half_width, Nbr_site):
+    """ return the flat indices of the union of the scan regions of the
+    sites locs (cf. scan_window) in increasing order, e.g. to rescan once
+    the sites of a batch of reactions
+    """
+    marked = np.zeros(Nbr_site, dtype=np.bool_)
+    for loc in locs:
+        for X in scan_window(loc, geo, half_length, half_width):
+            marked[X] = True
+    return np.flatnonzero(marked)
+
+
+def memo_table(size, slot):
+    """ return an empty memo (keys, values) of the enabled reactions of the
+        stencil patterns of a model, direct-mapped on size entries (a prime,
+        cf. memo_slot): the entry memo_slot(key) holds the last pattern
+        mapped on it
+        keys[h] = key of the pattern of the entry h, -1 if it is empty
+        values[h] = its sorted enabled reactions padded with -1 up to slot
+        the memo only pays off in compiled kernels, the python backend gets
+        an empty memo (size 0, no lookup) as the rules cost no more there than
+        the lookup of their pattern
+    """
+    if BACKEND == "python":
+        size = 0
+    return (np.full(size, -1, dtype=np.int64), np.full((size, slot), -1, dtype=INDEX))
+
+
+@jit
+def memo_slot(memo, key):
+    """ return the entry of the memo of the key >= 0 of a stencil pattern:
+        key modulo the prime size of the memo, which mixes all the digits of
+        the key (the states of a lattice are few and close, a power-of-2 size
+        would map most patterns on a few entries)
+    """
+    return key % len(memo[0])
+
+
+@jit
+def memo_store(memo, h, key, lsre_x):
+    """ store the sorted reactions lsre_x of the pattern key in the entry h of
+        the memo, evicting the pattern it held
+    """
+    keys, values = memo
+    keys[h] = key
+    for s in range(values.shape[1]):
+        values[h, s] = lsre_x[s] if s < len(lsre_x) else -1
+
+
+@jit
+def memo_changed(X, values_h, lsre):
+    """ return True if the reactions values_h of a memo entry differ from the
+        lsre row of the site of flat index X (both are sorted and padded)
+    """
+    for s in range(lsre.shape[1]):
+        if lsre[X, s] != values_h[s]:
+            return True
+    return False
+
+
+def random_streams(SEED):
+    """ return the 5 independent random generators of the reaction, waiting
+        time, site, rejection and leap draws of a run, SEED is an int or
+        [entropy, spawn key...] (e.g. the n-th stream spawned from a root
+        seed is [root, n]), the streams are the same whatever the number of
+        them a model uses
+    """
+    if isinstance(SEED, (list, tuple)):
+        seq = np.random.SeedSequence(SEED[0], spawn_key=tuple(SEED[1:]))
+    else:
+        seq = np.random.SeedSequence(SEED)
+    return [np.random.Generator(np.random.PCG64(s)) for s in seq.spawn(5)]
+
+
+def spawn_seed(SEED, n):
+    """ return the seed of the n-th child stream of the seed SEED of a run
+        (e.g. the replica or domain n), cf. random_streams
+    """
+    return (list(SEED) if isinstance(SEED, list) else [SEED]) + [n]
+
+
+def draw_events(rngs, n_events):
+    """ return the random numbers of the next n_events events, u[n] =
+        (uniform of the reaction, standard exponential of the waiting time,
+        uniform of the site): each draw type has its own stream so the
+        trajectory does not depend on the number of events drawn at once
+    """
+    u = np.empty((n_events, 3))
+    u[:,0] = rngs[0].random(n_events)
+    u[:,1] = rngs[1].standard_exponential(n_events)
+    u[:,2] = rngs[2].random(n_events)
+    return u
+
+
+def leap_rates(model, k, tolerance):
+    """ return (tau_leap, k_exact) of the approximate leap mode of tolerance
+        > 0: the leaped reactions of the model are left out of the exact
+        selection (k_exact = 0) and fired together every tau_leap =
+        tolerance/(largest leaped rate), cf. kMC_Kernels.leap_reactions,
+        (np.inf, k) for the exact kMC (tolerance 0)
+    """
+    if tolerance <= 0:
+        return (np.inf, k)
+    if not model.leaped:
+        raise ValueError("the %s model has no leaped reaction" % model.name)
+    leaped = list(model.leaped)
+    k_exact = k.copy() ; k_exact[leaped] = 0
+    return (tolerance/k[leaped].max(), k_exact)
+
+
+def insert_leaps(reacs, sites, dt, leaps):
+    """ put the leaped events back in a block of events (reacs, sites, dt)
+        at their place, leaps = [(index of the next event of the block,
+        reactions, sites, gap from the previous event to the leap)...]:
+        the first event of a leap waits the gap, the next event of the block
+        waits it in addition for an empty leap, return (reacs, sites, dt)
+    """
+    leap_dt = []
+    for d, r, x, gap in leaps:
+        leap_dt.append(np.zeros(len(r)))
+        if len(r):
+            leap_dt[-1][0] = gap
+        else:
+            dt[d] += gap
+    at = np.concatenate([np.full(len(r), d) for d, r, x, gap in leaps])
+    reacs = np.insert(reacs, at, np.concatenate([r for d, r, x, gap in leaps]))
+    sites = np.insert(sites, at, np.concatenate([x for d, r, x, gap in leaps]))
+    dt = np.insert(dt, at, np.concatenate(leap_dt))
+    return (reacs, sites, dt)
+
+
+@jit
+def bin_rate(k, occ, bins, g):
+    """ return the total rate of the bin g, summed over its reactions in a
+        fixed order so that it only depends on occ (no drift)
+    """
+    CLASSES = bins[2]
+    rate = 0.
+    for c in range(len(CLASSES[g])):
+        j = CLASSES[g, c]
+        if j < 0:
+            break
+        rate += k[j]*occ[j]
+    return rate
+
+
+@jit
+def build_rate_tree(k, occ, bins):
+    """ build the binary sum tree of the total rates of the rate bins
+
+        the G leaves are stored at [P, P+G) with P the first power of 2
+        above G, each internal node n holds the sum of its children 2n and
+        2n+1, so the root tree[1] is the normalization factor C
+    """
+    G = len(bins[1])
+    P = 1
+    while P < G:
+        P *= 2
+    tree = np.zeros(2*P)
+    for g in range(G):
+        tree[P+g] = bin_rate(k, occ, bins, g)
+    for n in range(P-1, 0, -1):
+        tree[n] = tree[2*n] + tree[2*n+1]
+    return tree
+
+
+@jit
+def update_rate_tree(tree, reac, rate):
+    """ set the total rate of the leaf reac (a rate bin) and update its ancestors
+
+        each ancestor is resummed from its two children instead of being
+        shifted by the rate difference, hence C is always the exact sum of
+        the leaves and never drifts whatever the number of updates
+    """
+    n = len(tree)//2 + reac
+    tree[n] = rate
+    n //= 2
+    while n > 0:
+        tree[n] = tree[2*n] + tree[2*n+1]
+        n //= 2
+    return tree
+
+
+@jit
+def next_reaction_draw(tree, r):
+    """ select 1 rate bin at random by descending the sum tree in O(log G)
+        return the normalization factor & the bin of the next reaction
+    """
+    P = len(tree)//2
+    C = tree[1] # Normalizing factor
+    u = r*C
+    n = 1
+    while n < P:
+        """ go down to the child whose interval contains u,
+        an empty right child is never selected even with round-off errors
+        """
+        if u < tree[2*n] or tree[2*n+1] == 0:
+            n = 2*n
+        else:
+            u -= tree[2*n]
+            n = 2*n + 1
+    reac = n - P
+    return (C, reac)
+
+
+@jit
+def select_event(ersl, bocc, k, bins, g, v, rng):
+    """ composition-rejection selection of the next reaction in the rate
+        bin g: a pair (reaction, site) of the bin is drawn uniformly and
+        accepted with the probability k[reac]/KMAX[g] >= 1/2, so the
+        expected cost does not depend on the number of reactions
+
+        v is the uniform of the first trial, its fractional part on the
+        bocc[g] pairs is the acceptance uniform, the next trials are drawn
+        from rng, return (reac, loc)
+        with the bins of reaction_bins (a single column of CLASSES, the
+        "reaction" selection) the pair is accepted without test, as the
+        plain selection of a site of the reaction
+    """
+    BIN, KMAX, CLASSES = bins
+    Nr = len(BIN)
+    n = bocc[g]
+    if CLASSES.shape[1] == 1:
+        e = ersl[g][min(int(v*n), n-1)]
+        return (e%Nr, e//Nr)
+    while True:
+        w = v*n
+        i = min(int(w), n-1)
+        e = ersl[g][i]
+        reac = e%Nr
+        if (w - i)*KMAX[g] < k[reac]:
+            return (reac, e//Nr)
+        v = rng.random()
@@ -0,0 +1,125 @@
+"""
+Append-only binary log of the kMC events
+
+the log is a header followed by one fixed-width record per event
+    magic: 8 bytes, b"kMCLOG01"
+    size: length of the json header in bytes (uint64, little endian)
+    header: json of the run description (model, parameters, lattice shape)
+    records: EVENT_DTYPE = (reac int16, site int32, dt float64), packed
+
+the simulation loop only copies its block of events into a record array and
+puts it in a bounded queue, the records are written to disk by a background
+thread with a buffered file: the loop waits only when the disk is slower
+than the simulation for more than QUEUE_SIZE blocks
+
+read_event_log maps the records without loading them, so a log of 10^9
+events can be read by slices
+"""
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+MAGIC = b"kMCLOG01"
+EVENT_DTYPE = np.dtype([("reac", "<i2"), ("site", "<i4"), ("dt", "<f8")])
+QUEUE_SIZE = 8 # number of blocks of events waiting for the writer thread
+BUFFER_SIZE = 2**22 # size of the file buffer in bytes
+
+
+def write_records(f, blocks, error):
+    """ writer thread: write the record arrays of the queue blocks to the
+        file f until the sentinel None, the first exception is kept in error
+    """
+    while True:
+        records = blocks.get()
+        if records is None:
+            blocks.task_done()
+            break
+        if not error:
+            try:
+                f.write(records.tobytes())
+            except Exception as e:
+                error.append(e)
+        blocks.task_done()
+    try:
+        f.flush()
+    except Exception as e:
+        error.append(e)
+
+
+def open_event_log(path, header, tick=0):
+    """ open the event log path and start its writer thread, return the log
+        (f, blocks, thread, error) to give to log_events & close_event_log
+        a new log is created for tick = 0, otherwise the existing log of the
+        same run is truncated to its first tick events (resumed run)
+    """
+    data = json.dumps(header).encode()
+    if tick == 0:
+        f = open(path, "wb", buffering=BUFFER_SIZE)
+        f.write(MAGIC + np.uint64(len(data)).tobytes() + data)
+    else:
+        f = open(path, "r+b", buffering=BUFFER_SIZE)
+        start = len(MAGIC) + 8 + int(np.frombuffer(f.read(len(MAGIC) + 8)[len(MAGIC):], "<u8")[0])
+        end = start + tick*EVENT_DTYPE.itemsize
+        if os.path.getsize(path) < end:
+            f.close()
+            raise ValueError("the event log %s holds less than %d events" % (path, tick))
+        f.truncate(end)
+        f.seek(end)
+
+    blocks = queue.Queue(QUEUE_SIZE)
+    error = []
+    thread = threading.Thread(target=write_records, args=(f, blocks, error), daemon=True)
+    thread.start()
+    return (f, blocks, thread, error)
+
+
+def log_events(log, reacs, sites, dt):
+    """ queue the events (reacs[n], sites[n], dt[n]) to be written """
+    f, blocks, thread, error = log
+    if error:
+        raise error[0]
+    records = np.empty(len(dt), dtype=EVENT_DTYPE)
+    records["reac"] = reacs
+    records["site"] = sites
+    records["dt"] = dt
+    blocks.put(records)
+
+
+def flush_event_log(log):
+    """ wait for the queued events to be written and sync the file, e.g.
+        before a checkpoint so that the log holds every checkpointed event
+    """
+    f, blocks, thread, error = log
+    blocks.join()
+    if error:
+        raise error[0]
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def close_event_log(log):
+    """ write the queued events, stop the writer thread and close the file """
+    f, blocks, thread, error = log
+    blocks.put(None)
+    thread.join()
+    f.close()
+    if error:
+        raise error[0]
+
+
+def read_event_log(path):
+    """ return the header and the records of the event log path,
+        the records are a read-only memory map of EVENT_DTYPE
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a kMC event log" % path)
+        size = int(np.frombuffer(f.read(8), "<u8")[0])
+        header = json.loads(f.read(size).decode())
+    offset = len(MAGIC) + 8 + size
+    n = (os.path.getsize(path) - offset)//EVENT_DTYPE.itemsize
+    if n == 0:
+        return (header, np.zeros(0, dtype=EVENT_DTYPE))
+    return (header, np.memmap(path, dtype=EVENT_DTYPE, mode="r", offset=offset, shape=(n,)))
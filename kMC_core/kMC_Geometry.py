@@ -0,0 +1,104 @@
+"""
+Neighbor tables of the lattices of the models
+
+the sites of a lattice of l rows and L columns are stored flat, x = j + i*L,
+and their neighbors are read in the int32 table geo of lattice_geometry, so
+the kernels never compute a neighbor index (the MoTub lattices are closed by
+a seam, the motor flow lattice is periodic, i.e. START = 0). ngbr_s3 counts
+the tubulin neighbors of a site of the MoTub lattices through this table
+"""
+import numpy as np
+from kMC_core.kMC_Backend import jit
+
+UP = 0 ; DOWN = 1 
+LEFT1 = 2 ; LEFT2 = 3 ; RIGHT1 = 4 ; RIGHT2 = 5 
+WEST = 6 ; EAST = 7 
+LATERAL = (LEFT1, LEFT2, RIGHT1, RIGHT2)
+
+def lattice_geometry(l, L, START=3):
+    """ precompute the flat indices x = j+i*L of the neighbors of every site 
+        of a lattice of l dimers along L protofilaments closed by a seam, 
+        return the int32 array geo of shape (8, l*L) where 
+        geo[UP,x], geo[DOWN,x] = site above (i+1) & below (i-1) 
+        geo[LEFT1,x], geo[LEFT2,x] = the 2 lateral half-contacts on the left 
+        geo[RIGHT1,x], geo[RIGHT2,x] = the 2 lateral half-contacts on the right 
+        geo[WEST,x], geo[EAST,x] = sites (i,j-1) & (i,j+1) without seam shift, 
+                                   they span the scan window
+        
+        for a START-start helix the protofilaments 0 and L-1 are shifted by 
+        START/2 dimers across the seam: an odd START gives 2 half-contacts 
+        with 2 different dimers, otherwise both half-contacts are the same 
+        dimer as everywhere away from the seam (13_3, 14_3 and 12_3 
+        lattices: L = 13, 14 and 12 with START = 3), the 7 rows of the scan 
+        window cover the seam shift up to START = 5
+    """
+    i, j = np.divmod(np.arange(l*L), L)
+    shift = START//2 
+    half = START%2
+    
+    def flat(I, J): 
+        return (I%l)*L + J%L
+    
+    geo = np.zeros((8, l*L), dtype=np.int32)
+    geo[UP] = flat(i+1, j)
+    geo[DOWN] = flat(i-1, j)
+    geo[WEST] = flat(i, j-1)
+    geo[EAST] = flat(i, j+1)
+    geo[LEFT1] = np.where(j == 0, flat(i+shift, L-1), geo[WEST])
+    geo[LEFT2] = np.where(j == 0, flat(i+shift+half, L-1), geo[WEST])
+    geo[RIGHT1] = np.where(j == L-1, flat(i-shift, 0), geo[EAST])
+    geo[RIGHT2] = np.where(j == L-1, flat(i-shift-half, 0), geo[EAST])
+    return geo
+
+
+@jit
+def ngbr_s3(x, lat, geo, GTP): 
+    """ return the neighbor counts (a, at, b, bt) of the site of flat index x 
+        with plain lookups in the geometry table geo, lat being the flattened 
+        lattice (0 for a vacancy, the sign of a dimer is its nucleotide, 
+        negative for GTP), each lateral half-contact counts for 1 (2 for a 
+        whole lateral neighbor)
+        for GTP = True (the nucleotide of the site as read by the model) 
+        the GDP (a, b) & GTP (at, bt) neighbors are counted apart, otherwise 
+        every non-vacant neighbor counts in (a, b)
+    """
+    a = 0 ; at = 0 
+    b = 0 ; bt = 0 
+    for n in (UP, DOWN): 
+        v = lat[geo[n,x]]
+        if GTP: 
+            if v > 0: 
+                a += 1
+            elif v < 0: 
+                at += 1
+        elif v != 0: 
+            a += 1
+    for n in LATERAL: 
+        v = lat[geo[n,x]]
+        if GTP: 
+            if v > 0: 
+                b += 1
+            elif v < 0: 
+                bt += 1
+        elif v != 0: 
+            b += 1
+    return (a,at,b,bt)
+
+
+def ngbr_s3_lattice(lat, geo, GTP): 
+    """ whole lattice version of ngbr_s3: return the arrays (a, at, b, bt) 
+        of the neighbor counts of every site, GTP being the mask of the 
+        sites that count their GDP & GTP neighbors apart
+    """
+    flat = lat.reshape(-1)
+    a = np.zeros(lat.shape, dtype=int) ; at = np.zeros(lat.shape, dtype=int)
+    b = np.zeros(lat.shape, dtype=int) ; bt = np.zeros(lat.shape, dtype=int)
+    for n in (UP, DOWN): 
+        v = flat[geo[n]].reshape(lat.shape)
+        a += np.where(GTP, v > 0, v != 0)
+        at += GTP & (v < 0)
+    for n in LATERAL: 
+        v = flat[geo[n]].reshape(lat.shape)
+        b += np.where(GTP, v > 0, v != 0)
+        bt += GTP & (v < 0)
+    return (a, at, b, bt)
@@ -0,0 +1,174 @@
+"""
+Event loop of a model: scan, lattice update, event loop & leap mode
+
+the kernels are written once for every model around its rules, this file is
+not imported as such but loaded once per model by kMC_Engine.model_kernels,
+which sets the globals below: the jit functions of the rules and the
+constants of the ModelSpec of the model. numba compiles and caches every
+instance apart (cf. kMC_Backend.module_instance), so the rules are inlined
+in the kernels as if each model wrote its own copy of them
+
+    enabled_reactions(X, lat, geo, rules): list of the reactions enabled at
+        the site of flat index X
+    change_lattice(lat, reac, loc, rules): lattice change of the reaction
+        reac at the site of flat index loc (and of the trackers of the model)
+    stencil_key(X, lat, geo, rules): key >= 0 of the states the reactions of
+        the site X depend on, -1 for a site never memoised (cf. rescan_window)
+
+rules is the tuple of the parameters & trackers of the model, passed as is
+to its rules
+"""
+import numpy as np
+from kMC_core.kMC_Backend import jit
+from kMC_core.kMC_Engine import (site_changed, update_site, scan_window, window_union, memo_slot,
+    memo_store, memo_changed, next_reaction_draw, select_event)
+
+""" rules & ModelSpec of the model (cf. kMC_Engine.model_kernels) """
+enabled_reactions = None
+change_lattice = None
+stencil_key = None
+SLOT = 0 # width of the lsre rows
+HALF_LENGTH = 0 ; HALF_WIDTH = 0 # half sizes of the scan region
+LEAPED = np.zeros(0, dtype=np.int64) # reactions of the leap mode
+
+
+@jit
+def rescan_window(window, lsre, ersl, pos, occ, bocc, tree, k, bins, lat, geo, rules, memo):
+    """ test the reactions enabled at the sites of flat indices window and
+    update the event lists and the rate tree of the ones that changed (cf.
+    kMC_Engine.site_changed & update_site)
+
+    the enabled reactions of the stencil pattern of a site are looked up in
+    the memo (cf. kMC_Engine.memo_table), enabled_reactions is only called
+    for a pattern missing in the memo, which then stores it, or for a site
+    without pattern (a memo of size 0 for none). Most rescans are hits: a few
+    patterns (e.g. GDP-lattice without motor) make most of the lattice
+    """
+    pos_x = np.zeros(SLOT, dtype=pos.dtype)
+    keys, values = memo
+    for X in window:
+        key = -1 ; h = 0
+        if len(keys) > 0:
+            key = stencil_key(X, lat, geo, rules)
+        if key >= 0:
+            h = memo_slot(memo, key)
+            if keys[h] == key:
+                if memo_changed(X, values[h], lsre):
+                    n_x = 0
+                    while n_x < SLOT and values[h, n_x] >= 0:
+                        n_x += 1
+                    update_site(X, values[h, :n_x], lsre, ersl, pos, occ, bocc, tree, k, bins, pos_x)
+                continue
+        lsre_x = enabled_reactions(X, lat, geo, rules)
+        changed = site_changed(X, lsre_x, lsre)
+        if key >= 0:
+            memo_store(memo, h, key, lsre_x)
+        if changed:
+            update_site(X, lsre_x, lsre, ersl, pos, occ, bocc, tree, k, bins, pos_x)
+
+
+@jit
+def scan(lsre, ersl, pos, occ, bocc, tree, k, bins, loc, lat, geo, rules, memo):
+    """ scan the neighborhood around the location (i,j) of the new reaction site
+    given by its flat index loc = j+i*L
+    to update the enable reaction site list (ersl + pos) + occurence vectors
+    (occ + bocc) + reactions enabled per site (lsre) and the sum tree of the
+    rates of the bins (tree)
+
+    the scan region is the window of the stencil of the model, walked through
+    the geometry table geo (cf. kMC_Engine.scan_window)
+    """
+    rescan_window(scan_window(loc, geo, HALF_LENGTH, HALF_WIDTH), lsre, ersl, pos, occ, bocc, tree, k, bins,
+                  lat, geo, rules, memo)
+    return (occ, ersl, pos, lsre, tree)
+
+
+@jit
+def rescan_sites(lsre, ersl, pos, occ, bocc, tree, k, bins, locs, lat, geo, rules, memo):
+    """ rescan once every site of the union of the scan regions of the sites
+    locs (cf. scan), in increasing flat index, e.g. after a batch of reactions
+    """
+    rescan_window(window_union(locs, geo, HALF_LENGTH, HALF_WIDTH, lat.size), lsre, ersl, pos, occ, bocc, tree,
+                  k, bins, lat, geo, rules, memo)
+    return (occ, ersl, pos, lsre, tree)
+
+
+@jit
+def update_lattice_configuration(lat, geo, occ, bocc, ersl, pos, lsre, tree, k, bins, reac, loc, rules, memo):
+    """ change the lattice configuration with new reaction
+        and create corresponding event lists (ersl + occ + bocc + lsre) and rate tree
+    """
+    change_lattice(lat, reac, loc, rules)
+
+    """ create the new ersl + occ
+    """
+    occ, ersl, pos, lsre, tree = scan(lsre, ersl, pos, occ, bocc, tree, k, bins, loc, lat, geo, rules, memo)
+    return (lat, occ, ersl, pos, lsre, tree)
+
+
+@jit
+def run_events(lat, geo, occ, bocc, ersl, pos, lsre, tree, k, bins, u, reacs, sites, dt, t, t_stop, rng, rules, memo):
+    """ run one kMC event per row of the random numbers u (cf. draw_events)
+        the uniform u[n,0] selects the rate bin, the standard exponential
+        u[n,1] gives the waiting time u[n,1]/C and the uniform u[n,2] the
+        reaction & site among the pairs of the bin (select_event, its
+        rejected trials draw from rng, never drawn with one reaction per bin)
+        reacs[n], sites[n] and dt[n] are filled with the reaction, the flat
+        index of the site and the waiting time of the n-th event
+        the events stop before the first one occuring after the simulated
+        time t_stop (np.inf for no stop): the lattice is unchanged, so the
+        next call draws the same event from the same row of u
+        return the simulated time and the number of events done
+    """
+    for n in range(len(u)):
+        C, g = next_reaction_draw(tree, u[n,0])
+        tau = u[n,1]/C
+        if t + tau > t_stop:
+            return (t, n)
+        dt[n] = tau
+        t += dt[n] # Simulated time evolution
+        reac, loc = select_event(ersl, bocc, k, bins, g, u[n,2], rng)
+        reacs[n] = reac ; sites[n] = loc
+        update_lattice_configuration(lat, geo, occ, bocc, ersl, pos, lsre, tree, k, bins, reac, loc, rules, memo)
+    return (t, len(u))
+
+
+@jit
+def leap_reactions(lat, geo, occ, bocc, ersl, pos, lsre, tree, k_exact, bins, k, tau, rng, rules, memo):
+    """ fire at once the LEAPED reactions of a leap of time tau (approximate
+        mode): they are left out of the exact selection (k_exact = 0, so
+        their bins have a rate 0) and every enabled pair fires with the
+        probability 1 - exp(-k[reac]*tau) drawn from rng, in the order of the
+        bins, then the union of the regions of the fired sites is rescanned
+        once
+
+        a LEAPED reaction only changes its own site and never disables the
+        other LEAPED reactions of the site (cf. ModelSpec), so the batch does
+        not depend on the order of its reactions, return the fired (reacs, sites)
+    """
+    BIN = bins[0]
+    Nr = len(BIN)
+    leaped = np.zeros(Nr, dtype=np.bool_) ; leaped_bin = np.zeros(len(bocc), dtype=np.bool_)
+    for r in LEAPED:
+        leaped[r] = True ; leaped_bin[BIN[r]] = True
+    size = 0
+    for g in range(len(bocc)):
+        if leaped_bin[g]:
+            size += bocc[g]
+    p = -np.expm1(-k*tau)
+    reacs = np.zeros(size, dtype=np.int64) ; sites = np.zeros(size, dtype=np.int64)
+    n = 0
+    for g in range(len(bocc)):
+        if not leaped_bin[g]:
+            continue
+        for i in range(bocc[g]):
+            e = ersl[g][i]
+            reac = e%Nr
+            if leaped[reac]:
+                if rng.random() < p[reac]:
+                    reacs[n] = reac ; sites[n] = e//Nr
+                    n += 1
+    for i in range(n):
+        change_lattice(lat, reacs[i], sites[i], rules)
+    rescan_sites(lsre, ersl, pos, occ, bocc, tree, k_exact, bins, sites[:n], lat, geo, rules, memo)
+    return (reacs[:n], sites[:n])
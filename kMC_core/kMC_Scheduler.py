@@ -0,0 +1,46 @@
+"""
+Physical-time scheduler of the observers of a run
+
+an observer is called at the simulated times T = n*interval (n integer) with
+the state of the run at T, i.e. the lattice before the first event after T,
+so its samples are a uniform time series whatever the total rate
+
+the kMC kernel stops before the first event after next_time(scheduler),
+fire_observers then calls the observers due at that time: several events
+between two samples and several samples between two events (n = 0 event
+done until the next stop) are both handled, and the cost of the sampling
+scales with the simulated time, not with the number of events
+"""
+import math
+import numpy as np
+
+
+def new_scheduler(t, observers):
+    """ return the scheduler of the (interval, callback) observers for a run
+        at the simulated time t, callback(T, tick) is called at the times
+        T >= t, the scheduler is a list of [n, interval, callback]
+    """
+    scheduler = []
+    for interval, callback in observers:
+        n = int(math.floor(t/interval))
+        while n*interval < t:
+            n += 1
+        scheduler.append([n, interval, callback])
+    return scheduler
+
+
+def next_time(scheduler):
+    """ return the next sampling time of the scheduler (np.inf for none) """
+    return min([n*interval for n, interval, callback in scheduler], default=np.inf)
+
+
+def fire_observers(scheduler, tick):
+    """ call the observers due at next_time(scheduler) with the number of
+        events done tick and move them to their next time
+    """
+    T = next_time(scheduler)
+    for observer in scheduler:
+        n, interval, callback = observer
+        if n*interval == T:
+            callback(T, tick)
+            observer[0] = n + 1
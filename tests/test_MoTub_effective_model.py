@@ -0,0 +1,86 @@
+"""
+Checks of the effective MoTub model
+
+    the cache of the detachment tables follows a change of the tables
+    the interpolation of the tables gives the tabulated values at a
+    tabulated point, and is monotone in rho & linear in log(taur)
+
+kMC_Tabulation of the model only needs numpy, it is loaded from its file
+(the models share their module names)
+
+    python -m pytest tests
+"""
+import importlib.util
+import os
+import shutil
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL = os.path.join(ROOT, "MoTub_effective_model")
+
+
+def load_tabulation():
+    """ return a new instance of kMC_Tabulation of the model """
+    spec = importlib.util.spec_from_file_location("effective_tabulation", os.path.join(MODEL, "kMC_Tabulation.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def copy_tables(tab, directory):
+    """ copy the kinesin tables in directory and return them as {(taur, theta): path} """
+    for path in tab.table_files("kinesin").values():
+        shutil.copy(path, directory)
+    return tab.table_files("kinesin", str(directory))
+
+
+def test_cache_follows_tables(tmp_path):
+    """ a table changed in place with its modification time kept, then a
+        table removed, must rebuild the cache
+    """
+    tab = load_tabulation()
+    tables = copy_tables(tab, tmp_path)
+    path = tables[(0.1, 100.)]
+    cache = tab.load_cache("kinesin", str(tmp_path))
+    assert np.array_equal(cache[0, 1, 1:, 2:], np.loadtxt(path, ndmin=2))
+
+    stat = os.stat(path)
+    table = np.loadtxt(path, ndmin=2)
+    table[:, 1:] *= 0.5
+    np.savetxt(path, table)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    for load in (tab, load_tabulation()):
+        """ in the same process and in a new one """
+        cache = load.load_cache("kinesin", str(tmp_path))
+        assert np.array_equal(cache[0, 1, 1:, 2:], table)
+
+    os.remove(tables[(1.0, 100.)]) ; os.remove(tables[(1.0, 10.)])
+    assert tab.load_cache("kinesin", str(tmp_path)).shape[:2] == (1, 2)
+
+
+def test_interpolation(tmp_path):
+    """ exact at the tabulated points, between the tabulated rows in rho for a
+        monotone column, mean of the 2 tables at the geometric mean of their
+        taur, no motor at rho = 0, and out of the tabulated ranges an error
+    """
+    tab = load_tabulation()
+    tables = copy_tables(tab, tmp_path)
+    directory = str(tmp_path)
+    table = np.loadtxt(tables[(0.1, 100.)], ndmin=2)
+    for row in table[[0, 4, -1]]:
+        assert tab.detachment_probabilities("kinesin", row[0], 0.1, 100, directory) == tuple(row[1:])
+
+    rho = (table[3, 0] + table[4, 0])/2
+    c = np.array(tab.detachment_probabilities("kinesin", rho, 0.1, 100, directory))
+    assert np.all(np.minimum(table[3, 1:], table[4, 1:]) <= c) and np.all(c <= np.maximum(table[3, 1:], table[4, 1:]))
+
+    table_1 = np.loadtxt(tables[(1.0, 100.)], ndmin=2)
+    c = tab.detachment_probabilities("kinesin", table[4, 0], np.sqrt(0.1*1.0), 100, directory)
+    assert np.allclose(c, (table[4, 1:] + table_1[4, 1:])/2)
+
+    assert tab.detachment_probabilities("kinesin", 0, 0.1, 100, directory) == (1., 0., 1., 0.)
+    assert tab.lambda_coefficients("kinesin", 0, 0.1, 100, 1, directory) == (1, 1)
+    for rho, taur, theta in ((table[-1, 0] + 0.01, 0.1, 100), (0.05, 2.0, 100), (0.05, 0.1, 5)):
+        with pytest.raises(ValueError):
+            tab.detachment_probabilities("kinesin", rho, taur, theta, directory)
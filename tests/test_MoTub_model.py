@@ -0,0 +1,155 @@
+"""
+Checks of the features of the MoTub model
+
+    the replay of the event log at the last tick gives the final lattice
+    the snapshots of the lattice equal the replay at their times
+    the time series of the observables is sampled at the times n*interval
+    with the observables of the replay at these times
+    the sublattice parallel run equals the same cycles run one domain after
+    the other
+    a run in leap mode resumed from a checkpoint continues it exactly
+
+the scripts make a short run writing its outputs in the temporary directory
+of the test (cf. test_kMC_core)
+
+    python -m pytest tests
+"""
+from test_kMC_core import MODELS, run_script
+
+""" short run with the overrides, writing its outputs in directory """
+RUN = """
+    import json, os
+    import numpy as np
+    import kMC_main as main
+    directory = %r
+    P = main.load_parameters(overrides=%r + ["EVENT_LOG=" + json.dumps(os.path.join(directory, "events.log"))])
+    lat, t, tick = main.run(P)[:3]
+"""
+
+REPLAY = RUN + """
+    import kMC_Replay as replay
+    index = replay.build_keyframe_index(P["EVENT_LOG"], every=1000)
+    lat_t, tick_t = replay.lattice_at_time(index, t)
+    print(json.dumps({"tick": bool(np.array_equal(replay.lattice_at(index, tick), lat)),
+                      "time": bool(np.array_equal(lat_t, lat)) and tick_t == tick,
+                      "keyframe": float(index["times"][-1]) == float(t)}))
+"""
+
+
+def test_replay_final_lattice(tmp_path):
+    """ the replay of the 3000 events of a run gives its final lattice, at
+        its last tick and at its final time, and its keyframes end at its
+        simulated time
+    """
+    checks = run_script("MoTub_model", REPLAY % (str(tmp_path), MODELS["MoTub_model"]))
+    assert checks == {"tick": True, "time": True, "keyframe": True}
+
+
+SNAPSHOTS = RUN + """
+    import kMC_Replay as replay, kMC_Snapshot as snap
+    index = replay.build_keyframe_index(P["EVENT_LOG"], every=1000)
+    reader = snap.read_snapshot_store(P["SNAPSHOT_STORE"])
+    same = []
+    for i in range(len(reader["t"])):
+        lat_t, tick_t = replay.lattice_at_time(index, reader["t"][i])
+        same.append(bool(np.array_equal(snap.snapshot(reader, i), lat_t)) and tick_t == reader["tick"][i])
+    print(json.dumps({"snapshots": len(same), "same": all(same)}))
+"""
+
+
+def test_snapshots_match_replay(tmp_path):
+    """ every snapshot (one per 0.05 s) equals the lattice replayed from the
+        event log at its simulated time, with the same tick
+    """
+    overrides = MODELS["MoTub_model"] + ["SNAPSHOT_STORE=%s" % (tmp_path / "snapshots"), "SNAPSHOT_TIME=0.05"]
+    checks = run_script("MoTub_model", SNAPSHOTS % (str(tmp_path), overrides))
+    assert checks["snapshots"] > 5
+    assert checks["same"]
+
+
+OBSERVABLES = RUN + """
+    import kMC_Replay as replay, Tools as tl
+    index = replay.build_keyframe_index(P["EVENT_LOG"], every=1000)
+    series = np.load(P["OBSERVABLES_FILE"])
+    same = []
+    for row in series:
+        lat_t, tick_t = replay.lattice_at_time(index, row["t"])
+        expected = tl.observables_row(row["t"], tick_t, tl.observable_counts(lat_t), tl.protofilament_tips(lat_t))
+        same.append(all(np.array_equal(row[i], expected[i]) for i in range(len(expected))))
+    print(json.dumps({"t": series["t"].tolist(), "same": all(same)}))
+"""
+
+
+def test_observables_match_replay(tmp_path):
+    """ the observables are sampled every 0.04 s of simulated time up to the
+        end of the run, each row equals the observables of the lattice
+        replayed from the event log at its time
+    """
+    overrides = MODELS["MoTub_model"] + ["OBSERVABLES_FILE=%s" % (tmp_path / "observables.npy"),
+                                         "OBSERVABLES_TIME=0.04"]
+    checks = run_script("MoTub_model", OBSERVABLES % (str(tmp_path), overrides))
+    t = checks["t"]
+    assert len(t) > 5
+    assert t == [n*0.04 for n in range(len(t))]
+    assert checks["same"]
+
+
+PARALLEL = """
+    import json
+    import numpy as np
+    import kMC_Library as kMC, kMC_main as main, kMC_Parallel as par, Tools as tl
+    P = main.load_parameters(overrides=%r)
+    n_domains, t_max, cycle_time = 2, 0.05, 0.01
+    lat, t, n_events = par.run_parallel(P, n_domains, t_max, cycle_time)[:3]
+
+    lat0 = main.initial_lattice(P) ; ref = lat0.copy()
+    rows = par.domain_rows(ref.shape[0], n_domains)
+    n_cycles = int(np.ceil(2*t_max/cycle_time))
+    k = main.rate_constants(P) ; bins = kMC.model_bins(kMC.MODEL, k)
+    rngs = [kMC.random_streams(kMC.spawn_seed(P["SEED"], d)) for d in range(n_domains)]
+    events = 0
+    for half in par.sublattice_choices(P["SEED"], n_cycles):
+        for d in range(n_domains):
+            first, end = rows[d, half], rows[d, half + 1]
+            slab = ref[first-par.BELOW:end+par.ABOVE].copy()
+            geo = tl.lattice_geometry(len(slab), ref.shape[1], P["SEAM_START"])
+            events += par.run_cycle(slab, geo, k, bins, rngs[d], cycle_time, P["DIRECTIONALITY"])
+            ref[first-par.REACH:end+par.REACH] = slab[par.BELOW-par.REACH:par.BELOW+end-first+par.REACH]
+    print(json.dumps({"events": int(n_events), "same_events": int(n_events) == events,
+                      "same": bool(np.array_equal(lat, ref)), "changed": not np.array_equal(lat, lat0)}))
+"""
+
+
+def test_parallel_matches_sequential():
+    """ 2 worker processes give the lattice and the number of events of the
+        same cycles and halves run sequentially with the streams of the
+        workers: the rows a worker copies are never written by another one
+    """
+    checks = run_script("MoTub_model", PARALLEL % MODELS["MoTub_model"])
+    assert checks.pop("events") > 0
+    assert checks == {"same_events": True, "same": True, "changed": True}
+
+
+LEAP_RESUME = """
+    import json, os
+    import numpy as np
+    import kMC_main as main
+    P = main.load_parameters(overrides=%r)
+    path = os.path.join(%r, "run.npz")
+    lat, t, tick = main.run(P)[:3]
+    main.run(dict(P, TICK_MAX=P["TICK_MAX"]//2, CHECKPOINT_FILE=path))
+    lat_r, t_r, tick_r = main.run(P, resume=path)[:3]
+    print(json.dumps({"leaped": int(tick) - P["TICK_MAX"], "lattice": bool(np.array_equal(lat, lat_r)),
+                      "t": float(t) == float(t_r), "tick": int(tick) == int(tick_r)}))
+"""
+
+
+def test_leap_resume_exact(tmp_path):
+    """ with LEAP_TOLERANCE > 0, a run stopped at half its loops and resumed
+        from its checkpoint ends with the lattice, the time and the tick of
+        the same run done at once
+    """
+    overrides = MODELS["MoTub_model"] + ["LEAP_TOLERANCE=0.05"]
+    checks = run_script("MoTub_model", LEAP_RESUME % (overrides, str(tmp_path)))
+    assert checks.pop("leaped") > 0
+    assert checks == {"lattice": True, "t": True, "tick": True}
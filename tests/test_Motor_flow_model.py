@@ -0,0 +1,38 @@
+"""
+Checks of the motor flow model
+
+    the tabulation reproduces a row of the tables shipped with the effective
+    model within its error bars
+
+the tabulation runs with the numba backend (a short run of the flow is still
+millions of events)
+
+    python -m pytest tests
+"""
+import os
+import numpy as np
+import pytest
+from test_kMC_core import ROOT, run_script
+
+TABULATION = """
+    import json
+    import kMC_Tabulation as tab, kMC_main as main
+    P = main.load_parameters(overrides=["kw=%r" % tab.MOTORS["kinesin"], "theta=100", "rho=0.05"])
+    row, error, n_batches = tab.measure_density(P, 0.1, tol=1, batch_time=5)
+    print(json.dumps({"row": row.tolist(), "error": error.tolist(), "name": tab.tabulation_name("kinesin", 0.1, 100)}))
+"""
+
+
+def test_tabulation_matches_table():
+    """ the D columns of kinesin, taur 0.1, theta 100, rho 0.05 within 4
+        standard errors (+ the rounding of the table), the ND columns of the
+        shipped tables are averaged over the first seconds of the flow and
+        not in its steady state (cf. kMC_Tabulation)
+    """
+    pytest.importorskip("numba")
+    out = run_script("Motor_flow_model", TABULATION, "numba")
+    table = np.loadtxt(os.path.join(ROOT, "MoTub_effective_model", out["name"]), ndmin=2)
+    shipped = table[np.isclose(table[:, 0], 0.05)][0]
+    row = np.array(out["row"]) ; error = np.array(out["error"])
+    assert row[0] == shipped[0]
+    assert np.all(np.abs(row[3:] - shipped[3:]) <= 4*error[2:] + 5e-5)
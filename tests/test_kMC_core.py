@@ -0,0 +1,154 @@
+"""
+Checks of the shared kMC engine (kMC_core) on the three models
+
+    the numba & pure Python backends give the same trajectory
+    the event lists & rate tree updated event by event equal the ones built
+    from scratch on the final lattice
+    a resumed MoTub checkpoint continues the run exactly
+    the cached numba kernels of a model follow a change of the engine
+
+the scripts of a model are run in its directory by a subprocess, the models
+share their module names and the backend is chosen once at the import
+(KMC_BACKEND). The checks run with KMC_BACKEND=python, the numba backend is
+only needed for the comparison of the backends
+
+    python -m pytest tests
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+""" short runs of the models: directory, overrides of the parameters """
+MODELS = {
+    "MoTub_model": ["TICK_MAX=3000", "MOTOR_DENSITY=0.1"],
+    "MoTub_effective_model": ["TICK_MAX=3000", "rho=0.1"],
+    "Motor_flow_model": ["TICK_MAX=3000"],
+}
+
+""" call of initialize_eventlist of each model from the arguments of its last
+    run_events call (lat, geo, occ, bocc, ersl, pos, lsre, tree, k, bins, u,
+    reacs, sites, dt, t, t_stop, rng, rules, memo)
+"""
+REBUILD = {
+    "MoTub_model": "kMC.initialize_eventlist(lat, geo, bins, extra[0][0])", # extra = (DIRECTIONALITY, counts, tips), memo
+    "MoTub_effective_model": "kMC.initialize_eventlist(lat, geo, bins, extra[0][0], extra[0][1])", # extra = (KOFF, DIRECTIONALITY), memo
+    "Motor_flow_model": "kMC.initialize_eventlist(lat, bins)",
+}
+
+
+def run_script(model, script, backend="python", root=ROOT):
+    """ run the python script in the directory of the model (in the
+        repository root) with the backend and return the json it prints on
+        its last line
+    """
+    env = dict(os.environ, KMC_BACKEND=backend)
+    env.pop("NUMBA_CACHE_DIR", None)
+    out = subprocess.run([sys.executable, "-c", textwrap.dedent(script)], cwd=os.path.join(root, model),
+                         env=env, capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+RUN = """
+    import hashlib, json
+    import numpy as np
+    import kMC_Backend, kMC_main as main
+    lat, t, tick = main.run(main.load_parameters(overrides=%r))[:3]
+    print(json.dumps({"backend": kMC_Backend.BACKEND, "t": float(t), "tick": int(tick),
+                      "lattice": hashlib.md5(np.ascontiguousarray(lat, dtype=np.int8).tobytes()).hexdigest()}))
+"""
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_backends_identical(model):
+    pytest.importorskip("numba")
+    python = run_script(model, RUN % MODELS[model], "python")
+    numba = run_script(model, RUN % MODELS[model], "numba")
+    assert (python["backend"], numba["backend"]) == ("python", "numba")
+    assert python["tick"] == numba["tick"] > 0
+    assert python["t"] == numba["t"]
+    assert python["lattice"] == numba["lattice"]
+
+
+INCREMENTAL = """
+    import json
+    import numpy as np
+    import kMC_Library as kMC, kMC_main as main
+    calls = []
+    run_events = kMC.run_events
+    def recorded(*args):
+        calls.append(args)
+        return run_events(*args)
+    kMC.run_events = recorded
+    main.run(main.load_parameters(overrides=%r))
+    lat, geo, occ, bocc, ersl, pos, lsre, tree, k, bins = calls[-1][:10]
+    extra = calls[-1][17:]
+    occ0, bocc0, ersl0, pos0, lsre0 = %s
+    tree0 = kMC.build_rate_tree(k, occ0, bins)
+
+    BIN = bins[0] ; Nr = len(BIN)
+    X, S = np.nonzero(lsre >= 0)
+    R = lsre[X, S]
+    located = all(ersl[BIN[r]][pos[x, s]] == x*Nr + r for x, s, r in zip(X, S, R))
+    pairs = all(sorted(ersl[g][:bocc[g]]) == sorted(ersl0[g][:bocc0[g]]) for g in range(len(bocc)))
+    print(json.dumps({"events": int(sum(len(c[11]) for c in calls)),
+                      "occ": bool(np.array_equal(occ, occ0)), "bocc": bool(np.array_equal(bocc, bocc0)),
+                      "lsre": bool(np.array_equal(lsre, lsre0)), "tree": bool(np.array_equal(tree, tree0)),
+                      "pos": bool(located), "ersl": bool(pairs)}))
+"""
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_event_lists_match_rebuild(model):
+    checks = run_script(model, INCREMENTAL % (MODELS[model], REBUILD[model]))
+    assert checks.pop("events") > 0
+    assert checks == dict.fromkeys(checks, True)
+
+
+RESUME = """
+    import json, os, tempfile
+    import numpy as np
+    import kMC_main as main
+    overrides = %r
+    P = main.load_parameters(overrides=overrides)
+    lat, t, tick = main.run(P)[:3]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "run.npz")
+        main.run(dict(P, TICK_MAX=P["TICK_MAX"]//2, CHECKPOINT_FILE=path))
+        lat_r, t_r, tick_r = main.run(dict(P, CHECKPOINT_FILE=None), resume=path)[:3]
+    print(json.dumps({"lattice": bool(np.array_equal(lat, lat_r)), "t": float(t) == float(t_r),
+                      "tick": int(tick) == int(tick_r)}))
+"""
+
+
+def test_resume_exact():
+    checks = run_script("MoTub_model", RESUME % MODELS["MoTub_model"])
+    assert checks == {"lattice": True, "t": True, "tick": True}
+
+
+def test_cache_follows_engine_source(tmp_path):
+    """ the kernels of the model inline next_reaction_draw of kMC_core: after
+        a change of it, the cached numba run must follow the python backend
+    """
+    pytest.importorskip("numba")
+    model = "Motor_flow_model"
+    for directory in ("kMC_core", model):
+        shutil.copytree(os.path.join(ROOT, directory), tmp_path / directory,
+                        ignore=shutil.ignore_patterns("__pycache__"))
+    script = RUN % MODELS[model]
+    before = run_script(model, script, "numba", tmp_path)
+
+    engine = tmp_path / "kMC_core" / "kMC_Engine.py"
+    source = engine.read_text()
+    assert source.count("    u = r*C\n") == 1
+    engine.write_text(source.replace("    u = r*C\n", "    u = r*C*0.5\n"))
+    after = run_script(model, script, "numba", tmp_path)
+    python = run_script(model, script, "python", tmp_path)
+    assert after == dict(python, backend="numba")
+    assert after["lattice"] != before["lattice"]